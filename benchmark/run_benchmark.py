@@ -0,0 +1,323 @@
+# -*- coding: utf-8 -*-
+# Author: Nianze A. TAO (omozawa SUENO)
+"""
+Benchmark the generation pipeline with a small randomly initialised model.
+
+Usage: `python benchmark/run_benchmark.py -o benchmark.json`
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import statistics
+from pathlib import Path
+from typing import Dict, List, Callable, Any
+import torch
+import rdkit
+from bayesianflow_for_chem import ChemBFN
+
+sys.path.append(str(Path(__file__).parent.parent))
+from chembfn_webui.lib.cache import model_cache, load_model
+from chembfn_webui.lib.pipeline import build_tokeniser, build_input
+from chembfn_webui.lib.scheduler import run_model
+from chembfn_webui.lib.postprocess import build_records, Renderer, ChemfigConverter
+from chembfn_webui.lib.version import __version__
+
+# molecules used to benchmark post-processing, since a random model generates invalid strings
+MOLECULES = [
+    "CC(=O)Oc1ccccc1C(=O)O",
+    "CN1C=NC2=C1C(=O)N(C(=O)N2C)C",
+    "CC(C)Cc1ccc(cc1)C(C)C(=O)O",
+    "CC(=O)Nc1ccc(O)cc1",
+    "OC[C@H]1OC(O)[C@H](O)[C@@H](O)[C@@H]1O",
+    "c1ccc2c(c1)ccc1ccccc12",
+    "CCN(CC)CCOC(=O)c1ccc(N)cc1",
+    "COc1ccc2[nH]cc(CCNC(C)=O)c2c1",
+    "OC(=O)c1ccccc1O",
+    "CC1=C(C(=O)OC2CCCC2)C(c2ccccc2[N+](=O)[O-])C(C(=O)OC)=C1C",
+    "C1CN(CCN1)C(c1ccccc1)c1ccc(Cl)cc1",
+    "CN1CCC[C@H]1c1cccnc1",
+]
+SCAFFOLD = "c1ccccc1"
+TEMPLATE = "CC(=O)Oc1ccccc1C(=O)O"
+VOCAB_KEYS, TOKENISER = build_tokeniser("SMILES & SAFE", None, {})
+
+
+def _measure(fn: Callable[[], Any], repeat: int, warmup: int = 1) -> Dict[str, Any]:
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return {
+        "times": times,
+        "median": statistics.median(times),
+        "min": min(times),
+    }
+
+
+def _unique_molecules(n: int) -> List[str]:
+    # lengthen the molecules with carbon chains to get as many different ones as needed
+    return [
+        f"{'C' * (i // len(MOLECULES))}{MOLECULES[i % len(MOLECULES)]}"
+        for i in range(n)
+    ]
+
+
+def environment() -> Dict[str, Any]:
+    """
+    Describe the environment that the results depend on.
+
+    :return: versions and hardware
+    :rtype: dict
+    """
+    return {
+        "chembfn_webui": __version__,
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "rdkit": rdkit.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor() or platform.machine(),
+        "cpu_count": os.cpu_count(),
+        "threads": torch.get_num_threads(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def bench_loading(ckpt: Path, repeat: int) -> List[Dict[str, Any]]:
+    """
+    Time loading the model from disk and from the resident cache.
+
+    :param ckpt: checkpoint file
+    :param repeat: number of timed runs
+    :type ckpt: pathlib.Path
+    :type repeat: int
+    :return: results
+    :rtype: list
+    """
+
+    def _cold() -> None:
+        model_cache.clear()
+        load_model(ckpt)
+
+    results = [
+        {"name": "load_model", "params": {"cache": "cold"}} | _measure(_cold, repeat)
+    ]
+    load_model(ckpt)
+    results.append(
+        {"name": "load_model", "params": {"cache": "warm"}}
+        | _measure(lambda: load_model(ckpt), repeat)
+    )
+    model_cache.clear()
+    return results
+
+
+def bench_generation(
+    model: ChemBFN,
+    modes: List[str],
+    batch_sizes: List[int],
+    steps: List[int],
+    lengths: List[int],
+    methods: List[str],
+    repeat: int,
+) -> List[Dict[str, Any]]:
+    """
+    Time sampling, inpainting and optimisation over a grid of settings.
+
+    :param model: ChemBFN model
+    :param modes: generation modes
+    :param batch_sizes: batch sizes
+    :param steps: numbers of sampling steps
+    :param lengths: sequence lengths
+    :param methods: sampling methods, e.g., `"bfn"` or `"ode:0.5"`
+    :param repeat: number of timed runs of each setting
+    :type model: bayesianflow_for_chem.model.ChemBFN
+    :type modes: list
+    :type batch_sizes: list
+    :type steps: list
+    :type lengths: list
+    :type methods: list
+    :type repeat: int
+    :return: results
+    :rtype: list
+    """
+    results = []
+    for mode in modes:
+        for method in methods:
+            for length in lengths:
+                for step in steps:
+                    for batch_size in batch_sizes:
+                        if mode == "sample":
+                            x = (batch_size, length)
+                        else:
+                            scaffold = SCAFFOLD if mode == "inpaint" else ""
+                            _, x, _ = build_input(scaffold, TEMPLATE, TOKENISER, length)
+                            x = x.repeat(batch_size, 1)
+                        fn = lambda: run_model(
+                            model, mode, x, step, None, 0, VOCAB_KEYS, method, "all"
+                        )
+                        result = _measure(fn, repeat)
+                        result["samples_per_s"] = batch_size / result["median"]
+                        params = {
+                            "mode": mode,
+                            "method": method,
+                            "sequence_length": length,
+                            "step": step,
+                            "batch_size": batch_size,
+                        }
+                        results.append({"name": "generate", "params": params} | result)
+                        print(
+                            f"{mode:>8} {method:>7} length={length:<4} step={step:<4} "
+                            f"batch={batch_size:<5} {result['samples_per_s']:10.1f} samples/s",
+                            file=sys.stderr,
+                        )
+    return results
+
+
+def bench_postprocess(
+    n_molecules: int, n_images: int, workdir: Path, repeat: int
+) -> List[Dict[str, Any]]:
+    """
+    Time RDKit parsing, image rendering and Chemfig conversion.
+    Rendering and conversion start from empty caches in every run.
+
+    :param n_molecules: number of molecules parsed by RDKit
+    :param n_images: number of different molecules drawn and converted to Chemfig
+    :param workdir: folder of the caches
+    :param repeat: number of timed runs
+    :type n_molecules: int
+    :type n_images: int
+    :type workdir: pathlib.Path
+    :type repeat: int
+    :return: results
+    :rtype: list
+    """
+    strings = (MOLECULES * (n_molecules // len(MOLECULES) + 1))[:n_molecules]
+    entropy = [0.0] * n_molecules
+    results = []
+    result = _measure(lambda: build_records(strings, entropy, "SMILES & SAFE"), repeat)
+    result["molecules_per_s"] = n_molecules / result["median"]
+    results.append({"name": "rdkit", "params": {"molecules": n_molecules}} | result)
+    # different molecules so that the image and Chemfig caches do not hide the work
+    records = build_records(
+        _unique_molecules(n_images), [0.0] * n_images, "SMILES & SAFE"
+    )
+    image_dir = workdir / "images"
+    for workers in sorted({1, Renderer().workers}):
+        renderer = Renderer(image_dir, workers=workers)
+
+        def _render() -> None:
+            shutil.rmtree(image_dir, ignore_errors=True)
+            renderer.render(records)
+
+        result = _measure(_render, repeat)
+        renderer.shutdown()
+        result["molecules_per_s"] = len(records) / result["median"]
+        params = {"molecules": len(records), "workers": renderer.workers}
+        results.append({"name": "render", "params": params} | result)
+    smiles = [i.smiles for i in records]
+    converter = ChemfigConverter(workdir / "chemfig.jsonl")
+
+    def _convert() -> None:
+        converter.cache_file.unlink(missing_ok=True)
+        converter._cache = None  # forget the molecules converted in the last run
+        for _ in converter.convert(smiles):
+            pass
+
+    result = _measure(_convert, repeat)
+    converter.shutdown()
+    result["molecules_per_s"] = len(smiles) / result["median"]
+    params = {"molecules": len(smiles), "workers": converter.workers}
+    results.append({"name": "chemfig", "params": params} | result)
+    return results
+
+
+def main() -> None:
+    """
+    Run the benchmarks and write the results in JSON format.
+
+    :return:
+    :rtype: None
+    """
+    parser = argparse.ArgumentParser(
+        description="Benchmark the generation pipeline of ChemBFN WebUI "
+        "with a randomly initialised model.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "-o", "--output", type=Path, help="JSON file; default is stdout"
+    )
+    parser.add_argument("--repeat", default=3, type=int, help="timed runs of each case")
+    parser.add_argument("--channel", default=256, type=int, help="model width")
+    parser.add_argument("--layers", default=4, type=int, help="number of model layers")
+    parser.add_argument(
+        "--heads", default=8, type=int, help="number of attention heads"
+    )
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        default=["sample", "inpaint", "optimise"],
+        choices=["sample", "inpaint", "optimise"],
+    )
+    parser.add_argument("--batch_sizes", nargs="+", type=int, default=[1, 32, 128])
+    parser.add_argument("--steps", nargs="+", type=int, default=[10, 100])
+    parser.add_argument("--lengths", nargs="+", type=int, default=[32, 64])
+    parser.add_argument("--methods", nargs="+", default=["bfn", "ode:0.5"])
+    parser.add_argument(
+        "--molecules", default=1000, type=int, help="molecules parsed by RDKit"
+    )
+    parser.add_argument(
+        "--images",
+        default=64,
+        type=int,
+        help="molecules drawn and converted to Chemfig",
+    )
+    parser.add_argument("--threads", type=int, help="number of PyTorch threads")
+    parser.add_argument(
+        "--quick",
+        default=False,
+        action="store_true",
+        help="run a small grid (batch size 8, 10 steps, length 32, BFN sampling)",
+    )
+    parser.add_argument("--seed", default=0, type=int)
+    args = parser.parse_args()
+    if args.quick:
+        args.batch_sizes, args.steps, args.lengths = [8], [10], [32]
+        args.methods, args.repeat, args.molecules, args.images = ["bfn"], 1, 100, 16
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    torch.manual_seed(args.seed)
+    report = {"environment": environment(), "settings": vars(args) | {"output": None}}
+    with tempfile.TemporaryDirectory() as workdir:
+        workdir = Path(workdir)
+        model = ChemBFN(len(VOCAB_KEYS), args.channel, args.layers, args.heads)
+        ckpt = workdir / "model.pt"
+        torch.save({"nn": model.state_dict(), "hparam": model.hparam}, ckpt)
+        results = bench_loading(ckpt, args.repeat)
+        model = load_model(ckpt)
+        results += bench_generation(
+            model,
+            args.modes,
+            args.batch_sizes,
+            args.steps,
+            args.lengths,
+            args.methods,
+            args.repeat,
+        )
+        results += bench_postprocess(args.molecules, args.images, workdir, args.repeat)
+    report["results"] = results
+    if args.output is None:
+        print(json.dumps(report, indent=2))
+    else:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
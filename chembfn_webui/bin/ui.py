@@ -0,0 +1,1127 @@
+# -*- coding: utf-8 -*-
+# Author: Nianze A. TAO (omozawa SUENO)
+"""
+Build the web-UI.
+"""
+import time
+import argparse
+import itertools
+from pathlib import Path
+from copy import deepcopy
+from functools import partial
+from typing import (
+    Dict,
+    Tuple,
+    List,
+    Optional,
+    Union,
+    Literal,
+    Generator,
+)
+import torch
+import gradio as gr
+from lib.utilities import (
+    sys_info,
+    find_model,
+    find_vocab,
+    parse_prompt,
+    parse_objective_sweep,
+    parse_guidance_sweep,
+    parse_input_list,
+    parse_exclude_token,
+    parse_sar_control,
+    parse_length_buckets,
+    build_result_prep_fn,
+    MAX_SWEEP_SIZE,
+)
+from lib.pipeline import build_tokeniser, build_model, build_input
+from lib.scheduler import (
+    scheduler,
+    generate,
+    plan_chunks,
+    length_stats,
+)
+from lib.shard import ModelSpec, ShardPool
+from lib.postprocess import Record, build_records, renderer, chemfig_converter
+from lib.export import ResultWriter
+from lib.novelty import NoveltyIndex, record_key, deduplicate
+from lib.runtime import configure_torch, thread_budget
+
+# found when the web-UI is built (see `build_app()`) and at each refresh
+vocabs: Dict[str, str] = {}
+models: Dict[str, List[List[Union[str, int, List[str], Path]]]] = {}
+cache_dir = Path(__file__).parent.parent / "cache"
+favicon_dir = Path(__file__).parent / "favicon.png"
+_STREAM_CHUNK_SIZE = 64
+_RESULT_FORMAT = "csv"
+_GALLERY_PAGE_SIZE = 16
+_CHEMFIG_UPDATE_INTERVAL = 0.5  # in seconds
+_SHARD_POOL: Optional[ShardPool] = None
+_NOVELTY_INDEX: Optional[NoveltyIndex] = None
+_NOVELTY_KEY = "smiles"
+
+HTML_STYLE = gr.InputHTMLAttributes(
+    autocapitalize="off",
+    autocorrect="off",
+    spellcheck=False,
+    autocomplete="off",
+    lang="en",
+)
+
+
+def _refresh(
+    model_selected: str, vocab_selected: str, tokeniser_selected: str
+) -> Tuple[
+    List[str], List[str], List[List[str]], List[List[str]], gr.Dropdown, gr.Dropdown
+]:
+    """
+    Refresh model file list.
+
+    :param model_selected: the selected model name
+    :param vocab_selected: the selected vocabulary name
+    :param tokeniser_selected: the selected tokeniser name
+    :type model_selected: str
+    :type vocab_selected: str
+    :type tokeniser_selected: str
+    :return: a list of vocabulary names \n
+             a list of base model files \n
+             a list of standalone model files \n
+             a list of LoRA model files \n
+             Gradio Dropdown item \n
+             Gradio Dropdown item \n
+    :rtype: tuple
+    """
+    global vocabs, models
+    vocabs = find_vocab()
+    models = find_model()
+    a = list(vocabs.keys())
+    b = [i[0] for i in models["base"]]
+    c = [[i[0], i[2]] for i in models["standalone"]]
+    d = [[i[0], i[2]] for i in models["lora"]]
+    e = gr.Dropdown(
+        [i[0] for i in models["base"]] + [i[0] for i in models["standalone"]],
+        value=model_selected,
+        label="model",
+        filterable=False,
+    )
+    f = gr.Dropdown(
+        list(vocabs.keys()),
+        value=vocab_selected,
+        label="vocabulary",
+        visible=tokeniser_selected == "SELFIES",
+        filterable=False,
+    )
+    return a, b, c, d, e, f
+
+
+def _select_lora(evt: gr.SelectData, prompt: str) -> str:
+    """
+    Select LoRA model name from Dataframe object.
+
+    :param evt: `~gradio.SelectData` instance
+    :param prompt: prompt string
+    :type evt: gradio.SelectData
+    :type prompt: str
+    :return: new prompt string
+    :rtype: str
+    """
+    selected_lora = evt.value
+    exist_lora = parse_prompt(prompt)["lora"]
+    if evt.index[1] != 0 or selected_lora in exist_lora:
+        return prompt
+    if not prompt:
+        return f"<{selected_lora}:1>"
+    return f"{prompt};\n<{selected_lora}:1>"
+
+
+def _token_name_change_evt(
+    token_name: str, vocab_fn: str
+) -> Tuple[gr.Dropdown, gr.Tab, gr.Tab]:
+    """
+    Define token_name-dropdown item change event.
+
+    :param token_name: tokeniser name
+    :param vocab_fn: customised vocabulary name
+    :type token_name: str
+    :type vocab_fn: str
+    :return: Dropdown item \n
+             Tab item \n
+             Tab item \n
+    :rtype: tuple
+    """
+    a = gr.Dropdown(
+        list(vocabs.keys()),
+        value=vocab_fn,
+        label="vocabulary",
+        visible=token_name == "SELFIES",
+        filterable=False,
+    )
+    b = gr.Tab(label="LATEX Chemfig", visible=token_name != "FASTA")
+    c = gr.Tab(label="gallery", visible=token_name != "FASTA")
+    return a, b, c
+
+
+def _result_table(
+    records: List[Record],
+    labels: Optional[List[List[str]]] = None,
+    names: Tuple[str, ...] = (),
+) -> gr.Dataframe:
+    """
+    Show the generated molecules, next to the labels of their groups if given.
+
+    :param records: records of generated molecules
+    :param labels: labels (e.g., scaffold and objective values) of each record
+    :param names: names of the labels
+    :type records: list
+    :type labels: list | None
+    :type names: tuple
+    :return: Dataframe item
+    :rtype: gradio.Dataframe
+    """
+    if labels is None:
+        labels = [[] for _ in records]
+    return gr.Dataframe(
+        [i + [j.string] for i, j in zip(labels, records)],
+        headers=list(names) + ["molecule"],
+        column_count=(len(names) + 1, "fixed"),
+    )
+
+
+def _select_conditions(
+    y: Optional[Union[torch.Tensor, List[torch.Tensor]]], idx: List[int]
+) -> Optional[Union[torch.Tensor, List[torch.Tensor]]]:
+    """
+    Select the conditioning vectors of some conditions.
+
+    :param y: conditioning vector(s) of all conditions
+    :param idx: indices of the selected conditions
+    :type y: torch.Tensor | list | None
+    :type idx: list
+    :return: conditioning vector(s) of the selected conditions
+    :rtype: torch.Tensor | list | None
+    """
+    if isinstance(y, list):
+        return [i[idx] for i in y]
+    if y is not None:
+        return y[idx]
+    return y
+
+
+def _show_gallery(
+    records: List[Record], view: str
+) -> Generator[Optional[List[str]], None, None]:
+    """
+    Draw the generated molecules when the gallery is open. \n
+    The first page is shown before the rest are drawn.
+
+    :param records: records of generated molecules
+    :param view: name of the opened view
+    :type records: list
+    :type view: str
+    :return: a list of image file paths
+    :rtype: generator
+    """
+    if view != "gallery":
+        yield gr.skip()
+        return
+    records = [i for i in records if i.mol is not None]
+    if not records:
+        yield None
+        return
+    imgs = renderer.render(records[:_GALLERY_PAGE_SIZE])
+    if len(records) > _GALLERY_PAGE_SIZE:
+        yield imgs
+        imgs += renderer.render(records[_GALLERY_PAGE_SIZE:])
+    yield imgs
+
+
+def _show_chemfig(records: List[Record], view: str) -> Generator[str, None, None]:
+    """
+    Convert the generated molecules to Chemfig code when the Chemfig tab is open. \n
+    The code is updated while the conversion is running.
+
+    :param records: records of generated molecules
+    :param view: name of the opened view
+    :type records: list
+    :type view: str
+    :return: Chemfig code
+    :rtype: generator
+    """
+    if view != "chemfig":
+        yield gr.skip()
+        return
+    smiles = [i.smiles for i in records if i.smiles is not None]
+    codes = {}
+    join_fn = lambda: "\n\n".join(codes[i] for i in smiles if codes.get(i))
+    t = time.time()
+    for key, code in chemfig_converter.convert(smiles):
+        codes[key] = code
+        if time.time() - t > _CHEMFIG_UPDATE_INTERVAL:
+            t = time.time()
+            yield join_fn()
+    yield join_fn()
+
+
+def run(
+    model_name: str,
+    token_name: str,
+    vocab_fn: str,
+    step: int,
+    batch_size: int,
+    sequence_size: int,
+    guidance_strength: float,
+    method: Literal["BFN", "ODE"],
+    temperature: float,
+    prompt: Optional[str],
+    scaffold: Optional[str],
+    template: Optional[str],
+    sar_control: Optional[str],
+    exclude_token: Optional[str],
+    quantise: Literal["on", "off"],
+    jited: Literal["on", "off"],
+    sorted_: Literal["on", "off"],
+    result_prep_fn: Optional[str],
+    novelty: Literal["off", "unique", "novel"] = "off",
+    target: int = 0,
+    max_samples: int = 10000,
+    length_buckets: Optional[str] = "",
+    session_index: Optional[NoveltyIndex] = None,
+    scaffold_file: Optional[str] = None,
+    template_file: Optional[str] = None,
+    objective_file: Optional[str] = None,
+    guidance_sweep: Optional[str] = "",
+) -> Generator[
+    Tuple[
+        Union[List, None],
+        gr.Dataframe,
+        str,
+        gr.TextArea,
+        gr.File,
+        List[Record],
+        NoveltyIndex,
+    ],
+    None,
+    None,
+]:
+    """
+    Run generation or inpainting. \n
+    The batch is generated in chunks and the results are yielded after each chunk.
+    If `target` is set, samples are generated until `target` samples are found
+    or `max_samples` samples are generated.
+    If several scaffolds (or templates), objective conditions or guidance strengths are given,
+    `batch_size` samples of each combination are generated
+    in large batches packing many of these groups, and the results are grouped accordingly.
+    The conditioning vectors of all conditions are made in one pass and
+    every sample of a batch is conditioned by the vector and guided by the strength of its group.
+
+    :param model_name: model name
+    :param token_name: tokeniser name
+    :param vocab_fn: customised vocabulary name
+    :param step: number of sampling steps
+    :param batch_size: batch-size
+    :param sequence_size: maximum sequence length
+    :param guidance_strength: guidance strength of conditioning
+    :param method: `"BFN"` or `"ODE"`
+    :param temperature: sampling temperature while ODE-solver used
+    :param prompt: prompt string
+    :param scaffold: molecular scaffold
+    :param template: molecular template
+    :param sar_control: semi-autoregressive behaviour flags
+    :param exclude_token: unwanted tokens
+    :param quantise: `"on"` or `"off"`
+    :param jited: `"on"` or `"off"`
+    :param sorted\\_: whether to sort the reulst; `"on"` or `"off"`
+    :param result_prep_fn: a string form result preprocessing function
+    :param novelty: `"off"`; `"unique"` to drop repeated molecules;
+                    `"novel"` to drop molecules generated before as well
+    :param target: number of wanted samples; 0 means one batch
+    :param max_samples: maximum number of samples generated while a target is set
+    :param length_buckets: shorter sequence lengths tried first while sampling, e.g., `"32,64"`;
+                           `"auto"` to learn them from earlier samples
+    :param session_index: molecules generated in this session
+    :param scaffold_file: file of scaffolds used together with those in `scaffold`
+    :param template_file: file of templates used together with those in `template`
+    :param objective_file: file of objective values replacing those in `prompt`
+    :param guidance_sweep: guidance strengths replacing `guidance_strength`, e.g., `"2,4,6,8"`
+    :type model_name: str
+    :type token_name: str
+    :type vocab_fn: str
+    :type step: int
+    :type batch_size: int
+    :type sequence_size: int
+    :type guidance_strength: float
+    :type method: str
+    :type temperature: float
+    :type prompt: str | None
+    :type scaffold: str | None
+    :type template: str | None
+    :type sar_control: str | None
+    :type exclude_token: str | None
+    :type quantise: str
+    :type jited: str
+    :type sorted\\_: str
+    :type result_prep_fn: str | None
+    :type novelty: str
+    :type target: int
+    :type max_samples: int
+    :type length_buckets: str | None
+    :type session_index: lib.novelty.NoveltyIndex | None
+    :type scaffold_file: str | None
+    :type template_file: str | None
+    :type objective_file: str | None
+    :type guidance_sweep: str | None
+    :return: list of images (skipped; drawn when the gallery is opened) \n
+             Dataframe item of generated molecules \n
+             Chemfig code (skipped; made when the Chemfig tab is opened) \n
+             messages \n
+             File item of the result file \n
+             records of generated molecules \n
+             molecules generated in this session
+    :rtype: generator
+    """
+    # ------- build result preprocessing function -------
+    _result_prep_fn = build_result_prep_fn(result_prep_fn)
+    # ------- build tokeniser -------
+    vocab_keys, tokeniser = build_tokeniser(token_name, vocab_fn, vocabs)
+    _method = "bfn" if method == "BFN" else f"ode:{temperature}"
+    # ------- build model -------
+    _prompt, conditions = parse_objective_sweep(prompt, objective_file)
+    prompt_info = parse_prompt(_prompt)
+    n_objectives = max(1, len(prompt_info["lora"]))
+    if any(len(i) != n_objectives for i in conditions):
+        raise ValueError(
+            f"Each condition needs {n_objectives} objective "
+            f"{'vector' if n_objectives == 1 else 'vectors'}."
+        )
+    if len(conditions) == 1:
+        prompt_info["objective"], conditions = conditions[0], []
+    elif conditions:
+        # one objective vector of each condition for each model
+        prompt_info["objective"] = [list(i) for i in zip(*conditions)]
+    sar_flag = parse_sar_control(sar_control)
+    _info = deepcopy(prompt_info)
+    _info["semi-autoregression"] = deepcopy(sar_flag)
+    print("Prompt summary:", _info)  # prompt
+    spec = ModelSpec(
+        model_name,
+        prompt_info,
+        sar_flag,
+        sequence_size,
+        quantise == "on",
+        jited == "on",
+        models,
+    )
+    bfn, y, lmax, _message = build_model(*spec)
+    strengths = parse_guidance_sweep(guidance_sweep)
+    if y is None:
+        conditions = []  # objective values ignored
+        if strengths:
+            _message.append("Guidance strengths ignored without conditioning.")
+            strengths = []
+    if len(strengths) == 1:
+        guidance_strength, strengths = strengths[0], []
+    if len(conditions) * len(strengths) > MAX_SWEEP_SIZE:
+        raise ValueError(
+            f"{len(conditions)} conditions under {len(strengths)} guidance strengths "
+            f"are swept but at most {MAX_SWEEP_SIZE} combinations are allowed."
+        )
+    result_prep_fn_ = lambda x: [_result_prep_fn(i) for i in x]
+    # ------- inference -------
+    allowed_tokens = parse_exclude_token(exclude_token, vocab_keys)
+    if not allowed_tokens:
+        allowed_tokens = "all"
+    scaffolds = parse_input_list(scaffold, scaffold_file)
+    templates = parse_input_list(template, template_file)
+    scaffold, template = "\n".join(scaffolds), "\n".join(templates)
+    mode, x, _msg = build_input(scaffolds, templates, tokeniser, lmax)
+    _message.extend(_msg)
+    # each scaffold or template is one row of the model input
+    input_name = "scaffold" if mode == "inpaint" else "template"
+    inputs = scaffolds if mode == "inpaint" else templates
+    # each scaffold/template under each condition and guidance strength is one group of samples
+    names = (
+        ((input_name,) if len(inputs) > 1 else ())
+        + (("objective",) if conditions else ())
+        + (("guidance",) if strengths else ())
+    )
+    groups = list(
+        itertools.product(
+            range(max(1, len(inputs))),
+            range(max(1, len(conditions))),
+            range(max(1, len(strengths))),
+        )
+    )
+    plurals = {"objective": "conditions", "guidance": "guidance strengths"}
+    group_name = "groups"
+    if len(names) == 1:
+        group_name = plurals.get(names[0], f"{names[0]}s")
+    if len(groups) > 1 and target > 0:
+        _message.append(f"Target number of samples ignored with several {group_name}.")
+    # sequence lengths depend on the model and the conditioning
+    length_key = (
+        model_name,
+        token_name,
+        vocab_fn if token_name == "SELFIES" else None,
+        str(prompt_info),
+        tuple(sar_flag),
+    )
+    buckets = parse_length_buckets(length_buckets) if mode == "sample" else []
+    if buckets and len(groups) == 1 and sorted_ == "on":
+        # entropy values are averaged over sequences of different lengths
+        sorted_ = "off"
+        _message.append("Results are not sorted when length buckets are used.")
+    # requests sharing the same model and sampling settings are batched together
+    job_key = (
+        model_name,
+        token_name,
+        vocab_fn if token_name == "SELFIES" else None,
+        str(prompt_info),
+        tuple(sar_flag),
+        quantise,
+        jited,
+        mode,
+        lmax,
+        step,
+        guidance_strength,
+        _method,
+        str(allowed_tokens),
+        sorted_,
+        # sorted samples are dealt across requests; only identical inputs can share them
+        (scaffold, template) if sorted_ == "on" else None,
+    )
+    writer = ResultWriter(
+        # plain CSV files cannot tell the groups apart
+        fmt="csv.gz" if len(groups) > 1 and _RESULT_FORMAT == "csv" else _RESULT_FORMAT,
+        metadata={
+            "model": model_name,
+            "tokeniser": token_name,
+            "vocabulary": vocab_fn if token_name == "SELFIES" else None,
+            "lora": prompt_info["lora"],
+            "lora_scaling": prompt_info["lora_scaling"],
+            "objective": prompt_info["objective"] if not conditions else [],
+            "prompt": prompt,
+            "scaffold": scaffold if len(scaffolds) < 2 else "",
+            "template": template if len(templates) < 2 else "",
+            "sequence_length": lmax,
+            "step": step,
+            "guidance_strength": guidance_strength,
+            "method": _method,
+            "semi_autoregressive": sar_flag,
+            "sorted": sorted_ == "on",
+        },
+    )
+    if _SHARD_POOL is None:
+        runner = partial(generate, model=bfn, y=y)
+    else:
+        # workers build their own models from the same settings
+        runner = partial(_SHARD_POOL.generate, spec=spec)
+    results: List[Record] = []
+    if session_index is None:
+        session_index = NoveltyIndex()
+    # molecules generated in this session (and before if the index is kept on disk)
+    history = [session_index] + ([_NOVELTY_INDEX] if _NOVELTY_INDEX is not None else [])
+    run_index = NoveltyIndex()
+    n_sampled = n_mol = 0
+    n_written = 0  # number of results that have been submitted to the writer
+    runner_kargs = {
+        "mode": mode,
+        "sequence_size": lmax,
+        "sample_step": step,
+        "guidance_strength": guidance_strength,
+        "vocab_keys": vocab_keys,
+        "method": _method,
+        "allowed_tokens": allowed_tokens,
+    }
+
+    def _drop_repeated(records: List[Record], index: NoveltyIndex) -> List[Record]:
+        # `index` holds the molecules kept so far from the same input
+        if novelty == "novel":
+            return deduplicate(records, [index] + history, _NOVELTY_KEY)
+        if novelty == "unique":
+            records = deduplicate(records, [index], _NOVELTY_KEY)
+            # remembered so that a later "novel" run drops them
+            keys = [record_key(i, _NOVELTY_KEY) for i in records]
+            for i in history:
+                i.update(keys)
+        return records
+
+    def _outputs(table: gr.Dataframe, info: str, n_saved: Optional[int]) -> Tuple:
+        # the file can be offered once it is up to date, so that writing never blocks generation
+        if n_saved is None:
+            file = gr.skip()
+        else:
+            file = gr.File(
+                str(writer.path) if n_saved > 0 else None,
+                label="download",
+                visible=n_saved > 0,
+                interactive=False,
+            )
+        return (
+            gr.skip(),  # images are drawn when the gallery is opened
+            table,
+            gr.skip(),  # Chemfig code is generated when the Chemfig tab is opened
+            gr.TextArea(
+                "\n".join(_message + [info]), label="message", lines=len(_message) + 1
+            ),
+            file,
+            results,
+            session_index,
+        )
+
+    try:
+        if len(groups) > 1:
+            # pack the groups into batches as large as the scheduler runs at once
+            pack = max(1, scheduler.max_batch_size // batch_size)
+            labels: List[List[str]] = []  # labels of the group of each result
+            for start in range(0, len(groups), pack):
+                packed = groups[start : start + pack]
+                kargs = {}
+                if conditions:
+                    kargs["y"] = _select_conditions(y, [i[1] for i in packed])
+                if strengths:
+                    # the strengths run in one batch; each sample follows its own trajectory,
+                    # so the batch costs as much as running the strengths one by one
+                    kargs["guidance_strength"] = [strengths[i[2]] for i in packed]
+                outputs = runner(
+                    [
+                        (None if x is None else x[i : i + 1], batch_size)
+                        for i, _, _ in packed
+                    ],
+                    sort=False,
+                    buckets=[],
+                    **(runner_kargs | kargs),
+                )
+                n_saved = n_written if writer.done else None
+                if n_saved is None and start == 0:
+                    n_saved = 0  # hide the file of the last run
+                for (i, j, w), (mols, entropy) in zip(packed, outputs):
+                    records = build_records(result_prep_fn_(mols), entropy, token_name)
+                    records = [k for k in records if k.valid]
+                    records = _drop_repeated(records, NoveltyIndex())
+                    if sorted_ == "on":
+                        records.sort(key=lambda k: k.entropy)
+                    group = {}
+                    if len(inputs) > 1:
+                        group[input_name] = inputs[i]
+                    if conditions:
+                        group["objective"] = conditions[j]
+                    if strengths:
+                        group["guidance_strength"] = strengths[w]
+                    records = [k._replace(tags=group) for k in records]
+                    results.extend(records)
+                    label = [
+                        ";".join(str(k) for k in v) if key == "objective" else str(v)
+                        for key, v in group.items()
+                    ]
+                    labels.extend([label] * len(records))
+                    writer.append(records)
+                n_sampled += batch_size * len(packed)
+                n_written = n_mol = len(results)
+                _info = (
+                    f"{start + len(packed)}/{len(groups)} {group_name} done; "
+                    f"{n_mol} valid samples so far..."
+                )
+                yield _outputs(_result_table(results, labels, names), _info, n_saved)
+        else:
+            for chunk in plan_chunks(
+                batch_size,
+                target,
+                lambda: len(results),
+                max_samples,
+                _STREAM_CHUNK_SIZE,
+            ):
+                if buckets == "auto":
+                    chunk_buckets = length_stats.buckets(length_key, lmax)
+                else:
+                    chunk_buckets = buckets
+                mols, entropy = scheduler.submit(
+                    job_key + (tuple(chunk_buckets), chunk),
+                    (x, chunk),
+                    chunk,
+                    partial(
+                        runner,
+                        sort=sorted_ == "on",
+                        buckets=chunk_buckets,
+                        **runner_kargs,
+                    ),
+                )
+                n_sampled += chunk
+                if mode == "sample":
+                    length_stats.update(
+                        length_key, [len(tokeniser(i)) + 2 for i in mols]
+                    )
+                records = build_records(result_prep_fn_(mols), entropy, token_name)
+                records = [i for i in records if i.valid]
+                records = _drop_repeated(records, run_index)
+                if target > 0:
+                    records = records[: target - len(results)]
+                results.extend(records)
+                if sorted_ == "on":
+                    results.sort(key=lambda i: i.entropy)
+                # while generating, the file is up to date when the writing of the previous chunk has finished
+                n_saved = n_written if writer.done else None
+                if n_saved is None and n_sampled == chunk:
+                    n_saved = 0  # hide the file of the last run
+                if sorted_ == "on":
+                    writer.write(results)
+                else:
+                    writer.append(records)
+                n_written = n_mol = len(results)
+                if target > 0:
+                    _info = (
+                        f"{n_sampled} sampled; {n_mol}/{target} samples found so far..."
+                    )
+                else:
+                    _info = f"{n_sampled}/{batch_size} sampled; {n_mol} valid samples so far..."
+                yield _outputs(_result_table(results), _info, n_saved)
+        writer.close()
+        writer.wait()
+        _info = (
+            f"{n_mol} {'smaple' if n_mol in (0, 1) else 'samples'} "
+            "generated and saved to cache that can be downloaded."
+        )
+        # the target is ignored with several groups
+        if len(groups) == 1 and n_mol < target and n_sampled >= max_samples:
+            _info += f" Stopped at the limit of {max_samples} samples."
+        elif len(groups) == 1 and n_mol < target:
+            _info += f" Stopped after {n_sampled} samples as the last rounds found nothing new."
+        yield (
+            gr.skip(),
+            gr.skip(),
+            gr.skip(),
+            gr.TextArea(
+                "\n".join(_message + [_info]), label="message", lines=len(_message) + 1
+            ),
+            gr.File(
+                str(writer.path) if n_mol > 0 else None,
+                label="download",
+                visible=n_mol > 0,
+                interactive=False,
+            ),
+            gr.skip(),
+            gr.skip(),
+        )
+    finally:
+        writer.close()  # finish the file if stopped
+
+
+def build_app() -> gr.Blocks:
+    """
+    Find the models and build the web-UI.
+
+    :return: web-UI
+    :rtype: gradio.Blocks
+    """
+    global vocabs, models
+    vocabs = find_vocab()
+    models = find_model()
+    with gr.Blocks(title="ChemBFN WebUI", analytics_enabled=False) as app:
+        with gr.Row():
+            with gr.Column(scale=1):
+                btn = gr.Button("RUN", variant="primary")
+                stop = gr.Button("\u23f9", variant="stop", visible=False)
+                model_name = gr.Dropdown(
+                    [i[0] for i in models["base"]]
+                    + [i[0] for i in models["standalone"]],
+                    label="model",
+                    filterable=False,
+                )
+                token_name = gr.Dropdown(
+                    ["SMILES & SAFE", "SELFIES", "FASTA"],
+                    label="tokeniser",
+                    filterable=False,
+                )
+                vocab_fn = gr.Dropdown(
+                    list(vocabs.keys()),
+                    label="vocabulary",
+                    visible=token_name.value == "SELFIES",
+                    filterable=False,
+                )
+                step = gr.Slider(1, 5000, 100, step=1, precision=0, label="step")
+                batch_size = gr.Slider(
+                    1, 512, 1, step=1, precision=0, label="batch size"
+                )
+                sequence_size = gr.Slider(
+                    5, 4096, 50, step=1, precision=0, label="sequence length"
+                )
+                guidance_strength = gr.Slider(
+                    0, 25, 4, step=0.05, label="guidance strength"
+                )
+                guidance_sweep = gr.Textbox(
+                    label="guidance sweep",
+                    placeholder="e.g., 2,4,6,8 or 2~8~4",
+                    html_attributes=HTML_STYLE,
+                )
+                method = gr.Dropdown(["BFN", "ODE"], label="method", filterable=False)
+                temperature = gr.Slider(
+                    0.0,
+                    2.5,
+                    0.5,
+                    step=0.001,
+                    label="temperature",
+                    visible=method.value == "ODE",
+                )
+            with gr.Column(scale=2):
+                with gr.Tab(label="prompt editor") as prompt_editor:
+                    prompt = gr.TextArea(
+                        label="prompt", lines=12, html_attributes=HTML_STYLE
+                    )
+                    objective_file = gr.File(
+                        label="objective file",
+                        file_types=[".csv"],
+                        type="filepath",
+                    )
+                    scaffold = gr.Textbox(
+                        label="scaffold",
+                        placeholder="one scaffold per line",
+                        max_lines=8,
+                        html_attributes=HTML_STYLE,
+                    )
+                    scaffold_file = gr.File(
+                        label="scaffold file",
+                        file_types=[".txt", ".smi", ".csv"],
+                        type="filepath",
+                    )
+                    template = gr.Textbox(
+                        label="template",
+                        placeholder="one template per line",
+                        max_lines=8,
+                        html_attributes=HTML_STYLE,
+                    )
+                    template_file = gr.File(
+                        label="template file",
+                        file_types=[".txt", ".smi", ".csv"],
+                        type="filepath",
+                    )
+                    gr.Markdown("")
+                    message = gr.TextArea(label="message", lines=2)
+                with gr.Tab(label="result viewer") as result_viewer:
+                    with gr.Tab(label="result") as result_tab:
+                        btn_download = gr.File(
+                            str(cache_dir / "results.csv"),
+                            label="download",
+                            visible=False,
+                            interactive=False,
+                        )
+                        result = gr.Dataframe(
+                            headers=["molecule"],
+                            type="array",
+                            column_count=(1, "fixed"),
+                            label="",
+                            interactive=False,
+                            show_row_numbers=True,
+                        )
+                    with gr.Tab(
+                        label="LATEX Chemfig", visible=token_name.value != "FASTA"
+                    ) as code:
+                        chemfig = gr.Code(
+                            label="", language="latex", show_line_numbers=True
+                        )
+                with gr.Tab(
+                    label="gallery", visible=token_name.value != "FASTA"
+                ) as gallery:
+                    img = gr.Gallery(label="molecule", columns=4, height=512)
+                with gr.Tab(label="model explorer") as model_explorer:
+                    btn_refresh = gr.Button("refresh", variant="secondary")
+                    with gr.Tab(label="customised vocabulary"):
+                        vocab_table = gr.Dataframe(
+                            list(vocabs.keys()),
+                            headers=["name"],
+                            column_count=(1, "fixed"),
+                            label="",
+                            interactive=False,
+                            show_row_numbers=True,
+                        )
+                    with gr.Tab(label="base models"):
+                        base_table = gr.Dataframe(
+                            [i[0] for i in models["base"]],
+                            headers=["name"],
+                            column_count=(1, "fixed"),
+                            label="",
+                            interactive=False,
+                            show_row_numbers=True,
+                        )
+                    with gr.Tab(label="standalone models"):
+                        standalone_table = gr.Dataframe(
+                            [[i[0], i[2]] for i in models["standalone"]],
+                            headers=["name", "objective"],
+                            column_count=(2, "fixed"),
+                            label="",
+                            interactive=False,
+                            show_row_numbers=True,
+                        )
+                    with gr.Tab(label="LoRA models"):
+                        lora_tabel = gr.Dataframe(
+                            [[i[0], i[2]] for i in models["lora"]],
+                            headers=["name", "objective"],
+                            column_count=(2, "fixed"),
+                            label="",
+                            interactive=False,
+                            show_row_numbers=True,
+                        )
+                with gr.Tab(label="advanced control") as advanced_control:
+                    sar_control = gr.Textbox(
+                        "F",
+                        label="semi-autoregressive behaviour",
+                        html_attributes=HTML_STYLE,
+                    )
+                    gr.Markdown("")
+                    exclude_token = gr.TextArea(
+                        label="exclude tokens",
+                        placeholder="key in unwanted tokens separated by comma.",
+                        html_attributes=HTML_STYLE,
+                    )
+                    result_prep_fn = gr.Textbox(
+                        "lambda x: x",
+                        label="result preprocessing function",
+                        placeholder="lambda x: x",
+                        html_attributes=HTML_STYLE,
+                    )
+                    with gr.Row(scale=1):
+                        quantise = gr.Radio(
+                            ["on", "off"], value="off", label="quantisation"
+                        )
+                        jited = gr.Radio(["on", "off"], value="off", label="JIT")
+                        sorted_ = gr.Radio(
+                            ["on", "off"],
+                            value="off",
+                            label="sort result based on entropy",
+                        )
+                    with gr.Row(scale=1):
+                        novelty = gr.Radio(
+                            ["off", "unique", "novel"],
+                            value="off",
+                            label="drop repeated molecules",
+                            info="unique: within a run; novel: within the session",
+                        )
+                        target = gr.Number(
+                            0,
+                            minimum=0,
+                            precision=0,
+                            label="target number of samples",
+                            info="keep sampling until this many samples are found; 0 to run one batch",
+                        )
+                        max_samples = gr.Number(
+                            10000,
+                            minimum=1,
+                            precision=0,
+                            label="sample limit",
+                            info="stop after this many samples even if the target is not met",
+                        )
+                    length_buckets = gr.Textbox(
+                        label="length buckets",
+                        placeholder="key in shorter sequence lengths separated by comma "
+                        "(e.g., 32,64) or auto to learn them from earlier samples.",
+                        info="faster, but samples that end within a shorter length are kept, "
+                        "so that short molecules are more likely than with the full length; "
+                        "results are not sorted",
+                        html_attributes=HTML_STYLE,
+                    )
+        gr.HTML(sys_info(), elem_classes="custom_footer", elem_id="footer")
+        view = gr.State("")  # "gallery", "chemfig" or ""
+        chemfig_selected = gr.State(False)
+        records = gr.State([])
+        session_index = gr.State(None)
+        # ------ user interaction events -------
+        gen = btn.click(
+            fn=lambda: (
+                gr.Button("RUN", variant="primary", visible=False),
+                gr.Button("\u23f9", variant="stop", visible=True),
+            ),
+            inputs=None,
+            outputs=[btn, stop],
+            api_name="switch_to_stop_mode",
+            api_description="Switch to STOP.",
+            api_visibility="private",
+        ).then(
+            fn=run,
+            inputs=[
+                model_name,
+                token_name,
+                vocab_fn,
+                step,
+                batch_size,
+                sequence_size,
+                guidance_strength,
+                method,
+                temperature,
+                prompt,
+                scaffold,
+                template,
+                sar_control,
+                exclude_token,
+                quantise,
+                jited,
+                sorted_,
+                result_prep_fn,
+                novelty,
+                target,
+                max_samples,
+                length_buckets,
+                session_index,
+                scaffold_file,
+                template_file,
+                objective_file,
+                guidance_sweep,
+            ],
+            outputs=[
+                img,
+                result,
+                chemfig,
+                message,
+                btn_download,
+                records,
+                session_index,
+            ],
+            api_name="run",
+            api_description="Run ChemBFN model.",
+        )
+        gen.then(
+            fn=lambda: (
+                gr.Button("RUN", variant="primary", visible=True),
+                gr.Button("\u23f9", variant="stop", visible=False),
+            ),
+            inputs=None,
+            outputs=[btn, stop],
+            api_name="switch_back_to_run_mode",
+            api_description="Swtch back to RUN.",
+            api_visibility="private",
+        )
+        stop.click(
+            fn=lambda: (
+                gr.Button("RUN", variant="primary", visible=True),
+                gr.Button("\u23f9", variant="stop", visible=False),
+            ),
+            inputs=None,
+            outputs=[btn, stop],
+            cancels=[gen],
+            api_name="stop",
+            api_description="Stop the model.",
+        )
+        btn_refresh.click(
+            fn=_refresh,
+            inputs=[model_name, vocab_fn, token_name],
+            outputs=[
+                vocab_table,
+                base_table,
+                standalone_table,
+                lora_tabel,
+                model_name,
+                vocab_fn,
+            ],
+            api_name="refresh_model_list",
+            api_description="Refresh the model list.",
+        )
+        token_name.input(
+            fn=_token_name_change_evt,
+            inputs=[token_name, vocab_fn],
+            outputs=[vocab_fn, code, gallery],
+            api_visibility="private",
+        )
+        method.input(
+            fn=lambda x, y: gr.Slider(
+                0.0,
+                2.5,
+                y,
+                step=0.001,
+                label="temperature",
+                visible=x == "ODE",
+            ),
+            inputs=[method, temperature],
+            outputs=temperature,
+            api_name="select_sampling_method",
+            api_description="Select sampling method between 'BFN' and 'ODE'.",
+            api_visibility="private",
+        )
+        lora_tabel.select(
+            fn=_select_lora,
+            inputs=prompt,
+            outputs=prompt,
+            api_name="select_lora",
+            api_description="Select LoRA model from the model list.",
+            api_visibility="private",
+        )
+        # ------ images and Chemfig code are only made for the opened view -------
+        show_gallery = dict(
+            fn=_show_gallery,
+            inputs=[records, view],
+            outputs=img,
+            trigger_mode="always_last",
+            api_visibility="private",
+        )
+        show_chemfig = dict(
+            fn=_show_chemfig,
+            inputs=[records, view],
+            outputs=chemfig,
+            trigger_mode="always_last",
+            api_visibility="private",
+        )
+        lazy_evts = [
+            records.change(**show_gallery),
+            records.change(**show_chemfig),
+            gallery.select(
+                fn=lambda: "gallery", outputs=view, api_visibility="private"
+            ).then(**show_gallery),
+            code.select(
+                fn=lambda: ("chemfig", True),
+                outputs=[view, chemfig_selected],
+                api_visibility="private",
+            ).then(**show_chemfig),
+            result_viewer.select(
+                fn=lambda x: "chemfig" if x else "",
+                inputs=chemfig_selected,
+                outputs=view,
+                api_visibility="private",
+            ).then(**show_chemfig),
+        ]
+        result_tab.select(
+            fn=lambda: ("", False),
+            outputs=[view, chemfig_selected],
+            cancels=lazy_evts,
+            api_visibility="private",
+        )
+        for tab in (prompt_editor, model_explorer, advanced_control):
+            tab.select(
+                fn=lambda: "", outputs=view, cancels=lazy_evts, api_visibility="private"
+            )
+        btn.click(fn=None, cancels=lazy_evts, api_visibility="private")
+    return app
+
+
+def launch(args: argparse.Namespace) -> None:
+    """
+    Build and launch the web-UI.
+
+    :param args: command line arguments parsed by `bin.app.main()`
+    :type args: argparse.Namespace
+    :return:
+    :rtype: None
+    """
+    global _STREAM_CHUNK_SIZE, _RESULT_FORMAT, _SHARD_POOL
+    global _NOVELTY_INDEX, _NOVELTY_KEY
+    _STREAM_CHUNK_SIZE = args.chunk_size
+    _RESULT_FORMAT = args.result_format
+    if args.shards > 1:
+        _SHARD_POOL = ShardPool(args.shards, args.shard_threads)
+    if args.novelty_index is not None:
+        _NOVELTY_INDEX = NoveltyIndex(args.novelty_index)
+    _NOVELTY_KEY = args.novelty_key
+    configure_torch(args.threads, args.interop_threads, args.matmul_precision)
+    if args.concurrency > 1:
+        scheduler.window = args.batch_window / 1000
+        # concurrent requests should not compete for the same cores;
+        # the number of threads is a process-wide setting, so it is only set here
+        configure_torch(thread_budget(args.concurrency))
+    app = build_app()
+    app.queue(default_concurrency_limit=args.concurrency)
+    app.launch(
+        share=args.public,
+        footer_links=["api"],
+        allowed_paths=[str(cache_dir.absolute())],
+        favicon_path=str(favicon_dir.absolute()),
+        css=".custom_footer {text-align:center;bottom:0;}",
+    )
+
+
+if __name__ == "__main__":
+    ...
@@ -0,0 +1,447 @@
+# -*- coding: utf-8 -*-
+# Author: Nianze A. TAO (omozawa SUENO)
+"""
+Resident model cache.
+"""
+import os
+import zipfile
+import threading
+from copy import deepcopy
+from pathlib import Path
+from collections import OrderedDict
+from typing import Dict, List, Tuple, Union, Optional, Callable, Hashable, Any
+import torch
+from bayesianflow_for_chem import ChemBFN, MLP, EnsembleChemBFN
+from bayesianflow_for_chem.tool import adjust_lora_, quantise_model_
+
+_DEFAULT_CACHE_MEMORY = 4096  # MiB
+if "CHEMBFN_WEBUI_CACHE_MEMORY" in os.environ:
+    _DEFAULT_CACHE_MEMORY = float(os.environ["CHEMBFN_WEBUI_CACHE_MEMORY"])
+_SAVE_QUANTISED = os.environ.get("CHEMBFN_WEBUI_SAVE_QUANTISED", "0") != "0"
+_QUANTISED_SUFFIX = ".int8"
+_MMAP_WEIGHTS = os.environ.get("CHEMBFN_WEBUI_MMAP_WEIGHTS", "0") != "0"
+_MAPPED_SUFFIX = ".mmap"
+
+
+def _mtime(files: List[Union[str, Path]]) -> Tuple[int, ...]:
+    return tuple(os.stat(i).st_mtime_ns for i in files)
+
+
+def _load_quantised(
+    ckpt: Union[str, Path], ckpt_lora: Union[str, Path, None] = None
+) -> Optional[ChemBFN]:
+    # Rebuild a quantised model from the saved quantised weights.
+    # The model skeleton is created on the meta device so that quantising it
+    # costs nothing before the real weights are assigned.
+    fn = f"{ckpt}{_QUANTISED_SUFFIX}"
+    if not os.path.exists(fn) or os.stat(fn).st_mtime_ns < os.stat(ckpt).st_mtime_ns:
+        return None
+    import torchao.quantization  # register quantised tensor types for `torch.load`
+
+    try:
+        with open(fn, "rb") as f:
+            state = torch.load(f, "cpu", weights_only=True)
+        with torch.device("meta"):
+            bfn = ChemBFN(**state["hparam"])
+        if ckpt_lora:
+            with open(ckpt_lora, "rb") as g:
+                lora_state = torch.load(g, "cpu", weights_only=True)
+            bfn.enable_lora(**lora_state["lora_param"])
+            bfn.load_state_dict(lora_state["lora_nn"], False, assign=True)
+        quantise_model_(bfn)
+        bfn.load_state_dict(state["nn"], False, assign=True)
+    except Exception as error:
+        print(f"Failed to load quantised weights from {fn}: {error}")
+        return None
+    for tensor in list(bfn.parameters()) + list(bfn.buffers()):
+        if tensor.is_meta:
+            return None
+    return bfn
+
+
+def _save_quantised(bfn: ChemBFN, ckpt: Union[str, Path]) -> None:
+    # LoRA parameters are not quantised, so the saved weights are shared by
+    # every LoRA model built on the same checkpoint.
+    state = {k: v for k, v in bfn.state_dict().items() if "lora_" not in k}
+    try:
+        torch.save({"nn": state, "hparam": bfn.hparam}, f"{ckpt}{_QUANTISED_SUFFIX}")
+    except (OSError, RuntimeError) as error:
+        print(f"Failed to save quantised weights of {ckpt}: {error}")
+
+
+def _mappable_checkpoint(ckpt: Union[str, Path]) -> Optional[str]:
+    # Checkpoints saved in the zip format of `torch.save` can be mapped as they are;
+    # legacy ones are converted once and kept next to the model file.
+    if zipfile.is_zipfile(ckpt):
+        return str(ckpt)
+    fn = f"{ckpt}{_MAPPED_SUFFIX}"
+    if os.path.exists(fn) and os.stat(fn).st_mtime_ns >= os.stat(ckpt).st_mtime_ns:
+        return fn
+    try:
+        with open(ckpt, "rb") as f:
+            state = torch.load(f, "cpu", weights_only=True)
+        torch.save({"nn": state["nn"], "hparam": state["hparam"]}, fn)
+    except (OSError, RuntimeError) as error:
+        print(f"Failed to convert {ckpt} to a memory-mappable file: {error}")
+        return None
+    return fn
+
+
+def _load_mapped(
+    ckpt: Union[str, Path], ckpt_lora: Union[str, Path, None] = None
+) -> Optional[ChemBFN]:
+    # Map the weights read-only instead of copying them to the heap, so that
+    # every process loading the same checkpoint shares the same physical pages.
+    # Only LoRA parameters, which are loaded as usual, are private.
+    fn = _mappable_checkpoint(ckpt)
+    if fn is None:
+        return None
+    try:
+        state = torch.load(fn, "cpu", weights_only=True, mmap=True)
+        with torch.device("meta"):
+            bfn = ChemBFN(**state["hparam"])
+        bfn.load_state_dict(state["nn"], False, assign=True)
+        if ckpt_lora:
+            with open(ckpt_lora, "rb") as g:
+                lora_state = torch.load(g, "cpu", weights_only=True)
+            bfn.enable_lora(**lora_state["lora_param"])
+            bfn.load_state_dict(lora_state["lora_nn"], False, assign=True)
+    except Exception as error:
+        print(f"Failed to map weights from {fn}: {error}")
+        return None
+    for tensor in list(bfn.parameters()) + list(bfn.buffers()):
+        if tensor.is_meta:
+            return None
+    return bfn
+
+
+def model_size(model: torch.nn.Module) -> int:
+    """
+    Estimate the memory occupied by the parameters and buffers of a model.
+
+    :param model: PyTorch module
+    :type model: torch.nn.Module
+    :return: size in bytes
+    :rtype: int
+    """
+    size, seen = 0, set()
+    for tensor in list(model.parameters()) + list(model.buffers()):
+        if id(tensor) in seen:
+            continue
+        seen.add(id(tensor))
+        size += tensor.numel() * tensor.element_size()
+    return size
+
+
+def _object_size(obj: Any) -> int:
+    if isinstance(obj, torch.nn.Module):
+        return model_size(obj)
+    if isinstance(obj, torch.Tensor):
+        return obj.numel() * obj.element_size()
+    if isinstance(obj, dict):
+        return sum(_object_size(i) for i in obj.values())
+    return 0
+
+
+def _shallow_copy(model: ChemBFN) -> ChemBFN:
+    # Copy the module tree while sharing every parameter and buffer,
+    # so that per-request attributes can be changed without touching the
+    # resident model.
+    memo = {id(i): i for i in list(model.parameters()) + list(model.buffers())}
+    return deepcopy(model, memo)
+
+
+def attach_lora_(
+    model: ChemBFN,
+    lora_state: Dict[str, Dict[str, Union[torch.Tensor, int, float]]],
+    lora_scaling: float = 1.0,
+) -> None:
+    """
+    In-place attach LoRA adapter parameters to a model without copying them.
+
+    :param model: ChemBFN model
+    :param lora_state: LoRA checkpoint content `{"lora_nn": ..., "lora_param": ...}`
+    :param lora_scaling: LoRA scaling multiplier
+    :type model: bayesianflow_for_chem.model.ChemBFN
+    :type lora_state: dict
+    :type lora_scaling: float
+    :return:
+    :rtype: None
+    """
+    lora_param = lora_state["lora_param"]
+    scaling = lora_param.get("lora_alpha", 1) / lora_param["r"] * lora_scaling
+    modules = dict(model.named_modules())
+    for name, value in lora_state["lora_nn"].items():
+        module_name, attr = name.rsplit(".", 1)
+        module = modules[module_name]
+        setattr(module, attr, torch.nn.Parameter(value, requires_grad=False))
+        module.scaling = scaling
+        module.lora_dropout = float(lora_param.get("lora_dropout", 0.0))
+        module.lora_enabled = True
+    model.lora_enabled = True
+    model.lora_param = dict(lora_param)
+
+
+class ModelCache:
+    """
+    Process-wide LRU cache of loaded models.
+    """
+
+    def __init__(self, max_memory: float = _DEFAULT_CACHE_MEMORY) -> None:
+        """
+        An entry is dropped when any of its source files has been modified
+        since it was loaded. The least recently used entries are evicted when
+        the total size exceeds `max_memory`. Setting `max_memory` to 0 disables the cache.
+
+        :param max_memory: memory budget in MiB
+        :type max_memory: float
+        """
+        self.max_memory = max_memory
+        self._entries: OrderedDict[
+            Hashable, Tuple[Any, Tuple[int, ...], int]
+        ] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def memory(self) -> int:
+        """
+        Memory occupied by the cached models in bytes.
+
+        :return: size in bytes
+        :rtype: int
+        """
+        with self._lock:
+            return sum(i[2] for i in self._entries.values())
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def get(
+        self,
+        key: Hashable,
+        files: List[Union[str, Path]],
+        loader: Callable[[], Any],
+    ) -> Any:
+        """
+        Get a cached object or load it.
+
+        :param key: cache key
+        :param files: source files of the object
+        :param loader: a function to load the object
+        :type key: hashable
+        :type files: list
+        :type loader: callable
+        :return: cached or freshly loaded object
+        :rtype: any
+        """
+        mtime = _mtime(files)
+        with self._lock:
+            if key in self._entries:
+                obj, _mtime_, _ = self._entries[key]
+                if _mtime_ == mtime:
+                    self._entries.move_to_end(key)
+                    return obj
+                del self._entries[key]
+        obj = loader()
+        if self.max_memory <= 0:
+            return obj
+        size = _object_size(obj)
+        with self._lock:
+            self._entries[key] = (obj, mtime, size)
+            self._entries.move_to_end(key)
+            budget = self.max_memory * 1024**2
+            while len(self._entries) > 1:
+                if sum(i[2] for i in self._entries.values()) <= budget:
+                    break
+                self._entries.popitem(last=False)
+        return obj
+
+    def clear(self) -> None:
+        """
+        Remove all cached objects.
+
+        :return:
+        :rtype: None
+        """
+        with self._lock:
+            self._entries.clear()
+
+
+model_cache = ModelCache()
+
+
+def _build_model(
+    ckpt: str,
+    ckpt_lora: Optional[str],
+    lora_scaling: float,
+    sar_flag: bool,
+    quantise: bool,
+    jited: bool,
+) -> ChemBFN:
+    bfn = None
+    if quantise:
+        bfn = _load_quantised(ckpt, ckpt_lora)
+    elif _MMAP_WEIGHTS:
+        # quantisation writes new weights, so only full-precision models are mapped
+        bfn = _load_mapped(ckpt, ckpt_lora)
+    if bfn is None:
+        bfn = ChemBFN.from_checkpoint(ckpt, ckpt_lora)
+        if quantise:
+            quantise_model_(bfn)
+            if _SAVE_QUANTISED:
+                _save_quantised(bfn, ckpt)
+    if lora_scaling != 1.0:
+        adjust_lora_(bfn, lora_scaling)
+    bfn.semi_autoregressive = sar_flag
+    if jited:
+        bfn.compile()
+    return bfn
+
+
+def load_model(
+    ckpt: Union[str, Path],
+    ckpt_lora: Union[str, Path, None] = None,
+    lora_scaling: float = 1.0,
+    sar_flag: bool = False,
+    quantise: bool = False,
+    jited: bool = False,
+) -> ChemBFN:
+    """
+    Load a (LoRA) ChemBFN model through the resident cache. \n
+    The weights of the base model are loaded once and shared by every returned model;
+    LoRA adapters, LoRA scaling and SAR flag only apply to the returned model.
+    A compiled model is cached as a whole.
+
+    :param ckpt: model checkpoint file
+    :param ckpt_lora: LoRA checkpoint file
+    :param lora_scaling: LoRA scaling
+    :param sar_flag: semi-autoregressive behaviour flag
+    :param quantise: whether to quantise the model
+    :param jited: whether to compile the model
+    :type ckpt: str | pathlib.Path
+    :type ckpt_lora: str | pathlib.Path | None
+    :type lora_scaling: float
+    :type sar_flag: bool
+    :type quantise: bool
+    :type jited: bool
+    :return: ChemBFN model
+    :rtype: bayesianflow_for_chem.model.ChemBFN
+    """
+    ckpt = str(Path(ckpt).resolve())
+    if ckpt_lora is not None:
+        ckpt_lora = str(Path(ckpt_lora).resolve())
+    if jited:
+        # a compiled model is bound to its own modules, so it is cached as it is
+        key = ("ChemBFN", ckpt, ckpt_lora, lora_scaling, sar_flag, quantise, jited)
+        files = [ckpt] if ckpt_lora is None else [ckpt, ckpt_lora]
+        return model_cache.get(
+            key,
+            files,
+            lambda: _build_model(
+                ckpt, ckpt_lora, lora_scaling, sar_flag, quantise, jited
+            ),
+        )
+    base = model_cache.get(
+        ("ChemBFN", ckpt, quantise),
+        [ckpt],
+        lambda: _build_model(ckpt, None, 1.0, False, quantise, False),
+    )
+    bfn = _shallow_copy(base)
+    if ckpt_lora is not None:
+        attach_lora_(bfn, load_lora(ckpt_lora), lora_scaling)
+    bfn.semi_autoregressive = sar_flag
+    return bfn
+
+
+def load_lora(ckpt_lora: Union[str, Path]) -> Dict[str, Dict[str, Any]]:
+    """
+    Load LoRA adapter parameters through the resident cache.
+
+    :param ckpt_lora: LoRA checkpoint file
+    :type ckpt_lora: str | pathlib.Path
+    :return: `{"lora_nn": ..., "lora_param": ...}`
+    :rtype: dict
+    """
+
+    def _loader() -> Dict[str, Dict[str, Any]]:
+        with open(ckpt_lora, "rb") as f:
+            state = torch.load(f, "cpu", weights_only=True)
+        return {"lora_nn": state["lora_nn"], "lora_param": state["lora_param"]}
+
+    ckpt_lora = str(Path(ckpt_lora).resolve())
+    return model_cache.get(("LoRA", ckpt_lora), [ckpt_lora], _loader)
+
+
+def load_mlp(ckpt: Union[str, Path]) -> MLP:
+    """
+    Load an MLP model through the resident cache.
+
+    :param ckpt: MLP checkpoint file
+    :type ckpt: str | pathlib.Path
+    :return: MLP model
+    :rtype: bayesianflow_for_chem.model.MLP
+    """
+    ckpt = str(Path(ckpt).resolve())
+    return model_cache.get(("MLP", ckpt), [ckpt], lambda: MLP.from_checkpoint(ckpt))
+
+
+def load_ensemble(
+    ckpt: Union[str, Path],
+    ckpt_loras: List[Union[str, Path]],
+    ckpt_mlps: List[Union[str, Path]],
+    weights: List[float],
+    sar_flags: List[bool],
+    quantise: bool = False,
+    jited: bool = False,
+) -> EnsembleChemBFN:
+    """
+    Load an ensemble of LoRA models through the resident cache.
+
+    :param ckpt: base model checkpoint file
+    :param ckpt_loras: LoRA checkpoint files
+    :param ckpt_mlps: MLP checkpoint files associated with LoRA models
+    :param weights: contribution of each LoRA model to the ensemble
+    :param sar_flags: semi-autoregressive behaviour flags of each LoRA model
+    :param quantise: whether to quantise the model
+    :param jited: whether to compile the model
+    :type ckpt: str | pathlib.Path
+    :type ckpt_loras: list
+    :type ckpt_mlps: list
+    :type weights: list
+    :type sar_flags: list
+    :type quantise: bool
+    :type jited: bool
+    :return: ensemble model
+    :rtype: bayesianflow_for_chem.model.EnsembleChemBFN
+    """
+    ckpt = str(Path(ckpt).resolve())
+    ckpt_loras = [str(Path(i).resolve()) for i in ckpt_loras]
+    ckpt_mlps = [str(Path(i).resolve()) for i in ckpt_mlps]
+    key = (
+        "EnsembleChemBFN",
+        ckpt,
+        tuple(ckpt_loras),
+        tuple(ckpt_mlps),
+        tuple(weights),
+        tuple(sar_flags),
+        quantise,
+        jited,
+    )
+
+    def _loader() -> EnsembleChemBFN:
+        mlps = [MLP.from_checkpoint(i) for i in ckpt_mlps]
+        bfn = EnsembleChemBFN(ckpt, ckpt_loras, mlps, weights, sar_flags)
+        if quantise:
+            bfn.quantise()
+        if jited:
+            bfn.compile()
+        return bfn
+
+    return model_cache.get(key, [ckpt] + ckpt_loras + ckpt_mlps, _loader)
+
+
+if __name__ == "__main__":
+    ...
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+# Author: Nianze A. TAO (omozawa SUENO)
+"""
+Write generated results.
+"""
+import os
+import csv
+import gzip
+import json
+import time
+import shutil
+import importlib.util
+from uuid import uuid4
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Dict, List, Union, Optional, Any
+from .postprocess import Record
+from .options import FORMATS
+
+_RESULT_DIR = Path(__file__).parent.parent / "cache" / "results"
+_RESULT_RETENTION = float(os.environ.get("CHEMBFN_WEBUI_RESULT_RETENTION", 24))
+# one thread keeps the writes of every file in order
+_io_executor = ThreadPoolExecutor(1, thread_name_prefix="chembfn_io")
+COLUMNS = ("molecule", "smiles", "valid", "entropy")
+
+
+def check_format(fmt: str) -> None:
+    """
+    Check whether a result format can be written.
+
+    :param fmt: result format
+    :type fmt: str
+    :return:
+    :rtype: None
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown result format {fmt}; choose from {FORMATS}.")
+    if fmt == "parquet" and importlib.util.find_spec("pyarrow") is None:
+        raise ImportError(
+            "Writing Parquet files requires pyarrow; install it via `pip install pyarrow`."
+        )
+
+
+def _normalise(value: Any) -> Union[str, int, float, bool]:
+    if value is None:
+        return ""
+    if isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, Path):
+        return str(value)
+    return json.dumps(value)
+
+
+def _rows(records: List[Record], metadata: Dict[str, Any]) -> List[Dict[str, Any]]:
+    return [
+        {
+            "molecule": i.string,
+            "smiles": i.smiles,
+            "valid": i.valid,
+            "entropy": i.entropy,
+        }
+        | metadata
+        | {k: _normalise(v) for k, v in (i.tags or {}).items()}
+        for i in records
+    ]
+
+
+def prune_results(
+    result_dir: Path = _RESULT_DIR, retention: float = _RESULT_RETENTION
+) -> None:
+    """
+    Remove result files that have not been modified for a while.
+
+    :param result_dir: directory holding the result files of each request
+    :param retention: retention time in hours
+    :type result_dir: pathlib.Path
+    :type retention: float
+    :return:
+    :rtype: None
+    """
+    if not result_dir.is_dir():
+        return
+    deadline = time.time() - retention * 3600
+    for folder in result_dir.iterdir():
+        if folder.is_dir() and folder.stat().st_mtime < deadline:
+            shutil.rmtree(folder, ignore_errors=True)
+
+
+class ResultWriter:
+    """
+    Write the results of one request in the background.
+    """
+
+    def __init__(
+        self,
+        result_dir: Path = _RESULT_DIR,
+        fmt: str = "csv",
+        metadata: Optional[Dict[str, Any]] = None,
+        path: Optional[Path] = None,
+        keep: Optional[int] = None,
+    ) -> None:
+        """
+        Each writer owns a file `result_dir/{random id}/results.{fmt}`;
+        outdated files of other requests are removed when a writer is created.
+        If `path` is given, the writer writes to `path` instead and nothing is removed. \n
+        `"csv"` files hold one generated string per line as they always did;
+        `"csv.gz"` and `"parquet"` files hold a table with the columns
+        `molecule`, `smiles` (canonical SMILES), `valid`, `entropy`
+        and one column for each metadata item (e.g., model name and sampling settings);
+        the tags of a record replace the metadata items of the same names in its row,
+        which `"csv"` files cannot hold.
+        Parquet files also keep the metadata in the file schema and
+        can be read after `close()` is called.
+
+        :param result_dir: directory holding the result files of each request
+        :param fmt: result format chosen from `"csv"`, `"csv.gz"` and `"parquet"`
+        :param metadata: settings shared by all results
+        :param path: file path
+        :param keep: keep the first `keep` results of the existing file at `path` and append after them
+        :type result_dir: pathlib.Path
+        :type fmt: str
+        :type metadata: dict | None
+        :type path: pathlib.Path | None
+        :type keep: int | None
+        """
+        check_format(fmt)
+        self.fmt = fmt
+        if path is None:
+            self.path = Path(result_dir) / uuid4().hex / f"results.{fmt}"
+        else:
+            self.path = Path(path)
+        self.metadata = {k: _normalise(v) for k, v in (metadata or {}).items()}
+        self._empty = True
+        self._complete = fmt != "parquet"
+        self._parquet_writer = None
+        self._future = _io_executor.submit(
+            self._create, None if path is not None else Path(result_dir), keep
+        )
+
+    def _create(self, result_dir: Optional[Path], keep: Optional[int]) -> None:
+        if result_dir is not None:
+            prune_results(result_dir)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if keep is not None and self.path.exists():
+            self._keep(keep)
+        elif self.fmt == "csv":
+            self.path.write_bytes(b"")
+        elif self.fmt == "csv.gz":
+            self._write_csv_gz([], self.path)
+        elif self.path.exists():
+            self.path.unlink()
+
+    def _keep(self, n: int) -> None:
+        if self.fmt == "csv":
+            with open(self.path, "r+b") as f:
+                for _ in range(n):
+                    if not f.readline():
+                        break
+                f.truncate(f.tell())
+                # drop the line break after the last kept line
+                if f.tell() > 0:
+                    f.seek(-1, os.SEEK_END)
+                    if f.read(1) == b"\n":
+                        f.truncate(f.tell() - 1)
+                self._empty = f.tell() == 0
+        elif self.fmt == "csv.gz":
+            tmp = self.path.with_name(f"{self.path.name}.tmp")
+            with gzip.open(self.path, "rt", encoding="utf-8", newline="") as fi:
+                with gzip.open(tmp, "wt", encoding="utf-8", newline="") as fo:
+                    reader, writer = csv.reader(fi), csv.writer(fo)
+                    writer.writerow(next(reader))  # header
+                    for _, row in zip(range(n), reader):
+                        writer.writerow(row)
+            os.replace(tmp, self.path)
+        else:
+            import pyarrow.parquet as pq
+
+            try:
+                table = pq.read_table(self.path).slice(0, n)
+            except Exception as error:
+                raise RuntimeError(
+                    f"Cannot read {self.path}; a Parquet file is only complete after the writing is finished."
+                ) from error
+            self._parquet_writer = pq.ParquetWriter(self.path, self._schema())
+            self._parquet_writer.write_table(table.cast(self._schema()))
+            self._complete = False
+
+    def _schema(self) -> "pyarrow.Schema":
+        import pyarrow as pa
+
+        types = {bool: pa.bool_(), int: pa.int64(), float: pa.float64()}
+        fields = [
+            ("molecule", pa.string()),
+            ("smiles", pa.string()),
+            ("valid", pa.bool_()),
+            ("entropy", pa.float64()),
+        ]
+        fields += [
+            (k, types.get(type(v), pa.string())) for k, v in self.metadata.items()
+        ]
+        return pa.schema(fields, metadata={"chembfn_webui": json.dumps(self.metadata)})
+
+    def _write_csv_gz(self, records: List[Record], fn: Path, mode: str = "wt") -> None:
+        # every call adds one gzip member; concatenated members form a valid gzip file
+        with gzip.open(fn, mode, encoding="utf-8", newline="") as f:
+            writer = csv.DictWriter(f, COLUMNS + tuple(self.metadata))
+            if mode == "wt":
+                writer.writeheader()
+            writer.writerows(_rows(records, self.metadata))
+
+    def _append(self, records: List[Record]) -> None:
+        if not records:
+            return
+        if self.fmt == "csv":
+            with open(self.path, "a", encoding="utf-8", newline="") as f:
+                f.write(
+                    ("" if self._empty else "\n") + "\n".join(i.string for i in records)
+                )
+        elif self.fmt == "csv.gz":
+            self._write_csv_gz(records, self.path, "at")
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            schema = self._schema()
+            if self._parquet_writer is None:
+                self._parquet_writer = pq.ParquetWriter(self.path, schema)
+                self._complete = False
+            table = pa.Table.from_pylist(_rows(records, self.metadata), schema)
+            self._parquet_writer.write_table(table)
+        self._empty = False
+
+    def _write(self, records: List[Record]) -> None:
+        tmp = self.path.with_name(f"{self.path.name}.tmp")
+        if self.fmt == "csv":
+            with open(tmp, "w", encoding="utf-8", newline="") as f:
+                f.write("\n".join(i.string for i in records))
+        elif self.fmt == "csv.gz":
+            self._write_csv_gz(records, tmp)
+        else:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+
+            if self._parquet_writer is not None:
+                self._parquet_writer.close()
+                self._parquet_writer = None
+            schema = self._schema()
+            pq.write_table(
+                pa.Table.from_pylist(_rows(records, self.metadata), schema), tmp
+            )
+        os.replace(tmp, self.path)
+        self._empty = not records
+        self._complete = True
+
+    def _close(self) -> None:
+        if self._parquet_writer is not None:
+            self._parquet_writer.close()
+            self._parquet_writer = None
+        elif self.fmt == "parquet" and not self.path.exists():
+            self._write([])  # an empty table
+        self._complete = True
+
+    def append(self, records: List[Record]) -> Future:
+        """
+        Append results to the file.
+
+        :param records: records of generated molecules
+        :type records: list
+        :return: a future of the writing
+        :rtype: concurrent.futures.Future
+        """
+        self._future = _io_executor.submit(self._append, records)
+        return self._future
+
+    def write(self, records: List[Record]) -> Future:
+        """
+        Replace the content of the file.
+
+        :param records: records of generated molecules
+        :type records: list
+        :return: a future of the writing
+        :rtype: concurrent.futures.Future
+        """
+        self._future = _io_executor.submit(self._write, records)
+        return self._future
+
+    def close(self) -> Future:
+        """
+        Finish the file. Calling this method more than once is harmless.
+
+        :return: a future of the writing
+        :rtype: concurrent.futures.Future
+        """
+        self._future = _io_executor.submit(self._close)
+        return self._future
+
+    @property
+    def done(self) -> bool:
+        """
+        Whether all submitted writings are finished and the file can be read.
+
+        :return: `True` if finished
+        :rtype: bool
+        """
+        return self._future.done() and self._complete
+
+    def wait(self) -> None:
+        """
+        Wait until all submitted writings are finished.
+
+        :return:
+        :rtype: None
+        """
+        self._future.result()
+
+
+if __name__ == "__main__":
+    ...
@@ -0,0 +1,344 @@
+# -*- coding: utf-8 -*-
+# Author: Nianze A. TAO (omozawa SUENO)
+"""
+Generate molecules without the web-UI.
+"""
+import sys
+import json
+import time
+import argparse
+from pathlib import Path
+from functools import partial
+from typing import Dict, List, Optional, Any
+
+# the same defaults as the web-UI
+JOB_DEFAULTS = {
+    "model": None,
+    "tokeniser": "SMILES & SAFE",
+    "vocabulary": None,
+    "prompt": "",
+    "scaffold": "",
+    "template": "",
+    "step": 100,
+    "batch_size": 512,
+    "count": 512,
+    "target": 0,
+    "sequence_length": 50,
+    "guidance_strength": 4.0,
+    "method": "BFN",
+    "temperature": 0.5,
+    "sar_control": "F",
+    "exclude_token": "",
+    "quantise": False,
+    "jited": False,
+    "result_prep_fn": "lambda x: x",
+    "output": "results.csv",
+    "seed": None,
+    "shards": 1,
+    "threads": None,
+    "length_buckets": "",
+}
+# a campaign can be extended by increasing `count` before resuming
+_RESUMABLE_CHANGES = (
+    "count",
+    "target",
+    "output",
+    "shards",
+    "threads",
+    "length_buckets",
+)
+# settings that do not change what is generated
+_RUNTIME_KEYS = _RESUMABLE_CHANGES + ("batch_size",)
+
+
+def load_job(fn: Path) -> Dict[str, Any]:
+    """
+    Load a job file. \n
+    A job file is a JSON file, e.g., ```
+    {
+        "model": "zinc15_190m.pt",
+        "tokeniser": "SMILES & SAFE",
+        "prompt": "<csd_ees:1>:[1,0,0]",
+        "step": 100,
+        "batch_size": 512,
+        "count": 1000000,
+        "output": "zinc_ees.csv.gz"
+    }```
+    where `"output"` ends with `.csv`, `.csv.gz` or `.parquet` and
+    the other keys default to the values in `JOB_DEFAULTS`.
+    Set `"target"` to stop as soon as this many valid samples are found,
+    in which case `"count"` is the maximum number of samples.
+    Set `"shards"` to split each batch across several worker processes
+    using `"threads"` threads each (or the main process when `"shards"` is 1),
+    and `"seed"` to make the samples reproducible.
+    Set `"length_buckets"` to a list of shorter sequence lengths (or `"auto"`)
+    to sample short molecules without padding them to the full length.
+
+    :param fn: job file name
+    :type fn: pathlib.Path
+    :return: job settings
+    :rtype: dict
+    """
+    with open(fn, "r", encoding="utf-8") as f:
+        job = json.load(f)
+    unknown = set(job) - set(JOB_DEFAULTS)
+    if unknown:
+        raise ValueError(f"Unknown keys in the job file: {sorted(unknown)}")
+    job = JOB_DEFAULTS | job
+    if job["model"] is None:
+        raise ValueError("The job file should specify a model.")
+    return job
+
+
+def result_format(fn: Path) -> str:
+    """
+    Get the result format from the file name.
+
+    :param fn: file name
+    :type fn: pathlib.Path
+    :return: `"csv"`, `"csv.gz"` or `"parquet"`
+    :rtype: str
+    """
+    name = Path(fn).name
+    if name.endswith(".parquet"):
+        return "parquet"
+    if name.endswith(".gz"):
+        return "csv.gz"
+    return "csv"
+
+
+def _save_checkpoint(fn: Path, job: Dict[str, Any], state: Dict[str, Any]) -> None:
+    tmp = fn.with_name(f"{fn.name}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"job": job} | state, f, indent=2)
+    tmp.replace(fn)
+
+
+def _load_checkpoint(fn: Path, job: Dict[str, Any]) -> Dict[str, Any]:
+    with open(fn, "r", encoding="utf-8") as f:
+        state = json.load(f)
+    old_job = state.pop("job")
+    changed = [
+        k for k in job if k not in _RESUMABLE_CHANGES and old_job.get(k) != job[k]
+    ]
+    if changed:
+        raise ValueError(
+            f"Cannot resume from {fn} as the job settings {changed} have changed."
+        )
+    return state
+
+
+def _log(*args: Any, **kargs: Any) -> None:
+    print(*args, file=sys.stderr, flush=True, **kargs)
+
+
+def run_job(
+    job: Dict[str, Any], resume: bool = False, quiet: bool = False
+) -> Dict[str, Any]:
+    """
+    Generate molecules in chunks of `batch_size` until `count` samples are generated
+    or, if `target` is set, `target` valid samples are found. \n
+    Valid results are appended to the output file after each chunk and
+    the progress is saved to `{output}.ckpt` so that an interrupted job can be resumed.
+
+    :param job: job settings returned by `load_job()`
+    :param resume: whether to resume from the checkpoint
+    :param quiet: whether to hide the progress
+    :type job: dict
+    :type resume: bool
+    :type quiet: bool
+    :return: final state, i.e., `{"n_sampled": ..., "n_saved": ..., "finished": ...}`
+    :rtype: dict
+    """
+    # heavy modules are only imported to run a job, so that `--help` is fast
+    from .utilities import (
+        find_model,
+        find_vocab,
+        parse_prompt,
+        parse_exclude_token,
+        parse_sar_control,
+        parse_length_buckets,
+        build_result_prep_fn,
+    )
+    from .pipeline import build_tokeniser, build_model, build_input
+    from .scheduler import generate, next_round_size, length_stats
+    from .shard import ModelSpec, ShardPool, shard_seed
+    from .runtime import configure_torch
+    from .postprocess import build_records
+    from .export import ResultWriter, check_format
+
+    output = Path(job["output"])
+    ckpt_fn = output.with_name(f"{output.name}.ckpt")
+    fmt = result_format(output)
+    check_format(fmt)
+    state = {"n_sampled": 0, "n_saved": 0, "finished": False}
+    keep = None
+    if resume and ckpt_fn.exists():
+        state = _load_checkpoint(ckpt_fn, job)
+        keep = state["n_saved"]
+    elif resume and output.exists():
+        raise FileNotFoundError(f"Cannot find the checkpoint {ckpt_fn} to resume.")
+    elif output.exists():
+        raise FileExistsError(f"{output} exists; use --resume to continue the job.")
+    log = (lambda *_, **__: None) if quiet else _log
+    # ------- build tokeniser, model and input as the web-UI does -------
+    vocab_keys, tokeniser = build_tokeniser(
+        job["tokeniser"], job["vocabulary"], find_vocab()
+    )
+    prompt_info = parse_prompt(job["prompt"])
+    sar_flag = parse_sar_control(job["sar_control"])
+    models = find_model()
+    if job["model"] not in [i[0] for i in models["base"] + models["standalone"]]:
+        raise ValueError(f"Cannot find model: {job['model']}")
+    spec = ModelSpec(
+        job["model"],
+        prompt_info,
+        sar_flag,
+        job["sequence_length"],
+        job["quantise"],
+        job["jited"],
+        models,
+    )
+    bfn, y, lmax, messages = build_model(*spec)
+    mode, x, _messages = build_input(job["scaffold"], job["template"], tokeniser, lmax)
+    for message in messages + _messages:
+        log(message)
+    method = "bfn" if job["method"] == "BFN" else f"ode:{job['temperature']}"
+    allowed_tokens = parse_exclude_token(job["exclude_token"], vocab_keys)
+    if not allowed_tokens:
+        allowed_tokens = "all"
+    result_prep_fn = build_result_prep_fn(job["result_prep_fn"])
+    buckets = job["length_buckets"]
+    if not isinstance(buckets, list):
+        buckets = parse_length_buckets(buckets)
+    if mode != "sample":
+        buckets = []
+    length_key = (
+        job["model"],
+        job["tokeniser"],
+        job["vocabulary"],
+        str(prompt_info),
+        tuple(sar_flag),
+    )
+    metadata = {k: job[k] for k in JOB_DEFAULTS if k not in _RUNTIME_KEYS}
+    metadata["sequence_length"] = lmax
+    # ------- generate -------
+    if job["shards"] > 1:
+        shard_pool = ShardPool(job["shards"], job["threads"])
+        run_chunk = partial(shard_pool.generate, spec=spec)
+    else:
+        shard_pool = None
+        run_chunk = partial(generate, model=bfn, y=y)
+        configure_torch(job["threads"])
+    writer = ResultWriter(fmt=fmt, metadata=metadata, path=output, keep=keep)
+    t0, n0 = time.time(), state["n_sampled"]
+    try:
+        while state["n_sampled"] < job["count"]:
+            if 0 < job["target"] <= state["n_saved"]:
+                break
+            chunk = min(job["batch_size"], job["count"] - state["n_sampled"])
+            if job["target"] > 0 and state["n_sampled"] > 0:
+                # do not sample much more than needed for the last few samples
+                n_needed = next_round_size(
+                    job["target"] - state["n_saved"],
+                    state["n_saved"],
+                    state["n_sampled"],
+                    job["batch_size"],
+                )
+                chunk = min(chunk, n_needed)
+            # every chunk has its own seed so that a resumed job gives the same samples
+            seed = job["seed"]
+            if seed is not None:
+                seed = shard_seed(seed, state["n_sampled"])
+            [(mols, entropy)] = run_chunk(
+                [(x, chunk)],
+                mode=mode,
+                sequence_size=lmax,
+                sample_step=job["step"],
+                guidance_strength=job["guidance_strength"],
+                vocab_keys=vocab_keys,
+                method=method,
+                allowed_tokens=allowed_tokens,
+                sort=False,
+                seed=seed,
+                buckets=(
+                    length_stats.buckets(length_key, lmax)
+                    if buckets == "auto"
+                    else buckets
+                ),
+            )
+            if mode == "sample":
+                length_stats.update(length_key, [len(tokeniser(i)) + 2 for i in mols])
+            mols = [result_prep_fn(i) for i in mols]
+            records = [
+                i for i in build_records(mols, entropy, job["tokeniser"]) if i.valid
+            ]
+            if job["target"] > 0:
+                records = records[: job["target"] - state["n_saved"]]
+            # the last chunk has been written while this chunk was being generated
+            writer.wait()
+            _save_checkpoint(ckpt_fn, job, state)
+            writer.append(records)
+            state["n_sampled"] += chunk
+            state["n_saved"] += len(records)
+            speed = (state["n_sampled"] - n0) / (time.time() - t0)
+            log(
+                f"\r{state['n_sampled']}/{job['count']} sampled; "
+                f"{state['n_saved']} valid; {speed:.1f} samples/s",
+                end="",
+            )
+        state["finished"] = True
+    finally:
+        if shard_pool is not None:
+            shard_pool.shutdown()
+        writer.close()
+        writer.wait()
+        _save_checkpoint(ckpt_fn, job, state)
+        log()
+    return state
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """
+    Entry of `chembfn generate`.
+
+    :param argv: command line arguments
+    :type argv: list | None
+    :return:
+    :rtype: None
+    """
+    parser = argparse.ArgumentParser(
+        prog="chembfn generate",
+        description="Generate molecules without the web-UI.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("job", type=Path, help="job file in JSON format")
+    parser.add_argument(
+        "-o", "--output", type=Path, help="output file overriding the job file"
+    )
+    parser.add_argument(
+        "-r",
+        "--resume",
+        default=False,
+        action="store_true",
+        help="resume an interrupted job from its checkpoint",
+    )
+    parser.add_argument(
+        "-q", "--quiet", default=False, action="store_true", help="hide the progress"
+    )
+    args = parser.parse_args(argv)
+    job = load_job(args.job)
+    if args.output is not None:
+        job["output"] = str(args.output)
+    try:
+        state = run_job(job, args.resume, args.quiet)
+    except KeyboardInterrupt:
+        sys.exit("Interrupted; run again with --resume to continue.")
+    except (FileExistsError, FileNotFoundError, ValueError) as error:
+        sys.exit(f"{type(error).__name__}: {error}")
+    if not args.quiet:
+        _log(f"{state['n_saved']} valid samples saved to {job['output']}.")
+
+
+if __name__ == "__main__":
+    ...
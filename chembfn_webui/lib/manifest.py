@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+# Author: Nianze A. TAO (omozawa SUENO)
+"""
+Index of the model folder.
+"""
+import os
+import json
+import threading
+import importlib.util
+from pathlib import Path
+from typing import Dict, List, Union, Optional, Any
+
+_MANIFEST_NAME = ".manifest.json"
+_MANIFEST_VERSION = 1
+
+
+def _mtime(path: Path) -> Optional[int]:
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+class ModelIndex:
+    """
+    Models and vocabularies found in a model folder.
+    """
+
+    def __init__(self, model_path: Path, manifest_fn: Optional[Path] = None) -> None:
+        """
+        The result of the last scan is kept in a manifest file
+        (`model_path/.manifest.json` by default), so that a scan only
+        lists the folders whose modification time has changed and
+        only parses the `config.json` files that have changed.
+        If the manifest cannot be written, e.g., on a read-only file system,
+        the index is only kept in memory.
+
+        :param model_path: model folder
+        :param manifest_fn: manifest file
+        :type model_path: pathlib.Path
+        :type manifest_fn: pathlib.Path | None
+        """
+        self.model_path = Path(model_path)
+        if manifest_fn is None:
+            manifest_fn = self.model_path / _MANIFEST_NAME
+        self.manifest_fn = Path(manifest_fn)
+        self._data: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._observer = None
+        self._dirty = True
+        try:
+            with open(self.manifest_fn, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == _MANIFEST_VERSION:
+                self._data = data
+        except (OSError, ValueError):
+            pass
+
+    def _scan_files(self, group: str, suffix: str) -> bool:
+        folder = self.model_path / group
+        mtime = _mtime(folder)
+        old = self._data.get(group)
+        if old is not None and old["mtime"] == mtime:
+            return False
+        names = []
+        if mtime is not None:
+            names = sorted(i.name for i in folder.iterdir() if i.suffix == suffix)
+        self._data[group] = {"mtime": mtime, "names": names}
+        return True
+
+    def _scan_folders(self, group: str, weight_name: str) -> bool:
+        folder = self.model_path / group
+        mtime = _mtime(folder)
+        old = self._data.get(group, {"mtime": None, "folders": {}})
+        changed = old["mtime"] != mtime or group not in self._data
+        if changed and mtime is not None:
+            names = sorted(i.name for i in folder.iterdir() if i.is_dir())
+        elif changed:
+            names = []
+        else:
+            names = list(old["folders"])
+        folders = {}
+        for name in names:
+            sub = folder / name
+            sub_mtime, config_mtime = _mtime(sub), _mtime(sub / "config.json")
+            item = old["folders"].get(name)
+            if (
+                item is not None
+                and item["mtime"] == sub_mtime
+                and item["config_mtime"] == config_mtime
+            ):
+                folders[name] = item
+                continue
+            changed = True
+            info = None
+            if config_mtime is not None and (sub / weight_name).exists():
+                with open(sub / "config.json", "r", encoding="utf-8") as f:
+                    config = json.load(f)
+                info = [config["name"], config["label"], config["padding_length"]]
+            folders[name] = {
+                "mtime": sub_mtime,
+                "config_mtime": config_mtime,
+                "info": info,
+            }
+        self._data[group] = {"mtime": mtime, "folders": folders}
+        return changed
+
+    def _save(self) -> None:
+        tmp = self.manifest_fn.with_name(f"{self.manifest_fn.name}.tmp")
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self._data, f)
+            os.replace(tmp, self.manifest_fn)
+        except OSError:
+            pass
+
+    def scan(self) -> None:
+        """
+        Update the index. When a watcher is running, nothing is done
+        unless the watcher has seen a change.
+
+        :return:
+        :rtype: None
+        """
+        with self._lock:
+            if self._observer is not None and not self._dirty:
+                return
+            self._dirty = False
+            changed = self._data.get("version") != _MANIFEST_VERSION
+            self._data["version"] = _MANIFEST_VERSION
+            changed |= self._scan_files("base_model", ".pt")
+            changed |= self._scan_files("vocab", ".txt")
+            changed |= self._scan_folders("standalone_model", "model.pt")
+            changed |= self._scan_folders("lora", "lora.pt")
+            if changed:
+                self._save()
+
+    def models(self) -> Dict[str, List[List[Union[str, int, List[str], Path]]]]:
+        """
+        Get the models in the format of `~lib.utilities.find_model()`.
+
+        :return: models
+        :rtype: dict
+        """
+        self.scan()
+        models = {}
+        folder = self.model_path / "base_model"
+        models["base"] = [
+            [i, str(folder / i)] for i in self._data["base_model"]["names"]
+        ]
+        for key, group in (("standalone", "standalone_model"), ("lora", "lora")):
+            folder = self.model_path / group
+            models[key] = [
+                [v["info"][0], folder / k, v["info"][1], v["info"][2]]
+                for k, v in self._data[group]["folders"].items()
+                if v["info"] is not None
+            ]
+        return models
+
+    def vocabs(self) -> Dict[str, str]:
+        """
+        Get the vocabularies in the format of `~lib.utilities.find_vocab()`.
+
+        :return: vocabularies
+        :rtype: dict
+        """
+        self.scan()
+        folder = self.model_path / "vocab"
+        return {
+            i[:-4]: str(folder / i)
+            for i in self._data["vocab"]["names"]
+            if i != "place_vocabulary_file_here.txt"
+        }
+
+    def watch(self) -> None:
+        """
+        Watch the model folder so that a scan is only done after a change. \n
+        This requires `watchdog`.
+
+        :return:
+        :rtype: None
+        """
+        if importlib.util.find_spec("watchdog") is None:
+            raise ImportError(
+                "Watching the model folder requires watchdog; install it via `pip install watchdog`."
+            )
+        from watchdog.observers import Observer
+        from watchdog.events import FileSystemEventHandler
+
+        index = self
+        ignored = (self.manifest_fn.name, f"{self.manifest_fn.name}.tmp")
+
+        class _Handler(FileSystemEventHandler):
+            def on_any_event(self, event: Any) -> None:
+                # reading the files while scanning is not a change, and
+                # a folder is modified when its files are created or deleted
+                if event.event_type not in ("created", "deleted", "modified", "moved"):
+                    return
+                if event.is_directory and event.event_type == "modified":
+                    return
+                if Path(os.fsdecode(event.src_path)).name not in ignored:
+                    index._dirty = True
+
+        with self._lock:
+            if self._observer is not None:
+                return
+            observer = Observer()
+            observer.schedule(_Handler(), str(self.model_path), recursive=True)
+            observer.daemon = True
+            observer.start()
+            self._observer = observer
+            self._dirty = True
+
+    def stop(self) -> None:
+        """
+        Stop watching the model folder.
+
+        :return:
+        :rtype: None
+        """
+        with self._lock:
+            if self._observer is not None:
+                self._observer.stop()
+                self._observer = None
+
+
+if __name__ == "__main__":
+    ...
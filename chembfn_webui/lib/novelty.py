@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+# Author: Nianze A. TAO (omozawa SUENO)
+"""
+Remember generated molecules to drop repeated ones.
+"""
+import threading
+from pathlib import Path
+from typing import List, Optional, Literal, Iterable
+from rdkit.Chem import MolToInchiKey  # type: ignore
+from .postprocess import Record
+from .options import KEYS
+
+
+def record_key(record: Record, key: Literal["smiles", "inchikey"] = "smiles") -> str:
+    """
+    Get the identity of a generated molecule.
+
+    :param record: record of a generated molecule
+    :param key: `"smiles"` for canonical SMILES or `"inchikey"` for InChIKey
+    :type record: lib.postprocess.Record
+    :type key: str
+    :return: canonical SMILES or InChIKey; the generated string if it is not a molecule
+    :rtype: str
+    """
+    if record.mol is None:
+        return record.string
+    if key == "inchikey":
+        return MolToInchiKey(record.mol) or record.smiles
+    return record.smiles
+
+
+class NoveltyIndex:
+    """
+    A set of seen molecules.
+    """
+
+    def __init__(self, fn: Optional[Path] = None) -> None:
+        """
+        The keys are kept in memory;
+        if `fn` is given, the keys are loaded from and appended to the file as well
+        so that the index outlives the program.
+
+        :param fn: index file holding one key per line
+        :type fn: pathlib.Path | None
+        """
+        self.fn = None if fn is None else Path(fn)
+        self._keys = set()
+        self._lock = threading.Lock()
+        if self.fn is not None and self.fn.exists():
+            with open(self.fn, "r", encoding="utf-8") as f:
+                self._keys.update(i for i in f.read().split("\n") if i)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._keys
+
+    def update(self, keys: Iterable[str]) -> List[bool]:
+        """
+        Add keys to the index.
+
+        :param keys: keys of molecules
+        :type keys: iterable
+        :return: whether each key was new; a repeated key in `keys` is only new at its first place
+        :rtype: list
+        """
+        flags, new = [], []
+        with self._lock:
+            for key in keys:
+                flags.append(key not in self._keys)
+                if flags[-1]:
+                    self._keys.add(key)
+                    new.append(key)
+            if new and self.fn is not None:
+                self.fn.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.fn, "a", encoding="utf-8") as f:
+                    f.write("".join(f"{i}\n" for i in new))
+        return flags
+
+
+def deduplicate(
+    records: List[Record],
+    indices: List[NoveltyIndex],
+    key: Literal["smiles", "inchikey"] = "smiles",
+) -> List[Record]:
+    """
+    Drop the records repeated in the list or already seen by any of the indices.
+    Only the kept records are added to the indices.
+
+    :param records: records of generated molecules
+    :param indices: indices of seen molecules
+    :param key: `"smiles"` or `"inchikey"`
+    :type records: list
+    :type indices: list
+    :type key: str
+    :return: new records
+    :rtype: list
+    """
+    keys = [record_key(i, key) for i in records]
+    seen = set()
+    kept = []
+    for idx, k in enumerate(keys):
+        if k not in seen and not any(k in i for i in indices):
+            kept.append(idx)
+        seen.add(k)
+    # a key added by another caller in the meantime is dropped here
+    flags = [True] * len(kept)
+    for index in indices:
+        new = index.update([keys[i] for i in kept])
+        flags = [i and j for i, j in zip(flags, new)]
+    return [records[i] for i, flag in zip(kept, flags) if flag]
+
+
+if __name__ == "__main__":
+    ...
@@ -0,0 +1,10 @@
+# -*- coding: utf-8 -*-
+# Author: Nianze A. TAO (omozawa SUENO)
+"""
+Choices of command line options that are read before any heavy module is imported.
+"""
+
+# result file formats (see `~lib.export.ResultWriter`)
+FORMATS = ("csv", "csv.gz", "parquet")
+# how repeated molecules are recognised (see `~lib.novelty.record_key()`)
+KEYS = ("smiles", "inchikey")
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+# Author: Nianze A. TAO (omozawa SUENO)
+"""
+Build tokenisers, models and model inputs from user settings.
+"""
+import os
+from pathlib import Path
+from typing import Dict, List, Tuple, Union, Optional, Literal
+import torch
+from bayesianflow_for_chem import ChemBFN, EnsembleChemBFN
+from .utilities import LoRAError
+from .tokeniser import Tokeniser, tokenisers
+from .cache import load_model, load_mlp, load_ensemble
+
+
+def build_tokeniser(
+    token_name: Literal["SMILES & SAFE", "SELFIES", "FASTA"],
+    vocab_fn: Optional[str],
+    vocabs: Dict[str, str],
+) -> Tuple[List[str], Tokeniser]:
+    """
+    Build the tokeniser. A tokeniser is only built once (see `~lib.tokeniser.TokeniserRegistry`).
+
+    :param token_name: tokeniser name
+    :param vocab_fn: customised vocabulary name; only used by SELFIES tokeniser
+    :param vocabs: customised vocabularies found by `~lib.utilities.find_vocab()`
+    :type token_name: str
+    :type vocab_fn: str | None
+    :type vocabs: dict
+    :return: a list of (ordered) vocabulary \n
+             tokeniser
+    :rtype: tuple
+    """
+    vocab_file = vocabs[vocab_fn] if token_name == "SELFIES" else None
+    tokeniser = tokenisers.get(token_name, vocab_file)
+    return tokeniser.vocab_keys, tokeniser
+
+
+def _objective_tensor(obj: Union[List[float], List[List[float]]]) -> torch.Tensor:
+    # a list of objective vectors gives one row each, so that an MLP embeds them in one pass
+    if obj and isinstance(obj[0], (list, tuple)):
+        return torch.tensor(obj, dtype=torch.float32)
+    return torch.tensor([obj], dtype=torch.float32)
+
+
+@torch.no_grad()
+def build_model(
+    model_name: str,
+    prompt_info: Dict[str, List],
+    sar_flag: List[bool],
+    sequence_size: int,
+    quantise: bool,
+    jited: bool,
+    models: Dict[str, List[List[Union[str, int, List[str], Path]]]],
+) -> Tuple[
+    Union[ChemBFN, EnsembleChemBFN],
+    Optional[Union[torch.Tensor, List[torch.Tensor]]],
+    int,
+    List[str],
+]:
+    """
+    Build the model and the conditioning vector(s) described by the prompt.
+
+    :param model_name: model name
+    :param prompt_info: parsed prompt returned by `~lib.utilities.parse_prompt()`;
+                        each objective can also be a list of objective vectors, e.g., of a sweep,
+                        giving one conditioning vector for each
+    :param sar_flag: semi-autoregressive flags returned by `~lib.utilities.parse_sar_control()`
+    :param sequence_size: maximum sequence length used by base models
+    :param quantise: whether to quantise the model
+    :param jited: whether to compile the model
+    :param models: models found by `~lib.utilities.find_model()`
+    :type model_name: str
+    :type prompt_info: dict
+    :type sar_flag: list
+    :type sequence_size: int
+    :type quantise: bool
+    :type jited: bool
+    :type models: dict
+    :return: ChemBFN model \n
+             conditioning vector(s) \n
+             maximum sequence length \n
+             messages
+    :rtype: tuple
+    """
+    messages = []
+    base_model_dict = dict(models["base"])
+    # old code for reference:
+    # standalone_model_dict = dict([[i[0], i[1]] for i in models["standalone"]])
+    # lora_model_dict = dict([[i[0], i[1]] for i in models["lora"]])
+    # standalone_label_dict = dict([[i[0], i[2] != []] for i in models["standalone"]])
+    # lora_label_dict = dict([[i[0], i[2] != []] for i in models["lora"]])
+    # standalone_lmax_dict = dict([[i[0], i[3]] for i in models["standalone"]])
+    # lora_lmax_dict = dict([[i[0], i[3]] for i in models["lora"]])
+    standalone_model_dict = {i[0]: i[1] for i in models["standalone"]}
+    lora_model_dict = {i[0]: i[1] for i in models["lora"]}
+    standalone_label_dict = {i[0]: i[2] != [] for i in models["standalone"]}
+    lora_label_dict = {i[0]: i[2] != [] for i in models["lora"]}
+    standalone_lmax_dict = {i[0]: i[3] for i in models["standalone"]}
+    lora_lmax_dict = {i[0]: i[3] for i in models["lora"]}
+    # ------- build model -------
+    if not prompt_info["lora"]:
+        if model_name in base_model_dict:
+            lmax = sequence_size
+            bfn = load_model(
+                base_model_dict[model_name],
+                sar_flag=sar_flag[0],
+                quantise=quantise,
+                jited=jited,
+            )
+            y = None
+            if prompt_info["objective"]:
+                messages.append("Objective values ignored by base model.")
+        else:
+            lmax = standalone_lmax_dict[model_name]
+            bfn = load_model(
+                standalone_model_dict[model_name] / "model.pt",
+                sar_flag=sar_flag[0],
+                quantise=quantise,
+                jited=jited,
+            )
+            if prompt_info["objective"]:
+                if not standalone_label_dict[model_name]:
+                    y = None
+                    messages.append("Objective values ignored.")
+                elif not os.path.exists(standalone_model_dict[model_name] / "mlp.pt"):
+                    y = None
+                    messages.append(
+                        "Objective values ignored as no MLP model was found."
+                    )
+                else:
+                    mlp = load_mlp(standalone_model_dict[model_name] / "mlp.pt")
+                    y = mlp.forward(_objective_tensor(prompt_info["objective"][0]))
+            else:
+                y = None
+            messages.append(f"Sequence length set to {lmax} from model metadata.")
+    elif len(prompt_info["lora"]) == 1:
+        if not (lm := prompt_info["lora"][0]) in lora_model_dict:
+            raise LoRAError(f"Cannot find LoRA model: &lt{lm}&gt")
+        lmax = lora_lmax_dict[prompt_info["lora"][0]]
+        if model_name in base_model_dict:
+            base_model_dir = base_model_dict[model_name]
+        else:
+            base_model_dir = standalone_model_dict[model_name] / "model.pt"
+        bfn = load_model(
+            base_model_dir,
+            lora_model_dict[prompt_info["lora"][0]] / "lora.pt",
+            prompt_info["lora_scaling"][0],
+            sar_flag[0],
+            quantise,
+            jited,
+        )
+        if prompt_info["objective"]:
+            if not lora_label_dict[prompt_info["lora"][0]]:
+                y = None
+                messages.append("Objective values ignored.")
+            elif not os.path.exists(lora_model_dict[prompt_info["lora"][0]] / "mlp.pt"):
+                y = None
+                messages.append("Objective values ignored as no MLP model was found.")
+            else:
+                mlp = load_mlp(lora_model_dict[prompt_info["lora"][0]] / "mlp.pt")
+                y = mlp.forward(_objective_tensor(prompt_info["objective"][0]))
+        else:
+            y = None
+        messages.append(f"Sequence length set to {lmax} from model metadata.")
+    else:
+        for i in prompt_info["lora"]:
+            if not i in lora_model_dict:
+                raise LoRAError(f"Cannot find LoRA model: &lt{i}&gt")
+            if not os.path.exists(lora_model_dict[i] / "mlp.pt"):
+                raise LoRAError(
+                    f"Cannot find MLP model associated with LoRA model: &lt{i}&gt"
+                )
+        lmax = max(lora_lmax_dict[i] for i in prompt_info["lora"])
+        if model_name in base_model_dict:
+            base_model_dir = base_model_dict[model_name]
+        else:
+            base_model_dir = standalone_model_dict[model_name] / "model.pt"
+            lmax = max([lmax, standalone_lmax_dict[model_name]])
+        lora_dir = [lora_model_dict[i] / "lora.pt" for i in prompt_info["lora"]]
+        mlp_dir = [lora_model_dict[i] / "mlp.pt" for i in prompt_info["lora"]]
+        weights = prompt_info["lora_scaling"]
+        if len(sar_flag) == 1:
+            sar_flag = [sar_flag[0] for _ in range(len(weights))]
+        bfn = load_ensemble(
+            base_model_dir,
+            lora_dir,
+            mlp_dir,
+            weights,
+            sar_flag,
+            quantise,
+            jited,
+        )
+        y = (
+            [_objective_tensor(i) for i in prompt_info["objective"]]
+            if prompt_info["objective"]
+            else None
+        )
+        messages.append(f"Sequence length set to {lmax} from model metadata.")
+    return bfn, y, lmax, messages
+
+
+def _input_list(inputs: Union[str, List[str], None]) -> List[str]:
+    inputs = [inputs] if isinstance(inputs, str) else list(inputs or [])
+    return [i.strip() for i in inputs if i.strip()]
+
+
+def build_input(
+    scaffold: Union[str, List[str], None],
+    template: Union[str, List[str], None],
+    tokeniser: Tokeniser,
+    lmax: int,
+) -> Tuple[Literal["sample", "inpaint", "optimise"], Optional[torch.Tensor], List[str]]:
+    """
+    Choose the generation mode and build the model input.
+
+    :param scaffold: molecular scaffold or a list of scaffolds
+    :param template: molecular template or a list of templates
+    :param tokeniser: tokeniser function
+    :param lmax: maximum sequence length
+    :type scaffold: str | list | None
+    :type template: str | list | None
+    :type tokeniser: lib.tokeniser.Tokeniser
+    :type lmax: int
+    :return: `"inpaint"` if a scaffold is given, `"optimise"` if a template is given, otherwise `"sample"` \n
+             token indices of the scaffold(s)/template(s), one row each;  shape: (n_s, n_t) \n
+             messages
+    :rtype: tuple
+    """
+    messages = []
+    scaffolds, templates = _input_list(scaffold), _input_list(template)
+    if scaffolds:
+        mode = "inpaint"
+        x = tokeniser.encode(scaffolds, lmax, end=False)
+        if templates:
+            messages.append(f"Molecular template {', '.join(templates)} ignored.")
+    elif templates:
+        mode = "optimise"
+        x = tokeniser.encode(templates, lmax)
+    else:
+        mode = "sample"
+        x = None
+    return mode, x, messages
+
+
+if __name__ == "__main__":
+    ...
@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+# Author: Nianze A. TAO (omozawa SUENO)
+"""
+Post-processing of generated molecules.
+"""
+import os
+import json
+import time
+import hashlib
+import threading
+import itertools
+import multiprocessing
+import multiprocessing.pool
+from pathlib import Path
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple, Optional, NamedTuple, Literal, Generator, Any
+from rdkit.Chem import Draw, Mol, MolFromSmiles, MolToSmiles  # type: ignore
+from selfies import decoder
+from mol2chemfigPy3 import mol2chemfig
+
+_CACHE_DIR = Path(__file__).parent.parent / "cache"
+_IMAGE_CACHE_DIR = _CACHE_DIR / "images"
+_IMAGE_CACHE_SIZE = int(os.environ.get("CHEMBFN_WEBUI_IMAGE_CACHE", 10000))
+_IMAGE_SIZE = (500, 500)
+# below this number of images, starting worker processes costs more than drawing
+_POOL_THRESHOLD = 32
+_CHEMFIG_TIMEOUT = float(os.environ.get("CHEMBFN_WEBUI_CHEMFIG_TIMEOUT", 10))
+
+
+class Record(NamedTuple):
+    """
+    A generated molecule parsed once and shared by all post-processing stages.
+    """
+
+    string: str  # generated string
+    mol: Optional[Mol]  # RDKit molecule; `None` for proteins or unparsable strings
+    smiles: Optional[str]  # canonical SMILES
+    valid: bool
+    entropy: float
+    tags: Optional[
+        Dict[str, Any]
+    ] = None  # settings of the group (e.g., scaffold) of the molecule
+
+
+def build_records(
+    strings: List[str],
+    entropy: List[float],
+    token_name: Literal["SMILES & SAFE", "SELFIES", "FASTA"],
+) -> List[Record]:
+    """
+    Decode and parse generated strings.
+
+    :param strings: generated strings
+    :param entropy: entropy of each sample
+    :param token_name: tokeniser name
+    :type strings: list
+    :type entropy: list
+    :type token_name: str
+    :return: a list of records
+    :rtype: list
+    """
+    records = []
+    for string, e in zip(strings, entropy):
+        mol = None
+        if string and token_name != "FASTA":
+            mol = MolFromSmiles(decoder(string) if token_name == "SELFIES" else string)
+        smiles = None if mol is None else MolToSmiles(mol)
+        # SMILES should be understood by RDKit; SELFIES and FASTA are always kept
+        valid = bool(string) and (mol is not None or token_name != "SMILES & SAFE")
+        records.append(Record(string, mol, smiles, valid, e))
+    return records
+
+
+def canonical_smiles(smiles: str) -> Optional[str]:
+    """
+    Canonicalise a SMILES string.
+
+    :param smiles: SMILES string
+    :type smiles: str
+    :return: canonical SMILES string or `None` if the SMILES is invalid
+    :rtype: str | None
+    """
+    mol = MolFromSmiles(smiles)
+    if mol is None:
+        return None
+    return MolToSmiles(mol)
+
+
+def _draw(mol: Mol, fn: str, size: Tuple[int, int]) -> str:
+    # write to a temporary file first so that a half-written image is never served
+    tmp = f"{fn}.{os.getpid()}.tmp.png"
+    Draw.MolToFile(mol, tmp, size)
+    os.replace(tmp, fn)
+    return fn
+
+
+class Renderer:
+    """
+    Draw molecules in worker processes and keep the images on disk.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Path = _IMAGE_CACHE_DIR,
+        max_images: int = _IMAGE_CACHE_SIZE,
+        workers: Optional[int] = None,
+        size: Tuple[int, int] = _IMAGE_SIZE,
+    ) -> None:
+        """
+        Images are stored under `cache_dir` and named after the hash of canonical SMILES,
+        so that a molecule is drawn only once across runs and restarts.
+
+        :param cache_dir: directory to store the images
+        :param max_images: maximum number of images kept on disk; the oldest images are removed first
+        :param workers: number of worker processes; `None` to use up to 4 CPUs; 0 or 1 to draw in the calling thread
+        :param size: image size
+        :type cache_dir: pathlib.Path
+        :type max_images: int
+        :type workers: int | None
+        :type size: tuple
+        """
+        self.cache_dir = Path(cache_dir)
+        self.max_images = max_images
+        self.workers = min(4, os.cpu_count() or 1) if workers is None else workers
+        self.size = size
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._n_images: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def path(self, smiles: str) -> Path:
+        """
+        Get the image file path of a canonical SMILES.
+
+        :param smiles: canonical SMILES string
+        :type smiles: str
+        :return: image file path
+        :rtype: pathlib.Path
+        """
+        name = hashlib.sha1(f"{smiles}{self.size}".encode("utf-8")).hexdigest()
+        return self.cache_dir / f"{name}.png"
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # forking a process that serves requests in threads is not safe
+                self._pool = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._pool
+
+    def render(self, records: List[Record]) -> List[Optional[str]]:
+        """
+        Get the images of molecules; only the images not found in the cache are drawn.
+
+        :param records: a list of records
+        :type records: list
+        :return: image file paths; `None` for records without a molecule
+        :rtype: list
+        """
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        paths = [None if i.smiles is None else self.path(i.smiles) for i in records]
+        missing: Dict[str, Tuple[Mol, Path]] = {}
+        for r, p in zip(records, paths):
+            if p is not None and r.smiles not in missing and not p.exists():
+                missing[r.smiles] = (r.mol, p)
+        if missing:
+            jobs = [(m, str(p), self.size) for m, p in missing.values()]
+            if self.workers > 1 and len(jobs) >= _POOL_THRESHOLD:
+                pool = self._get_pool()
+                chunksize = max(1, len(jobs) // (4 * self.workers))
+                list(pool.map(_draw, *zip(*jobs), chunksize=chunksize))
+            else:
+                for job in jobs:
+                    _draw(*job)
+            self._prune(len(missing))
+        return [None if i is None else str(i) for i in paths]
+
+    def _prune(self, n_new: int) -> None:
+        with self._lock:
+            if self._n_images is None:
+                self._n_images = sum(1 for _ in self.cache_dir.glob("*.png"))
+            else:
+                self._n_images += n_new
+            if self._n_images <= self.max_images:
+                return
+            files = sorted(self.cache_dir.glob("*.png"), key=os.path.getmtime)
+            n_remove = len(files) - int(0.9 * self.max_images)
+            for fn in files[: max(n_remove, 0)]:
+                fn.unlink(missing_ok=True)
+            self._n_images = len(files) - max(n_remove, 0)
+
+    def shutdown(self) -> None:
+        """
+        Stop the worker processes.
+
+        :return:
+        :rtype: None
+        """
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+
+
+renderer = Renderer()
+
+
+def _chemfig(smiles: str) -> str:
+    try:
+        return mol2chemfig(smiles, "-r", inline=True) or ""
+    except Exception:
+        return ""
+
+
+_started_queue = None  # of each worker process; see `_ChemfigPool`
+
+
+def _init_chemfig_worker(queue: multiprocessing.SimpleQueue) -> None:
+    global _started_queue
+    _started_queue = queue
+
+
+def _chemfig_task(task_id: int, smiles: str) -> Tuple[str, float]:
+    _started_queue.put(task_id)
+    t0 = time.monotonic()
+    return _chemfig(smiles), time.monotonic() - t0
+
+
+class _ChemfigPool:
+    # a pool shared by all callers until a conversion times out;
+    # it is then retired and only terminated when its last caller leaves
+    def __init__(self, workers: int) -> None:
+        # spawn: forking a process that serves requests in threads is not safe
+        ctx = multiprocessing.get_context("spawn")
+        self.queue = ctx.SimpleQueue()
+        self.pool = ctx.Pool(workers, _init_chemfig_worker, (self.queue,))
+        self.started: Dict[int, float] = {}  # start time of each task
+        self.users = 0
+        self.retired = False
+
+    def poll(self) -> None:
+        while not self.queue.empty():
+            self.started[self.queue.get()] = time.monotonic()
+
+
+class ChemfigConverter:
+    """
+    Convert molecules to Chemfig code in worker processes and keep the code on disk.
+    """
+
+    def __init__(
+        self,
+        cache_file: Path = _CACHE_DIR / "chemfig.jsonl",
+        workers: Optional[int] = None,
+        timeout: float = _CHEMFIG_TIMEOUT,
+    ) -> None:
+        """
+        A molecule whose conversion takes longer than `timeout` seconds
+        (counted from when a worker starts it) is skipped. The worker processes
+        are then replaced once no other request is waiting for them,
+        while new conversions go to new worker processes.
+
+        :param cache_file: file to store the Chemfig code of each canonical SMILES
+        :param workers: number of worker processes; `None` to use up to 2 CPUs
+        :param timeout: time limit in seconds for converting one molecule
+        :type cache_file: pathlib.Path
+        :type workers: int | None
+        :type timeout: float
+        """
+        self.cache_file = Path(cache_file)
+        self.workers = min(2, os.cpu_count() or 1) if workers is None else workers
+        self.timeout = timeout
+        self._cache: Optional[Dict[str, str]] = None
+        self._pool: Optional[_ChemfigPool] = None
+        self._task_ids = itertools.count()
+        self._lock = threading.Lock()
+
+    def _load(self) -> Dict[str, str]:
+        with self._lock:
+            if self._cache is None:
+                self._cache = {}
+                if self.cache_file.exists():
+                    with open(self.cache_file, "r", encoding="utf-8") as f:
+                        for line in f:
+                            try:
+                                self._cache.update(json.loads(line))
+                            except json.JSONDecodeError:
+                                continue  # a line cut off by a crash
+            return self._cache
+
+    def _store(self, smiles: str, result: Tuple[str, float]) -> None:
+        code, elapsed = result
+        if elapsed > self.timeout:
+            return  # the conversion has been reported as timed out
+        with self._lock:
+            self._cache[smiles] = code
+            with open(self.cache_file, "a", encoding="utf-8") as f:
+                f.write(json.dumps({smiles: code}) + "\n")
+
+    def _acquire(self) -> _ChemfigPool:
+        with self._lock:
+            if self._pool is None:
+                self._pool = _ChemfigPool(max(self.workers, 1))
+            self._pool.users += 1
+            return self._pool
+
+    def _release(self, pool: _ChemfigPool) -> None:
+        with self._lock:
+            pool.users -= 1
+            if pool.retired and pool.users == 0:
+                pool.pool.terminate()
+
+    def _retire(self, pool: _ChemfigPool) -> None:
+        # the stuck worker cannot be interrupted; new conversions go to a new pool
+        with self._lock:
+            pool.retired = True
+            if self._pool is pool:
+                self._pool = None
+
+    def _submit(
+        self, pool: _ChemfigPool, smiles: List[str]
+    ) -> List[Tuple[str, int, multiprocessing.pool.AsyncResult]]:
+        # results are stored by callbacks so that a closed generator
+        # does not waste the conversions that are still running
+        tasks = []
+        for s in smiles:
+            task_id = next(self._task_ids)
+            task = pool.pool.apply_async(
+                _chemfig_task, (task_id, s), callback=partial(self._store, s)
+            )
+            tasks.append((s, task_id, task))
+        return tasks
+
+    def _wait(
+        self,
+        pool: _ChemfigPool,
+        task_id: int,
+        task: multiprocessing.pool.AsyncResult,
+    ) -> Literal["done", "timeout", "moved"]:
+        while not task.ready():
+            with self._lock:
+                pool.poll()
+                start = pool.started.get(task_id)
+            if start is None and pool.retired:
+                return "moved"
+            if start is not None and time.monotonic() - start > self.timeout:
+                return "timeout"
+            task.wait(0.05)
+        with self._lock:
+            pool.started.pop(task_id, None)
+        return "done"
+
+    def convert(self, smiles: List[str]) -> Generator[Tuple[str, str], None, None]:
+        """
+        Convert molecules to Chemfig code; only the molecules not found in the cache are converted.
+        Closing the generator stops waiting for the remaining molecules.
+
+        :param smiles: a list of canonical SMILES strings
+        :type smiles: list
+        :return: canonical SMILES and Chemfig code (empty when failed or timed out);
+                 cached molecules come first
+        :rtype: generator
+        """
+        cache = self._load()
+        todo = []
+        for s in dict.fromkeys(smiles):
+            if s in cache:
+                yield s, cache[s]
+            else:
+                todo.append(s)
+        while todo:
+            pool = self._acquire()
+            try:
+                tasks = self._submit(pool, todo)
+                todo = []
+                for key, (s, task_id, task) in enumerate(tasks):
+                    state = self._wait(pool, task_id, task)
+                    if state == "moved":
+                        # waiting behind a stuck worker; submit the rest again
+                        todo = [i[0] for i in tasks[key:]]
+                        break
+                    if state == "timeout":
+                        # submit the rest again without caching this failure
+                        self._retire(pool)
+                        todo = [i[0] for i in tasks[key + 1 :]]
+                        yield s, ""
+                        break
+                    code, elapsed = task.get()
+                    yield s, code if elapsed <= self.timeout else ""
+            finally:
+                self._release(pool)
+
+    def shutdown(self) -> None:
+        """
+        Stop the worker processes.
+
+        :return:
+        :rtype: None
+        """
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.pool.terminate()
+
+
+chemfig_converter = ChemfigConverter()
+
+
+if __name__ == "__main__":
+    ...
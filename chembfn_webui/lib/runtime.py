@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# Author: Nianze A. TAO (omozawa SUENO)
+"""
+Process-level PyTorch settings.
+"""
+import os
+from typing import Optional
+
+MATMUL_PRECISIONS = ("highest", "high", "medium")
+# defaults of the command line options
+THREADS = os.environ.get("CHEMBFN_WEBUI_THREADS")
+INTEROP_THREADS = os.environ.get("CHEMBFN_WEBUI_INTEROP_THREADS")
+MATMUL_PRECISION = os.environ.get("CHEMBFN_WEBUI_MATMUL_PRECISION")
+
+
+def configure_torch(
+    threads: Optional[int] = None,
+    interop_threads: Optional[int] = None,
+    matmul_precision: Optional[str] = None,
+) -> None:
+    """
+    Set the number of threads and the precision of float32 matrix multiplications.
+    This should be called before any model runs. `None` leaves a setting to PyTorch.
+
+    :param threads: number of threads used inside an operation
+    :param interop_threads: number of threads used to run independent operations
+    :param matmul_precision: `"highest"`, `"high"` or `"medium"`
+    :type threads: int | None
+    :type interop_threads: int | None
+    :type matmul_precision: str | None
+    :return:
+    :rtype: None
+    """
+    import torch  # not imported with this module to keep the command line fast
+
+    if threads is not None:
+        torch.set_num_threads(threads)
+    if interop_threads is not None:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError as error:
+            # it can only be set once and before any inter-op parallel work
+            print(f"Failed to set the number of inter-op threads: {error}")
+    if matmul_precision is not None:
+        assert (
+            matmul_precision in MATMUL_PRECISIONS
+        ), f"Unknown matmul precision {matmul_precision}; choose from {MATMUL_PRECISIONS}."
+        torch.set_float32_matmul_precision(matmul_precision)
+
+
+def thread_budget(concurrency: int, threads: Optional[int] = None) -> int:
+    """
+    Share the threads among the requests processed at the same time.
+
+    :param concurrency: number of requests processed at the same time
+    :param threads: number of threads to share; default is the current setting
+    :type concurrency: int
+    :type threads: int | None
+    :return: number of threads of each request
+    :rtype: int
+    """
+    if threads is None:
+        import torch
+
+        threads = torch.get_num_threads()
+    return max(1, threads // max(1, concurrency))
+
+
+if __name__ == "__main__":
+    ...
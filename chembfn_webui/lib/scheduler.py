@@ -0,0 +1,519 @@
+# -*- coding: utf-8 -*-
+# Author: Nianze A. TAO (omozawa SUENO)
+"""
+Request-level micro-batching.
+"""
+import math
+import threading
+from collections import deque
+from typing import (
+    Dict,
+    List,
+    Tuple,
+    Deque,
+    Union,
+    Optional,
+    Callable,
+    Generator,
+    Hashable,
+    Literal,
+    Any,
+)
+import torch
+from bayesianflow_for_chem import ChemBFN, EnsembleChemBFN
+from bayesianflow_for_chem.tool import (
+    _find_device,
+    _map_model_to_device,
+    _map_value_to_device,
+    _build_token_mask,
+    _parse_and_assert_param,
+    _token_to_seq,
+)
+
+Job = Tuple[Optional[torch.Tensor], int]
+
+
+class _Group:
+    def __init__(self) -> None:
+        self.jobs: List[Any] = []
+        self.size = 0
+        self.results: Optional[List[Any]] = None
+        self.error: Optional[BaseException] = None
+        self.full = threading.Event()
+        self.done = threading.Event()
+
+
+class MicroBatcher:
+    """
+    Collect compatible requests and run them together.
+    """
+
+    def __init__(self, window: float = 0.0, max_batch_size: int = 512) -> None:
+        """
+        The first request of a group waits `window` seconds for compatible
+        requests (i.e., requests submitted with the same key) to join, then runs
+        the whole group in one call while the others wait for their share of the result.
+
+        :param window: waiting time in seconds; 0 means no waiting
+        :param max_batch_size: a group is closed once its total size reaches this value
+        :type window: float
+        :type max_batch_size: int
+        """
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self._pending: Dict[Hashable, _Group] = {}
+        self._lock = threading.Lock()
+
+    def submit(
+        self,
+        key: Hashable,
+        job: Any,
+        size: int,
+        runner: Callable[[List[Any]], List[Any]],
+    ) -> Any:
+        """
+        Submit a job and wait for its result.
+
+        :param key: compatibility key
+        :param job: job content passed to `runner`
+        :param size: size of the job
+        :param runner: a function mapping a list of jobs to a list of results;
+                       only the `runner` of the first job in a group is called
+        :type key: hashable
+        :type job: any
+        :type size: int
+        :type runner: callable
+        :return: result of the job
+        :rtype: any
+        """
+        with self._lock:
+            group = self._pending.get(key)
+            if group is not None and group.size + size > self.max_batch_size:
+                group.full.set()
+                group = None
+            leader = group is None
+            if leader:
+                group = self._pending[key] = _Group()
+            idx = len(group.jobs)
+            group.jobs.append(job)
+            group.size += size
+            if group.size >= self.max_batch_size:
+                group.full.set()
+        if leader:
+            if self.window > 0:
+                group.full.wait(self.window)
+            with self._lock:
+                if self._pending.get(key) is group:
+                    del self._pending[key]
+            try:
+                group.results = runner(group.jobs)
+            except BaseException as error:
+                group.error = error
+            finally:
+                group.done.set()
+        else:
+            group.done.wait()
+        if group.error is not None:
+            raise group.error
+        return group.results[idx]
+
+
+scheduler = MicroBatcher()
+
+
+class LengthStats:
+    """
+    Sequence lengths of recent samples of each model setting.
+    """
+
+    def __init__(self, size: int = 4096, min_count: int = 64) -> None:
+        """
+        Length buckets are suggested once at least `min_count` samples
+        of a setting have been seen; only the latest `size` samples are kept.
+
+        :param size: number of kept lengths of each setting
+        :param min_count: number of samples needed before suggesting buckets
+        :type size: int
+        :type min_count: int
+        """
+        self.size = size
+        self.min_count = min_count
+        self._lengths: Dict[Hashable, Deque[int]] = {}
+        self._lock = threading.Lock()
+
+    def update(self, key: Hashable, lengths: List[int]) -> None:
+        """
+        Record sequence lengths (including `<start>` and `<end>` tokens).
+
+        :param key: model setting
+        :param lengths: sequence lengths
+        :type key: hashable
+        :type lengths: list
+        :return:
+        :rtype: None
+        """
+        with self._lock:
+            if key not in self._lengths:
+                self._lengths[key] = deque(maxlen=self.size)
+            self._lengths[key].extend(lengths)
+
+    def buckets(
+        self,
+        key: Hashable,
+        sequence_size: int,
+        quantiles: Tuple[float, ...] = (0.5, 0.9),
+    ) -> List[int]:
+        """
+        Suggest length buckets from the quantiles of the recorded lengths.
+        Each bucket has a 10% margin and is rounded up to a multiple of 8.
+
+        :param key: model setting
+        :param sequence_size: full sequence length
+        :param quantiles: quantiles of the lengths used as buckets
+        :type key: hashable
+        :type sequence_size: int
+        :type quantiles: tuple
+        :return: bucket lengths shorter than `sequence_size`; empty if too few samples were seen
+        :rtype: list
+        """
+        with self._lock:
+            lengths = sorted(self._lengths.get(key, []))
+        if len(lengths) < self.min_count:
+            return []
+        buckets = set()
+        for q in quantiles:
+            length = lengths[min(int(q * len(lengths)), len(lengths) - 1)]
+            length = math.ceil(length * 1.1 / 8) * 8
+            if length < sequence_size:
+                buckets.add(length)
+        return sorted(buckets)
+
+
+length_stats = LengthStats()
+
+
+def estimate_sample_size(
+    n_wanted: int, n_found: int, n_sampled: int, margin: float = 1.1
+) -> int:
+    """
+    Estimate the number of samples needed to find `n_wanted` more results
+    from the rate of results (e.g., valid molecules) found so far.
+    A small margin is added so that one more round is usually enough.
+
+    :param n_wanted: number of results still wanted
+    :param n_found: number of results found so far
+    :param n_sampled: number of samples generated so far
+    :param margin: safety factor
+    :type n_wanted: int
+    :type n_found: int
+    :type n_sampled: int
+    :type margin: float
+    :return: number of samples; 0 if nothing has been found so that the rate is unknown
+    :rtype: int
+    """
+    if n_wanted <= 0 or n_found <= 0:
+        return 0
+    return math.ceil(n_wanted * n_sampled / n_found * margin)
+
+
+def next_round_size(
+    n_wanted: int, n_found: int, n_sampled: int, last_round: int
+) -> int:
+    """
+    Size the next round of sampling towards `n_wanted` more results.
+    The round is sized by the rate of results found so far (see `estimate_sample_size()`);
+    while nothing has been found, the last round is doubled instead.
+
+    :param n_wanted: number of results still wanted
+    :param n_found: number of results found so far
+    :param n_sampled: number of samples generated so far
+    :param last_round: number of samples of the last round
+    :type n_wanted: int
+    :type n_found: int
+    :type n_sampled: int
+    :type last_round: int
+    :return: number of samples; 0 if nothing is wanted
+    :rtype: int
+    """
+    if n_wanted <= 0:
+        return 0
+    if n_found <= 0:
+        return 2 * last_round
+    return estimate_sample_size(n_wanted, n_found, n_sampled)
+
+
+def plan_chunks(
+    batch_size: int,
+    target: int,
+    n_found: Callable[[], int],
+    max_samples: int,
+    chunk_size: int = 0,
+    max_empty_rounds: int = 3,
+) -> Generator[int, None, None]:
+    """
+    Plan the chunks of a run. \n
+    Without a target, one batch is generated.
+    Otherwise, the first round is one batch and each following round is sized
+    by `next_round_size()` to reach `target` in as few rounds as possible;
+    it stops once `target` samples are found, `max_samples` samples are generated
+    or `max_empty_rounds` rounds in a row find nothing new.
+    No chunk is larger than one batch.
+
+    :param batch_size: batch-size
+    :param target: number of wanted samples; 0 means one batch
+    :param n_found: a function returning the number of samples found so far
+    :param max_samples: maximum number of samples generated while a target is set
+    :param chunk_size: maximum size of each chunk; 0 means one batch
+    :param max_empty_rounds: number of rounds in a row finding nothing before giving up
+    :type batch_size: int
+    :type target: int
+    :type n_found: callable
+    :type max_samples: int
+    :type chunk_size: int
+    :type max_empty_rounds: int
+    :return: size of each chunk
+    :rtype: generator
+    """
+    chunk_size = min(chunk_size, batch_size) if chunk_size > 0 else batch_size
+    n_sampled, round_size, n_empty = 0, batch_size, 0
+    while True:
+        n_start, n_begin = n_found(), n_sampled
+        if target > 0:
+            n_end = min(n_sampled + round_size, max_samples)
+        else:
+            n_end = batch_size
+        while n_sampled < n_end:
+            chunk = min(chunk_size, n_end - n_sampled)
+            n_sampled += chunk
+            yield chunk
+            if target > 0 and n_found() >= target:
+                return
+        n_empty = n_empty + 1 if n_found() == n_start else 0
+        if target <= 0 or n_empty >= max_empty_rounds or n_sampled >= max_samples:
+            return
+        round_size = next_round_size(
+            target - n_found(), n_found(), n_sampled, n_sampled - n_begin
+        )
+
+
+def _split(
+    results: List[Tuple[str, float]], sizes: List[int], interleave: bool
+) -> List[Tuple[List[str], List[float]]]:
+    out = [[] for _ in sizes]
+    if not interleave:
+        start = 0
+        for key, size in enumerate(sizes):
+            out[key] = results[start : start + size]
+            start += size
+    else:
+        # dealing sorted samples one by one keeps every share sorted
+        # and with a similar quality distribution
+        idx = 0
+        for result in results:
+            while len(out[idx]) >= sizes[idx]:
+                idx = (idx + 1) % len(sizes)
+            out[idx].append(result)
+            idx = (idx + 1) % len(sizes)
+    return [([i[0] for i in j], [i[1] for i in j]) for j in out]
+
+
+def _job_conditions(
+    y: Optional[Union[torch.Tensor, List[torch.Tensor]]],
+    sizes: List[int],
+    start: int = 0,
+    stop: Optional[int] = None,
+) -> Optional[Union[torch.Tensor, List[torch.Tensor]]]:
+    # jobs of different conditions batched together come with one vector per job;
+    # each sample gets the vector of its job, otherwise `y` is shared by the batch
+    def _expand(i: torch.Tensor) -> torch.Tensor:
+        if len(sizes) < 2 or i.shape[0] != len(sizes):
+            return i
+        repeats = torch.tensor(sizes, device=i.device)
+        return i.repeat_interleave(repeats, 0)[start:stop]
+
+    if isinstance(y, list):
+        return [_expand(i) for i in y]
+    if y is not None:
+        return _expand(y)
+    return y
+
+
+def _job_guidance(
+    guidance_strength: Union[float, List[float]],
+    sizes: List[int],
+    start: int = 0,
+    stop: Optional[int] = None,
+) -> Union[float, torch.Tensor]:
+    # jobs of different guidance strengths batched together come with one strength per job;
+    # each sample is guided by the strength of its job
+    if not isinstance(guidance_strength, (list, tuple)):
+        return guidance_strength
+    w = torch.tensor(guidance_strength, dtype=torch.float32)
+    w = w.repeat_interleave(torch.tensor(sizes), 0)[start:stop]
+    return w[:, None, None]
+
+
+@torch.inference_mode()
+def run_model(
+    model: Union[ChemBFN, EnsembleChemBFN],
+    mode: Literal["sample", "inpaint", "optimise"],
+    x: Union[torch.Tensor, Tuple[int, int]],
+    sample_step: int,
+    y: Optional[Union[torch.Tensor, List[torch.Tensor]]],
+    guidance_strength: Union[float, torch.Tensor],
+    vocab_keys: List[str],
+    method: str,
+    allowed_tokens: Union[str, List[str]],
+    buckets: Optional[List[int]] = None,
+) -> Tuple[List[str], List[float]]:
+    """
+    Sample, inpaint or optimise molecules and keep the entropy of each sample. \n
+    If `buckets` is given while sampling, the batch is first sampled at the shortest length;
+    samples that do not end within it are sampled again at the next length, and so on,
+    so that short molecules are not padded to the full length.
+    Note that the entropy is averaged over all the positions of a sample,
+    so that samples of different lengths have different entropy scales.
+
+    :param model: ChemBFN model
+    :param mode: `"sample"`, `"inpaint"` or `"optimise"`
+    :param x: `(batch_size, sequence_size)` for sampling
+              or categorical indices of scaffolds/templates;  shape: (n_b, n_t)
+    :param sample_step: number of sampling steps
+    :param y: conditioning vector(s)
+    :param guidance_strength: strength of conditional generation
+                              or strength of each sample;  shape: (n_b, 1, 1)
+    :param vocab_keys: a list of (ordered) vocabulary
+    :param method: sampling method chosen from `"ode:x"` or `"bfn"`
+    :param allowed_tokens: a list of allowed tokens or `"all"`
+    :param buckets: shorter sequence lengths tried before the full length
+    :type model: bayesianflow_for_chem.model.ChemBFN | bayesianflow_for_chem.model.EnsembleChemBFN
+    :type mode: str
+    :type x: torch.Tensor | tuple
+    :type sample_step: int
+    :type y: torch.Tensor | list | None
+    :type guidance_strength: float | torch.Tensor
+    :type vocab_keys: list
+    :type method: str
+    :type allowed_tokens: str | list
+    :type buckets: list | None
+    :return: generated molecular strings \n
+             entropy of each sample
+    :rtype: tuple
+    """
+    # the same checks and helpers as `bayesianflow_for_chem.tool.sample()`
+    temperature = _parse_and_assert_param(model, y, method)
+    device = _find_device()
+    model = _map_model_to_device(model, device)
+    y = _map_value_to_device(y, device)
+    if isinstance(guidance_strength, torch.Tensor):
+        guidance_strength = guidance_strength.to(device)
+    token_mask = _build_token_mask(allowed_tokens, vocab_keys, device)
+    args = (sample_step, guidance_strength, token_mask)
+    if temperature is not None:
+        args += (temperature,)
+        fn = getattr(model, f"ode_{mode}")
+    else:
+        fn = getattr(model, mode)
+    if mode != "sample":
+        tokens, entropy = fn(x.to(device), y, *args)
+        return _token_to_seq(tokens, entropy, vocab_keys, "", False), entropy.tolist()
+    lengths = [x[1]]
+    # samples of different conditions cannot be sampled again in a smaller batch
+    per_sample = isinstance(guidance_strength, torch.Tensor) or (
+        y is not None
+        and any(i.shape[0] > 1 for i in (y if isinstance(y, list) else [y]))
+    )
+    if buckets and "<end>" in vocab_keys and not per_sample:
+        lengths = sorted({i for i in buckets if 2 < i < x[1]}) + lengths
+    end_id = vocab_keys.index("<end>") if len(lengths) > 1 else None
+    n, mols, entropy = x[0], [], []
+    for length in lengths:
+        tokens, e = fn(n, length, y, *args)
+        if length < x[1]:
+            ended = (tokens == end_id).any(-1)
+            tokens, e = tokens[ended], e[ended]
+        mols.extend(_token_to_seq(tokens, e, vocab_keys, "", False))
+        entropy.extend(e.tolist())
+        n = x[0] - len(mols)
+        if n == 0:
+            break
+    return mols, entropy
+
+
+def generate(
+    jobs: List[Job],
+    model: Union[ChemBFN, EnsembleChemBFN],
+    mode: Literal["sample", "inpaint", "optimise"],
+    sequence_size: int,
+    sample_step: int,
+    y: Optional[Union[torch.Tensor, List[torch.Tensor]]],
+    guidance_strength: Union[float, List[float]],
+    vocab_keys: List[str],
+    method: str,
+    allowed_tokens: Union[str, List[str]],
+    sort: bool,
+    seed: Optional[int] = None,
+    buckets: Optional[List[int]] = None,
+) -> List[Tuple[List[str], List[float]]]:
+    """
+    Run a group of sampling, inpainting or optimising jobs in one batch.
+
+    :param jobs: a list of `(x, batch_size)` where `x` is `None` for sampling
+                 or the token indices of a scaffold/template;  shape: (1, n_t)
+    :param model: ChemBFN model
+    :param mode: `"sample"`, `"inpaint"` or `"optimise"`
+    :param sequence_size: max sequence length used in sampling
+    :param sample_step: number of sampling steps
+    :param y: conditioning vector(s) shared by all jobs or one vector per job
+    :param guidance_strength: strength of conditional generation shared by all jobs or one strength per job
+    :param vocab_keys: a list of (ordered) vocabulary
+    :param method: sampling method
+    :param allowed_tokens: a list of allowed tokens or `"all"`
+    :param sort: whether to sort the samples according to entropy values;
+                 ignored when `buckets` are used since samples of different lengths are not comparable
+    :param seed: random seed; `None` means not seeding
+    :param buckets: shorter sequence lengths tried before `sequence_size` while sampling
+    :type jobs: list
+    :type model: bayesianflow_for_chem.model.ChemBFN | bayesianflow_for_chem.model.EnsembleChemBFN
+    :type mode: str
+    :type sequence_size: int
+    :type sample_step: int
+    :type y: torch.Tensor | list | None
+    :type guidance_strength: float | list
+    :type vocab_keys: list
+    :type method: str
+    :type allowed_tokens: str | list
+    :type sort: bool
+    :type seed: int | None
+    :type buckets: list | None
+    :return: generated molecules and their entropy values of each job
+    :rtype: list
+    """
+    sizes = [i[1] for i in jobs]
+    sort = sort and not buckets
+    if mode == "sample":
+        x = (sum(sizes), sequence_size)
+    else:
+        x = torch.cat([i[0].repeat(i[1], 1) for i in jobs], 0)
+    if seed is not None:
+        torch.manual_seed(seed)
+    mols, entropy = run_model(
+        model,
+        mode,
+        x,
+        sample_step,
+        _job_conditions(y, sizes),
+        _job_guidance(guidance_strength, sizes),
+        vocab_keys,
+        method,
+        allowed_tokens,
+        buckets,
+    )
+    results = list(zip(mols, entropy))
+    if sort:
+        results.sort(key=lambda i: i[1])
+    return _split(results, sizes, sort)
+
+
+if __name__ == "__main__":
+    ...
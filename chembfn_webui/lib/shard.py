@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+# Author: Nianze A. TAO (omozawa SUENO)
+"""
+Split large sampling jobs across worker processes.
+"""
+import os
+import hashlib
+import threading
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Tuple, Union, Optional, Literal, NamedTuple
+import torch
+from .pipeline import build_model
+from .scheduler import Job, run_model, _split, _job_conditions, _job_guidance
+
+
+class ModelSpec(NamedTuple):
+    """
+    Arguments of `~lib.pipeline.build_model()`.
+    Workers build (and keep) their own models from the spec instead of receiving the weights.
+    """
+
+    model_name: str
+    prompt_info: Dict[str, List]
+    sar_flag: List[bool]
+    sequence_size: int
+    quantise: bool
+    jited: bool
+    models: Dict[str, List[List[Union[str, int, List[str], Path]]]]
+
+
+def shard_seed(seed: int, *index: int) -> int:
+    """
+    Derive an independent seed, e.g., of a shard of a chunk, from a base seed.
+
+    :param seed: base seed
+    :param index: position of the shard, e.g., `(chunk_idx, shard_idx)`
+    :type seed: int
+    :type index: int
+    :return: derived seed
+    :rtype: int
+    """
+    key = ":".join(str(i) for i in (seed,) + index)
+    return int.from_bytes(hashlib.sha256(key.encode()).digest()[:8], "little") >> 1
+
+
+def _init_worker(threads: int) -> None:
+    torch.set_num_threads(threads)
+
+
+def _run_shard(
+    spec: ModelSpec,
+    mode: Literal["sample", "inpaint", "optimise"],
+    x: Union[torch.Tensor, Tuple[int, int]],
+    sample_step: int,
+    guidance_strength: Union[float, List[float]],
+    vocab_keys: List[str],
+    method: str,
+    allowed_tokens: Union[str, List[str]],
+    seed: int,
+    buckets: Optional[List[int]],
+    y: Optional[Union[torch.Tensor, List[torch.Tensor]]],
+    sizes: List[int],
+    start: int,
+) -> Tuple[List[str], List[float]]:
+    # the model stays in the model cache of the worker between calls
+    bfn, spec_y, _, _ = build_model(*spec)
+    if y is None:
+        y = spec_y
+    size = x[0] if isinstance(x, tuple) else x.shape[0]
+    y = _job_conditions(y, sizes, start, start + size)
+    guidance_strength = _job_guidance(guidance_strength, sizes, start, start + size)
+    torch.manual_seed(seed)
+    return run_model(
+        bfn,
+        mode,
+        x,
+        sample_step,
+        y,
+        guidance_strength,
+        vocab_keys,
+        method,
+        allowed_tokens,
+        buckets,
+    )
+
+
+class ShardPool:
+    """
+    Generate one batch in several worker processes.
+    """
+
+    def __init__(self, workers: int, threads: Optional[int] = None) -> None:
+        """
+        A batch is split into `workers` shards that are generated in parallel,
+        each by a worker process holding its own model and using `threads` threads.
+        The results are merged in the order of the shards,
+        so that the same seed always gives the same samples for the same number of workers.
+
+        :param workers: number of worker processes
+        :param threads: number of threads used by each worker; default is to share the CPU cores equally
+        :type workers: int
+        :type threads: int | None
+        """
+        assert workers > 0, "The number of workers should be positive."
+        self.workers = workers
+        if threads is None:
+            threads = max(1, (os.cpu_count() or 1) // workers)
+        self.threads = threads
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._pool is None:
+                # spawn: forking a process that serves requests in threads is not safe
+                self._pool = ProcessPoolExecutor(
+                    self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    initargs=(self.threads,),
+                )
+            return self._pool
+
+    def generate(
+        self,
+        jobs: List[Job],
+        spec: ModelSpec,
+        mode: Literal["sample", "inpaint", "optimise"],
+        sequence_size: int,
+        sample_step: int,
+        guidance_strength: Union[float, List[float]],
+        vocab_keys: List[str],
+        method: str,
+        allowed_tokens: Union[str, List[str]],
+        sort: bool,
+        seed: Optional[int] = None,
+        buckets: Optional[List[int]] = None,
+        y: Optional[Union[torch.Tensor, List[torch.Tensor]]] = None,
+    ) -> List[Tuple[List[str], List[float]]]:
+        """
+        Run a group of jobs in one batch split across the workers.
+        The arguments are the same as `~lib.scheduler.generate()`
+        except that the model is described by `spec`.
+
+        :param jobs: a list of `(x, batch_size)`
+        :param spec: arguments to build the model
+        :param mode: `"sample"`, `"inpaint"` or `"optimise"`
+        :param sequence_size: max sequence length used in sampling
+        :param sample_step: number of sampling steps
+        :param guidance_strength: strength of conditional generation shared by all jobs or one strength per job
+        :param vocab_keys: a list of (ordered) vocabulary
+        :param method: sampling method
+        :param allowed_tokens: a list of allowed tokens or `"all"`
+        :param sort: whether to sort the samples according to entropy values;
+                     ignored when `buckets` are used
+        :param seed: base seed of the shards; `None` means random
+        :param buckets: shorter sequence lengths tried before `sequence_size` while sampling
+        :param y: conditioning vector(s) shared by all jobs or one vector per job;
+                  default is the one built from `spec`
+        :type jobs: list
+        :type spec: lib.shard.ModelSpec
+        :type mode: str
+        :type sequence_size: int
+        :type sample_step: int
+        :type guidance_strength: float | list
+        :type vocab_keys: list
+        :type method: str
+        :type allowed_tokens: str | list
+        :type sort: bool
+        :type seed: int | None
+        :type buckets: list | None
+        :type y: torch.Tensor | list | None
+        :return: generated molecules and their entropy values of each job
+        :rtype: list
+        """
+        sizes = [i[1] for i in jobs]
+        total = sum(sizes)
+        sort = sort and not buckets
+        if seed is None:
+            seed = int.from_bytes(os.urandom(8), "little") >> 1
+        if mode != "sample":
+            x = torch.cat([i[0].repeat(i[1], 1) for i in jobs], 0)
+        pool = self._get_pool()
+        futures, start = [], 0
+        for idx in range(self.workers):
+            size = total // self.workers + (idx < total % self.workers)
+            if size == 0:
+                continue
+            shard_x = (
+                (size, sequence_size) if mode == "sample" else x[start : start + size]
+            )
+            futures.append(
+                pool.submit(
+                    _run_shard,
+                    spec,
+                    mode,
+                    shard_x,
+                    sample_step,
+                    guidance_strength,
+                    vocab_keys,
+                    method,
+                    allowed_tokens,
+                    shard_seed(seed, idx),
+                    buckets,
+                    y,
+                    sizes,
+                    start,
+                )
+            )
+            start += size
+        results = []
+        for future in futures:
+            mols, entropy = future.result()
+            results.extend(zip(mols, entropy))
+        if sort:
+            results.sort(key=lambda i: i[1])
+        return _split(results, sizes, sort)
+
+    def shutdown(self) -> None:
+        """
+        Stop the worker processes.
+
+        :return:
+        :rtype: None
+        """
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(cancel_futures=True)
+                self._pool = None
+
+
+if __name__ == "__main__":
+    ...
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+# Author: Nianze A. TAO (omozawa SUENO)
+"""
+Tokenisers shared by all runs.
+"""
+import os
+import threading
+from pathlib import Path
+from functools import partial
+from typing import Dict, List, Tuple, Optional, Callable, Literal
+import torch
+from bayesianflow_for_chem.data import (
+    VOCAB_KEYS,
+    VOCAB_DICT,
+    FASTA_VOCAB_KEYS,
+    FASTA_VOCAB_DICT,
+    load_vocab,
+    smiles2vec,
+    fasta2vec,
+    split_selfies,
+)
+
+
+def _unknown_id(vocab_dict: Dict[str, int]) -> Optional[int]:
+    for key, idx in vocab_dict.items():
+        if "unknown" in key.lower():
+            return idx
+    return None
+
+
+def _selfies2vec(
+    sel: str, vocab_dict: Dict[str, int], unknown_id: Optional[int]
+) -> List[int]:
+    return [vocab_dict.get(i, unknown_id) for i in split_selfies(sel)]
+
+
+def selfies2vec(sel: str, vocab_dict: Dict[str, int]) -> List[int]:
+    """
+    Tokeniser SELFIES string.
+
+    :param sel: SELFIES string
+    :param vocab_dict: vocabulary dictionary
+    :type sel: str
+    :type vocab_dict: dict
+    :return: a list of token indices
+    :rtype: list
+    """
+    return _selfies2vec(sel, vocab_dict, _unknown_id(vocab_dict))
+
+
+class Tokeniser:
+    """
+    A tokeniser and its vocabulary.
+    """
+
+    def __init__(
+        self,
+        vocab_keys: List[str],
+        vocab_dict: Dict[str, int],
+        fn: Callable[[str], List[int]],
+    ) -> None:
+        """
+        Calling the tokeniser gives the token indices of a string without `<start>` and `<end>`.
+
+        :param vocab_keys: a list of (ordered) vocabulary
+        :param vocab_dict: vocabulary dictionary
+        :param fn: function tokenising a string
+        :type vocab_keys: list
+        :type vocab_dict: dict
+        :type fn: callable
+        """
+        self.vocab_keys = vocab_keys
+        self.vocab_dict = vocab_dict
+        self.unknown_id = _unknown_id(vocab_dict)
+        self._fn = fn
+
+    def __call__(self, string: str) -> List[int]:
+        return self._fn(string)
+
+    def encode(self, strings: List[str], length: int, end: bool = True) -> torch.Tensor:
+        """
+        Tokenise a batch of strings into padded token indices.
+
+        :param strings: strings
+        :param length: sequence length including `<start>` (and `<end>`)
+        :param end: whether to end each sequence with `<end>`
+        :type strings: list
+        :type length: int
+        :type end: bool
+        :return: token indices;  shape: (n_b, length)
+        :rtype: torch.Tensor
+        """
+        x = torch.zeros((len(strings), length), dtype=torch.long)
+        for i, string in enumerate(strings):
+            tokens = [1] + self._fn(string) + ([2] if end else [])
+            if len(tokens) > length:
+                raise ValueError(
+                    f"{string} needs {len(tokens)} tokens, "
+                    f"more than the sequence length {length}."
+                )
+            x[i, : len(tokens)] = torch.tensor(tokens, dtype=torch.long)
+        return x
+
+
+class TokeniserRegistry:
+    """
+    Tokenisers built once and reused by later runs.
+    """
+
+    def __init__(self) -> None:
+        """
+        A SELFIES tokeniser is rebuilt when its vocabulary file has been modified.
+        """
+        self._entries: Dict[Tuple[str, Optional[str]], Tuple[Tokeniser, int]] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        token_name: Literal["SMILES & SAFE", "SELFIES", "FASTA"],
+        vocab_file: Optional[Path] = None,
+    ) -> Tokeniser:
+        """
+        Get a tokeniser.
+
+        :param token_name: tokeniser name
+        :param vocab_file: vocabulary file; only used by SELFIES tokeniser
+        :type token_name: str
+        :type vocab_file: pathlib.Path | None
+        :return: tokeniser
+        :rtype: lib.tokeniser.Tokeniser
+        """
+        if token_name in ("SMILES & SAFE", "FASTA"):
+            key, mtime = (token_name, None), 0
+        elif token_name == "SELFIES":
+            vocab_file = str(Path(vocab_file).resolve())
+            key, mtime = (token_name, vocab_file), os.stat(vocab_file).st_mtime_ns
+        else:
+            raise ValueError(f"Unknown tokeniser: {token_name}")
+        with self._lock:
+            if key in self._entries and self._entries[key][1] == mtime:
+                return self._entries[key][0]
+        if token_name == "SMILES & SAFE":
+            tokeniser = Tokeniser(VOCAB_KEYS, VOCAB_DICT, smiles2vec)
+        elif token_name == "FASTA":
+            tokeniser = Tokeniser(FASTA_VOCAB_KEYS, FASTA_VOCAB_DICT, fasta2vec)
+        else:
+            vocab_data = load_vocab(vocab_file)
+            vocab_dict = vocab_data["vocab_dict"]
+            fn = partial(
+                _selfies2vec, vocab_dict=vocab_dict, unknown_id=_unknown_id(vocab_dict)
+            )
+            tokeniser = Tokeniser(vocab_data["vocab_keys"], vocab_dict, fn)
+        with self._lock:
+            self._entries[key] = (tokeniser, mtime)
+        return tokeniser
+
+
+tokenisers = TokeniserRegistry()
+
+
+if __name__ == "__main__":
+    ...
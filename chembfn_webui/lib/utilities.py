@@ -4,17 +4,26 @@
 Utilities.
 """
 import os
+import re
 import ast
-import json
-from glob import glob
+import csv
+import math
+import itertools
 from pathlib import Path
 from typing import Dict, List, Tuple, Union, Optional, Callable, Any
 import gradio as gr
+from .manifest import ModelIndex
 
 _model_path = Path(__file__).parent.parent / "model"
 if "CHEMBFN_WEBUI_MODEL_DIR" in os.environ:
     _model_path = Path(os.environ["CHEMBFN_WEBUI_MODEL_DIR"])
 
+_model_indices: Dict[Path, ModelIndex] = {}
+_INPUT_HEADERS = {"smiles", "scaffold", "template", "molecule"}
+_OBJECTIVE_PATTERN = re.compile(r"\[([^\[\]]*)\]")
+# maximum number of swept conditions or guidance strengths of one run
+MAX_SWEEP_SIZE = 1000
+
 _ALLOWED_STRING_METHODS = {"strip", "replace", "split"}
 _ALLOWED_NODES = (
     ast.arguments,
@@ -167,6 +176,24 @@ def sys_info() -> str:
             """
 
 
+def _model_index() -> ModelIndex:
+    # `_model_path` may be changed after import, e.g., by tests
+    if _model_path not in _model_indices:
+        _model_indices[_model_path] = ModelIndex(_model_path)
+    return _model_indices[_model_path]
+
+
+def watch_model_dir() -> None:
+    """
+    Watch the model folder so that finding models only reads the index until something changes.
+    This requires `watchdog`.
+
+    :return:
+    :rtype: None
+    """
+    _model_index().watch()
+
+
 def find_vocab() -> Dict[str, str]:
     """
     Find customised vocabulary files.
@@ -174,17 +201,12 @@ def find_vocab() -> Dict[str, str]:
     :return: {file_name: file_path}
     :rtype: dict
     """
-    vocab_fns = glob(str(_model_path / "vocab/*.txt"))
-    return {
-        os.path.basename(i).replace(".txt", ""): i
-        for i in vocab_fns
-        if "place_vocabulary_file_here.txt" not in i
-    }
+    return _model_index().vocabs()
 
 
 def find_model() -> Dict[str, List[List[Union[str, int, List[str], Path]]]]:
     """
-    Find model files.
+    Find model files. Only the changed folders are scanned (see `~lib.manifest.ModelIndex`).
 
     :return: ```
             {
@@ -194,39 +216,7 @@ def find_model() -> Dict[str, List[List[Union[str, int, List[str], Path]]]]:
             }```
     :rtype: dict
     """
-    models = {}
-    # find base models
-    base_fns = glob(str(_model_path / "base_model/*.pt"))
-    models["base"] = [[os.path.basename(i), i] for i in base_fns]
-    # find standalone models
-    standalone_models = []
-    standalone_fns = glob(str(_model_path / "standalone_model/*/model.pt"))
-    for standalone_fn in standalone_fns:
-        config_fn = Path(standalone_fn).parent / "config.json"
-        if not os.path.exists(config_fn):
-            continue
-        with open(config_fn, "r", encoding="utf-8") as f:
-            config = json.load(f)
-        name = config["name"]
-        label = config["label"]
-        lmax = config["padding_length"]
-        standalone_models.append([name, Path(standalone_fn).parent, label, lmax])
-    models["standalone"] = standalone_models
-    # find lora models
-    lora_models = []
-    lora_fns = glob(str(_model_path / "lora/*/lora.pt"))
-    for lora_fn in lora_fns:
-        config_fn = Path(lora_fn).parent / "config.json"
-        if not os.path.exists(config_fn):
-            continue
-        with open(config_fn, "r", encoding="utf-8") as f:
-            config = json.load(f)
-        name = config["name"]
-        label = config["label"]
-        lmax = config["padding_length"]
-        lora_models.append([name, Path(lora_fn).parent, label, lmax])
-    models["lora"] = lora_models
-    return models
+    return _model_index().models()
 
 
 def _get_lora_info(prompt: str) -> Tuple[str, List[float], float]:
@@ -401,6 +391,193 @@ def parse_sar_control(sar_control: Optional[str]) -> List[bool]:
     return sar_flag
 
 
+def parse_length_buckets(buckets: Optional[str]) -> Union[str, List[int]]:
+    """
+    Parse length bucket string.
+
+    :param buckets: length bucket string: \n
+                    case I. `""` --> `[]` \n
+                    case II. `"auto"` --> `"auto"` \n
+                    case III. `"32,64,..."` --> `[32, 64, ...]` \n
+                    case IV. other cases --> `[]` with a warning \n
+    :type buckets: str | None
+    :return: a list of sequence lengths or `"auto"`
+    :rtype: list | str
+    """
+    if buckets is None:
+        buckets = ""
+    buckets = buckets.strip().replace("\n", "")
+    if buckets.lower() == "auto":
+        return "auto"
+    buckets = [i.strip() for i in buckets.split(",") if i.strip()]
+    if not all(i.isdigit() for i in buckets):
+        _warn(
+            f"Invalid length buckets: {','.join(buckets)}. Length buckets are not used.",
+            title="Warning in length buckets",
+        )
+        return []
+    return sorted({int(i) for i in buckets})
+
+
+class _SweepSizeError(ValueError):
+    # raised to the user instead of being ignored with a warning as malformed sweeps are
+    pass
+
+
+def _check_sweep_size(size: int, name: str) -> None:
+    if size > MAX_SWEEP_SIZE:
+        raise _SweepSizeError(
+            f"{size} {name} are swept but at most {MAX_SWEEP_SIZE} are allowed."
+        )
+
+
+def _sweep_values(item: str) -> List[float]:
+    if "|" in item:
+        return [float(i) for i in item.split("|")]
+    if "~" in item:
+        start, stop, num = item.split("~")
+        start, stop, num = float(start), float(stop), int(num)
+        _check_sweep_size(num, "values")
+        if num < 2:
+            return [start]
+        return [start + (stop - start) * i / (num - 1) for i in range(num)]
+    return [float(item)]
+
+
+def parse_guidance_sweep(strengths: Optional[str]) -> List[float]:
+    """
+    Parse guidance strength sweep string.
+
+    :param strengths: guidance strength sweep string: \n
+                      case I. `""` --> `[]` \n
+                      case II. `"2,4,8"` or `"2|4|8"` --> `[2.0, 4.0, 8.0]` \n
+                      case III. `"2~8~4"` --> `[2.0, 4.0, 6.0, 8.0]` (`n` evenly spaced values from `a` to `b`) \n
+                      case IV. other cases --> `[]` with a warning \n
+                      More than `MAX_SWEEP_SIZE` strengths raise a `ValueError`.
+    :type strengths: str | None
+    :return: a list of guidance strengths
+    :rtype: list
+    """
+    if strengths is None:
+        strengths = ""
+    strengths = strengths.strip().replace("\n", "")
+    try:
+        values = [_sweep_values(i.strip()) for i in strengths.split(",") if i.strip()]
+    except _SweepSizeError:
+        raise
+    except ValueError as error:
+        _warn(
+            f"{error}. Guidance strengths are not swept.",
+            title="Warning in guidance sweep",
+        )
+        return []
+    # repeated strengths would only repeat the same work
+    strengths = list(dict.fromkeys(i for j in values for i in j))
+    _check_sweep_size(len(strengths), "guidance strengths")
+    return strengths
+
+
+def parse_objective_sweep(
+    prompt: Optional[str], fn: Optional[str] = None
+) -> Tuple[Optional[str], List[List[List[float]]]]:
+    """
+        Parse the objective values swept in a prompt or listed in a file. \n
+        In a prompt, an objective value can be swept by `a|b|c` (these values)
+        or `a~b~n` (`n` evenly spaced values from `a` to `b`), e.g.,
+        `<name>:[0~1~5,2|4]` gives 10 conditions.
+        In a `.csv` file, each row is one condition and a header is skipped;
+        if the prompt contains objective values, the columns are split into objective vectors of the same lengths,
+        otherwise each row is one objective vector. The file takes the place of the values in the prompt.
+    More than `MAX_SWEEP_SIZE` conditions raise a `ValueError`.
+
+        :param prompt: prompt string
+        :param fn: file of objective values
+        :type prompt: str | None
+        :type fn: str | None
+        :return: prompt with each sweep replaced by its first value \n
+                 a list of conditions, each a list of objective vectors;
+                 empty if nothing is swept
+        :rtype: tuple
+    """
+    items = [i.split(",") for i in _OBJECTIVE_PATTERN.findall(prompt or "")]
+    values = []
+    for obj in items:
+        try:
+            values.append([_sweep_values(i.strip()) for i in obj])
+        except _SweepSizeError:
+            raise
+        except ValueError as error:
+            _warn(f"{error}. Objective sweep ignored.", title="Warning in prompt")
+            return prompt, []
+    lengths = [len(i) for i in items]
+    ends = list(itertools.accumulate(lengths))
+    bounds = list(zip([0] + ends[:-1], ends))  # of each objective vector
+    first = iter(str(i[0]) for obj in values for i in obj)
+    if prompt is not None and any(len(i) > 1 for obj in values for i in obj):
+        prompt = _OBJECTIVE_PATTERN.sub(
+            lambda m: f"[{','.join(next(first) for _ in m.group(1).split(','))}]",
+            prompt,
+        )
+    if fn:
+        with open(fn, "r", encoding="utf-8", newline="") as f:
+            rows = [i for i in csv.reader(f) if any(j.strip() for j in i)]
+        conditions = []
+        for idx, row in enumerate(rows):
+            try:
+                row = [float(i) for i in row if i.strip()]
+            except ValueError:
+                if idx == 0:
+                    continue  # header
+                raise
+            if not lengths:
+                conditions.append([row])
+                continue
+            if len(row) != sum(lengths):
+                raise ValueError(
+                    f"{len(row)} objective values in row {idx + 1} of the file "
+                    f"but {sum(lengths)} in the prompt."
+                )
+            conditions.append([row[i:j] for i, j in bounds])
+        _check_sweep_size(len(conditions), "conditions")
+        return prompt, conditions
+    if all(len(i) == 1 for obj in values for i in obj):
+        return prompt, []
+    # every combination of the swept values
+    flat = [i for obj in values for i in obj]
+    _check_sweep_size(math.prod(len(i) for i in flat), "conditions")
+    conditions = []
+    for combination in itertools.product(*flat):
+        conditions.append([list(combination[i:j]) for i, j in bounds])
+    return prompt, conditions
+
+
+def parse_input_list(text: Optional[str], fn: Optional[str] = None) -> List[str]:
+    """
+    Parse scaffolds or templates keyed in (one per line) and those in an uploaded file.
+    In a `.csv` file, the first column is read and a header named
+    `smiles`, `scaffold`, `template` or `molecule` is skipped;
+    in other files (e.g., `.smi` or `.txt`), the first word of each line is read.
+
+    :param text: one scaffold/template per line
+    :param fn: file of scaffolds/templates
+    :type text: str | None
+    :type fn: str | None
+    :return: a list of scaffolds/templates
+    :rtype: list
+    """
+    inputs = [i.strip() for i in (text or "").split("\n")]
+    if fn:
+        with open(fn, "r", encoding="utf-8", newline="") as f:
+            if str(fn).lower().endswith(".csv"):
+                rows = [i[0] if i else "" for i in csv.reader(f)]
+                if rows and rows[0].strip().lower() in _INPUT_HEADERS:
+                    rows = rows[1:]
+            else:
+                rows = [(i.split() or [""])[0] for i in f]
+        inputs += [i.strip() for i in rows]
+    return [i for i in inputs if i]
+
+
 def build_result_prep_fn(fn_string: Optional[str]) -> Callable[[str], str]:
     """
     Build result preprocessing function.
@@ -91,6 +91,7 @@ setup(
         "rdkit>=2025.3.5",
         "selfies>=2.2.0",
     ],
+    extras_require={"parquet": ["pyarrow"], "watch": ["watchdog"]},
     project_urls={"Source": "https://github.com/Augus1999/ChemBFN-WebUI"},
     classifiers=[
         "Development Status :: 5 - Production/Stable",
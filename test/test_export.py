@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+# Author: Nianze A. TAO (omozawa SUENO)
+"""
+Each request should own its result file.
+"""
+import os
+import time
+import pytest
+import pandas as pd
+from chembfn_webui.lib.export import ResultWriter, prune_results
+from chembfn_webui.lib.postprocess import build_records
+
+METADATA = {"model": "m", "lora": ["a", "b"], "step": 100, "sorted": False}
+
+
+def _records(*smiles):
+    return build_records(list(smiles), [0.5] * len(smiles), "SMILES & SAFE")
+
+
+def _tagged(records, **tags):
+    return [i._replace(tags=tags) for i in records]
+
+
+def test_result_writer(tmp_path):
+    w1, w2 = ResultWriter(tmp_path), ResultWriter(tmp_path)
+    assert w1.path != w2.path
+    w1.append(_records("CCO", "CCN"))
+    w1.append([])
+    w1.append(_records("c1ccccc1"))
+    w2.write(_records("C", "CC"))
+    w2.write(_records("CC", "C", "CCC"))
+    w1.close()
+    w1.wait()
+    w2.wait()
+    assert w1.done and w2.done
+    assert w1.path.read_text() == "CCO\nCCN\nc1ccccc1"
+    assert w2.path.read_text() == "CC\nC\nCCC"
+
+
+def test_csv_gz(tmp_path):
+    w = ResultWriter(tmp_path, "csv.gz", METADATA)
+    w.append(_records("OCC", "C1CC"))
+    w.append(_records("C#N"))
+    w.close()
+    w.wait()
+    df = pd.read_csv(w.path, keep_default_na=False)
+    assert df["molecule"].tolist() == ["OCC", "C1CC", "C#N"]
+    assert df["smiles"].tolist() == ["CCO", "", "C#N"]
+    assert df["valid"].tolist() == [True, False, True]
+    assert (df["step"] == 100).all() and (df["lora"] == '["a", "b"]').all()
+    w = ResultWriter(tmp_path, "csv.gz", METADATA | {"scaffold": ""})
+    records = _tagged(_records("CCO"), scaffold="CC")
+    records += _tagged(_records("c1ccccc1", "Cc1ccccc1"), scaffold="c1ccccc1")
+    w.append(records[:1])
+    w.append(records[1:])
+    w.close()
+    w.wait()
+    df = pd.read_csv(w.path, keep_default_na=False)
+    assert df["scaffold"].tolist() == ["CC", "c1ccccc1", "c1ccccc1"]
+    assert (df["model"] == "m").all()
+    # the tags are kept when the file is rewritten (e.g., after sorting)
+    w.write(records[::-1])
+    w.wait()
+    df = pd.read_csv(w.path, keep_default_na=False)
+    assert df["scaffold"].tolist() == ["c1ccccc1", "c1ccccc1", "CC"]
+
+
+def test_parquet(tmp_path):
+    pytest.importorskip("pyarrow")
+    import pyarrow.parquet as pq
+
+    w = ResultWriter(tmp_path, "parquet", METADATA)
+    w.append(_records("OCC"))
+    w.append(_records("CCN", "C#N"))
+    w.wait()
+    assert not w.done
+    w.close()
+    w.wait()
+    assert w.done
+    table = pq.read_table(w.path)
+    assert table.column("smiles").to_pylist() == ["CCO", "CCN", "C#N"]
+    assert table.column("entropy").to_pylist() == [0.5, 0.5, 0.5]
+    assert b"chembfn_webui" in table.schema.metadata
+    w = ResultWriter(tmp_path, "parquet", METADATA)
+    w.write(_records("CC"))
+    w.write(_records("CCC", "CC"))
+    w.close()
+    w.wait()
+    assert pq.read_table(w.path).column("molecule").to_pylist() == ["CCC", "CC"]
+    w = ResultWriter(tmp_path, "parquet", METADATA)
+    w.close()
+    w.wait()
+    assert pq.read_table(w.path).num_rows == 0
+
+
+def test_prune_results(tmp_path):
+    old, new = ResultWriter(tmp_path), ResultWriter(tmp_path)
+    old.wait()
+    new.wait()
+    t = time.time() - 3600 * 25
+    os.utime(old.path.parent, (t, t))
+    prune_results(tmp_path, 24)
+    assert not old.path.exists() and new.path.exists()
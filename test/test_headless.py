@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# Author: Nianze A. TAO (omozawa SUENO)
+"""
+Headless jobs should stream results and resume from checkpoints.
+"""
+import json
+import pytest
+import torch
+from bayesianflow_for_chem import ChemBFN
+from bayesianflow_for_chem.data import FASTA_VOCAB_KEYS
+import chembfn_webui.lib.utilities as utilities
+import chembfn_webui.lib.scheduler as scheduler
+from chembfn_webui.lib.headless import load_job, run_job
+
+
+def _fake_generate(jobs, *args, **kargs):
+    # an untrained model mostly samples empty sequences
+    return [([f"MKV{i}" for i in range(n)], [0.1] * n) for _, n in jobs]
+
+
+@pytest.fixture
+def job(tmp_path, monkeypatch):
+    (tmp_path / "model" / "base_model").mkdir(parents=True)
+    model = ChemBFN(len(FASTA_VOCAB_KEYS), 32, 1, 4)
+    torch.save(
+        {"nn": model.state_dict(), "hparam": model.hparam},
+        tmp_path / "model" / "base_model" / "tiny.pt",
+    )
+    monkeypatch.setattr(utilities, "_model_path", tmp_path / "model")
+    monkeypatch.setattr(scheduler, "generate", _fake_generate)
+    with open(fn := tmp_path / "job.json", "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "model": "tiny.pt",
+                "tokeniser": "FASTA",
+                "step": 2,
+                "batch_size": 4,
+                "count": 10,
+                "sequence_length": 8,
+                "output": str(tmp_path / "out.csv"),
+            },
+            f,
+        )
+    return load_job(fn)
+
+
+def test_load_job(tmp_path, job):
+    assert job["method"] == "BFN" and job["count"] == 10
+    with open(fn := tmp_path / "bad_job.json", "w", encoding="utf-8") as f:
+        json.dump({"model": "tiny.pt", "steps": 10}, f)
+    with pytest.raises(ValueError):
+        load_job(fn)
+
+
+def test_run_and_resume(tmp_path, job):
+    state = run_job(job, quiet=True)
+    assert state["n_sampled"] == 10 and state["finished"]
+    lines = (tmp_path / "out.csv").read_text().split("\n")
+    assert len(lines) == state["n_saved"] == 10
+    with pytest.raises(FileExistsError):
+        run_job(job, quiet=True)
+    with pytest.raises(ValueError):
+        run_job(job | {"step": 3}, resume=True, quiet=True)
+    # pretend the job was interrupted after the first chunk
+    ckpt = json.loads((tmp_path / "out.csv.ckpt").read_text())
+    n_kept = 2
+    ckpt |= {"n_sampled": 4, "n_saved": n_kept, "finished": False}
+    (tmp_path / "out.csv.ckpt").write_text(json.dumps(ckpt))
+    state = run_job(job | {"count": 12}, resume=True, quiet=True)
+    assert state["n_sampled"] == 12 and state["finished"]
+    text = (tmp_path / "out.csv").read_text()
+    assert text.split("\n")[:n_kept] == lines[:n_kept]
+    assert len(text.split("\n")) == state["n_saved"] == 10
+
+
+def test_resume_csv_gz(tmp_path, job):
+    import pandas as pd
+
+    job["output"] = str(tmp_path / "out.csv.gz")
+    state = run_job(job, quiet=True)
+    ckpt = json.loads((tmp_path / "out.csv.gz.ckpt").read_text())
+    ckpt |= {"n_sampled": 4, "n_saved": 1, "finished": False}
+    (tmp_path / "out.csv.gz.ckpt").write_text(json.dumps(ckpt))
+    first = pd.read_csv(tmp_path / "out.csv.gz", keep_default_na=False)
+    state = run_job(job, resume=True, quiet=True)
+    df = pd.read_csv(tmp_path / "out.csv.gz", keep_default_na=False)
+    assert len(df) == state["n_saved"] == 7 and (df["tokeniser"] == "FASTA").all()
+    assert df["molecule"].tolist()[:2] == [first["molecule"][0], "MKV0"]
+
+
+def test_target(tmp_path, job):
+    state = run_job(job | {"target": 5, "count": 100}, quiet=True)
+    assert state["finished"] and state["n_saved"] == 5
+    # the last chunk is sized by the rate of valid samples instead of the batch size
+    assert state["n_sampled"] == 6
+    assert len((tmp_path / "out.csv").read_text().split("\n")) == 5
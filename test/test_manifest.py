@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+# Author: Nianze A. TAO (omozawa SUENO)
+"""
+The model index should only read the changed parts of the model folder.
+"""
+import os
+import json
+from chembfn_webui.lib.structs import create_model_dir
+from chembfn_webui.lib.manifest import ModelIndex
+
+
+def _add_model(folder, name, weight_name, label=None, lmax=125):
+    folder.mkdir()
+    (folder / weight_name).touch()
+    config = {"name": name, "label": label or [], "padding_length": lmax}
+    with open(folder / "config.json", "w", encoding="utf-8") as f:
+        json.dump(config, f)
+
+
+def _touch(path, ns):
+    os.utime(path, ns=(ns, ns))
+
+
+def test_model_index(tmp_path):
+    create_model_dir(tmp_path)
+    model_dir = tmp_path / "model"
+    (model_dir / "base_model" / "zinc.pt").touch()
+    (model_dir / "vocab" / "moses.txt").touch()
+    _add_model(model_dir / "lora" / "a", "lora_a", "lora.pt", ["logP"], 90)
+    _add_model(model_dir / "standalone_model" / "b", "model_b", "model.pt")
+    (model_dir / "lora" / "broken").mkdir()  # no weights
+    index = ModelIndex(model_dir)
+    models = index.models()
+    assert models["base"] == [["zinc.pt", str(model_dir / "base_model" / "zinc.pt")]]
+    assert models["lora"] == [["lora_a", model_dir / "lora" / "a", ["logP"], 90]]
+    assert models["standalone"] == [
+        ["model_b", model_dir / "standalone_model" / "b", [], 125]
+    ]
+    assert index.vocabs() == {"moses": str(model_dir / "vocab" / "moses.txt")}
+    assert (model_dir / ".manifest.json").exists()
+    # an unchanged config is not read again
+    config_fn = model_dir / "lora" / "a" / "config.json"
+    stat = os.stat(config_fn)
+    with open(config_fn, "w", encoding="utf-8") as f:
+        json.dump({"name": "renamed", "label": [], "padding_length": 90}, f)
+    _touch(config_fn, stat.st_mtime_ns)
+    assert ModelIndex(model_dir).models()["lora"][0][0] == "lora_a"
+    # a changed config is read again
+    _touch(config_fn, stat.st_mtime_ns + 10**9)
+    assert ModelIndex(model_dir).models()["lora"][0][0] == "renamed"
+    # removed models are dropped
+    for i in ("lora.pt", "config.json"):
+        os.remove(model_dir / "lora" / "a" / i)
+    os.rmdir(model_dir / "lora" / "a")
+    os.remove(model_dir / "base_model" / "zinc.pt")
+    models = index.models()
+    assert models["lora"] == [] and models["base"] == []
+    assert len(models["standalone"]) == 1
+
+
+def test_missing_folder(tmp_path):
+    index = ModelIndex(tmp_path / "nowhere")
+    assert index.models() == {"base": [], "standalone": [], "lora": []}
+    assert index.vocabs() == {}
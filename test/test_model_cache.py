@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+# Author: Nianze A. TAO (omozawa SUENO)
+"""
+Resident models should be reused until they are evicted or modified.
+"""
+import os
+import torch
+from bayesianflow_for_chem import ChemBFN
+from chembfn_webui.lib.cache import ModelCache, model_cache, model_size, load_model
+
+
+def _save_model(fn, channel=32):
+    model = ChemBFN(10, channel, 1, 4)
+    torch.save({"nn": model.state_dict(), "hparam": model.hparam}, fn)
+    return model
+
+
+def test_reuse(tmp_path):
+    _save_model(fn := tmp_path / "model.pt")
+    model_cache.clear()
+    m1 = load_model(fn)
+    m2 = load_model(fn, sar_flag=True)
+    m3 = load_model(fn, jited=True)
+    m4 = load_model(fn, jited=True)
+    assert m1.embedding.weight is m2.embedding.weight
+    assert not m1.semi_autoregressive and m2.semi_autoregressive
+    assert m3 is m4
+    assert m1.embedding.weight is not m3.embedding.weight
+    model_cache.clear()
+
+
+def test_invalidation(tmp_path):
+    _save_model(fn := tmp_path / "model.pt")
+    model_cache.clear()
+    m1 = load_model(fn)
+    stat = os.stat(fn)
+    os.utime(fn, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    m2 = load_model(fn)
+    assert m1.embedding.weight is not m2.embedding.weight
+    model_cache.clear()
+
+
+def test_lru_eviction(tmp_path):
+    size = model_size(_save_model(fn1 := tmp_path / "model1.pt"))
+    _save_model(fn2 := tmp_path / "model2.pt")
+    _save_model(fn3 := tmp_path / "model3.pt")
+    cache = ModelCache(2.5 * size / 1024**2)
+    cache.get("1", [fn1], lambda: ChemBFN.from_checkpoint(fn1))
+    cache.get("2", [fn2], lambda: ChemBFN.from_checkpoint(fn2))
+    cache.get("1", [fn1], lambda: ChemBFN.from_checkpoint(fn1))
+    cache.get("3", [fn3], lambda: ChemBFN.from_checkpoint(fn3))
+    assert len(cache) == 2
+    assert "1" in cache and "3" in cache and "2" not in cache
+    assert cache.memory <= 2.5 * size
+    disabled = ModelCache(0)
+    disabled.get("1", [fn1], lambda: ChemBFN.from_checkpoint(fn1))
+    assert len(disabled) == 0
+
+
+def test_saved_quantised_weights(tmp_path, monkeypatch):
+    import chembfn_webui.lib.cache as cache
+
+    def _fake_quantise(model):
+        for module in model.modules():
+            if isinstance(module, torch.nn.Linear) and not module.weight.is_meta:
+                module.weight.data = module.weight.data.half().float()
+
+    monkeypatch.setattr(cache, "quantise_model_", _fake_quantise)
+    monkeypatch.setattr(cache, "_SAVE_QUANTISED", True)
+    _save_model(fn := tmp_path / "model.pt")
+    model_cache.clear()
+    m1 = load_model(fn, quantise=True)
+    assert (tmp_path / "model.pt.int8").exists()
+    model_cache.clear()
+    m2 = cache._load_quantised(fn)
+    assert m2 is not None
+    for (k1, v1), (k2, v2) in zip(m1.state_dict().items(), m2.state_dict().items()):
+        assert k1 == k2 and torch.equal(v1, v2)
+    model_cache.clear()
+
+
+def test_lora_adapters_share_base_weights(tmp_path):
+    from bayesianflow_for_chem.tool import adjust_lora_
+
+    model = _save_model(fn := tmp_path / "model.pt")
+    model.enable_lora(r=4)
+    for name, param in model.named_parameters():
+        if "lora_B" in name:
+            torch.nn.init.normal_(param)
+    lora_nn = {k: v for k, v in model.state_dict().items() if "lora_" in k}
+    torch.save(
+        {"lora_nn": lora_nn, "lora_param": model.lora_param},
+        lora_fn := tmp_path / "lora.pt",
+    )
+    model_cache.clear()
+    m1 = load_model(fn)
+    m2 = load_model(fn, lora_fn, 0.5, True)
+    m3 = load_model(fn, lora_fn, 1.0)
+    assert not m1.lora_enabled and not m1.semi_autoregressive
+    assert m2.lora_enabled and m2.semi_autoregressive
+    assert m1.embedding.weight is m2.embedding.weight is m3.embedding.weight
+    ref = ChemBFN.from_checkpoint(fn, lora_fn).eval()
+    adjust_lora_(ref, 0.5)
+    ref.semi_autoregressive = True
+    m1, m2, m3 = m1.eval(), m2.eval(), m3.eval()
+    x, t = torch.rand(2, 5, 10), torch.rand(2, 1, 1)
+    with torch.no_grad():
+        assert torch.allclose(m2.forward(x, t), ref.forward(x, t), atol=1e-6)
+        assert not torch.allclose(m1.forward(x, t), m3.forward(x, t))
+    model_cache.clear()
+
+
+def test_mapped_weights(tmp_path, monkeypatch):
+    import chembfn_webui.lib.cache as cache
+
+    monkeypatch.setattr(cache, "_MMAP_WEIGHTS", True)
+    mapped = []
+    load_mapped = cache._load_mapped
+    monkeypatch.setattr(
+        cache,
+        "_load_mapped",
+        lambda *args: mapped.append(load_mapped(*args)) or mapped[-1],
+    )
+    ref = _save_model(fn := tmp_path / "model.pt").eval()
+    model_cache.clear()
+    m1 = load_model(fn).eval()
+    # the model is loaded through the mapped path instead of falling back
+    assert len(mapped) == 1 and mapped[0] is not None
+    x, t = torch.rand(2, 5, 10), torch.rand(2, 1, 1)
+    with torch.no_grad():
+        assert torch.equal(m1.forward(x, t), ref.forward(x, t))
+    # legacy checkpoints are converted once
+    state = {"nn": ref.state_dict(), "hparam": ref.hparam}
+    torch.save(
+        state, fn := tmp_path / "legacy.pt", _use_new_zipfile_serialization=False
+    )
+    m2 = cache._load_mapped(fn)
+    assert m2 is not None and (tmp_path / "legacy.pt.mmap").exists()
+    for (k1, v1), (k2, v2) in zip(ref.state_dict().items(), m2.state_dict().items()):
+        assert k1 == k2 and torch.equal(v1, v2)
+    model_cache.clear()
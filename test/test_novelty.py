@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+# Author: Nianze A. TAO (omozawa SUENO)
+"""
+Repeated molecules should be dropped within a run and across runs.
+"""
+from chembfn_webui.lib.postprocess import build_records
+from chembfn_webui.lib.novelty import NoveltyIndex, record_key, deduplicate
+
+
+def _records(*smiles):
+    return build_records(list(smiles), [0.5] * len(smiles), "SMILES & SAFE")
+
+
+def test_record_key():
+    a, b = _records("OCC", "C(C)O")
+    assert record_key(a) == record_key(b) == "CCO"
+    assert record_key(a, "inchikey") == "LFQSCWFLJHTTHZ-UHFFFAOYSA-N"
+    [c] = build_records(["MKV"], [0.5], "FASTA")
+    assert record_key(c) == record_key(c, "inchikey") == "MKV"
+
+
+def test_novelty_index(tmp_path):
+    index = NoveltyIndex(tmp_path / "index.txt")
+    assert index.update(["CCO", "CN", "CCO"]) == [True, True, False]
+    assert index.update(["CN", "C"]) == [False, True]
+    assert len(index) == 3 and "CN" in index
+    index = NoveltyIndex(tmp_path / "index.txt")
+    assert len(index) == 3 and index.update(["C", "CC"]) == [False, True]
+
+
+def test_deduplicate():
+    run, session = NoveltyIndex(), NoveltyIndex()
+    session.update(["CCN"])
+    records = _records("OCC", "C(C)O", "NCC", "c1ccccc1")
+    assert [i.smiles for i in deduplicate(records, [run])] == ["CCO", "CCN", "c1ccccc1"]
+    assert deduplicate(records, [run]) == []
+    records = _records("CCO", "CCN", "CC")
+    assert [i.smiles for i in deduplicate(records, [NoveltyIndex(), session])] == [
+        "CCO",
+        "CC",
+    ]
+    assert "CC" in session and "CCO" in session
+    # molecules dropped by one index are not added to the others
+    run = NoveltyIndex()
+    assert deduplicate(_records("CCN"), [run, session]) == []
+    assert "CCN" not in run and len(run) == 0
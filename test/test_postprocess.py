@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+# Author: Nianze A. TAO (omozawa SUENO)
+"""
+Generated molecules should be parsed and drawn only once.
+"""
+import os
+import threading
+from chembfn_webui.lib.postprocess import (
+    Renderer,
+    ChemfigConverter,
+    build_records,
+    canonical_smiles,
+)
+
+
+def test_canonical_smiles():
+    assert canonical_smiles("OCC") == canonical_smiles("C(C)O") == "CCO"
+    assert canonical_smiles("C1CC") is None
+
+
+def test_records():
+    records = build_records(["OCC", "C1CC", ""], [0.1, 0.2, 0.3], "SMILES & SAFE")
+    assert [i.valid for i in records] == [True, False, False]
+    assert records[0].smiles == "CCO" and records[0].mol is not None
+    assert records[0].entropy == 0.1
+    records = build_records(["[C][C][O]", ""], [0.1, 0.2], "SELFIES")
+    assert [i.valid for i in records] == [True, False]
+    assert records[0].smiles == "CCO"
+    records = build_records(["MKV"], [0.1], "FASTA")
+    assert records[0].valid and records[0].mol is None and records[0].smiles is None
+
+
+def test_image_cache(tmp_path):
+    renderer = Renderer(tmp_path, workers=0)
+    records = build_records(["CCO", "c1ccccc1", "OCC"], [0, 0, 0], "SMILES & SAFE")
+    imgs = renderer.render(records)
+    assert imgs[0] == imgs[2] and imgs[0] != imgs[1]
+    assert all(os.path.exists(i) for i in imgs)
+    assert len(list(tmp_path.glob("*.png"))) == 2
+    mtime = os.path.getmtime(imgs[0])
+    os.utime(imgs[0], (mtime - 100, mtime - 100))
+    assert renderer.render(records[:1]) == imgs[:1]
+    assert os.path.getmtime(imgs[0]) == mtime - 100
+
+
+def test_pruning(tmp_path):
+    renderer = Renderer(tmp_path, max_images=2, workers=0)
+    renderer.render(build_records(["C", "CC"], [0, 0], "SMILES & SAFE"))
+    renderer.render(build_records(["CCC"], [0], "SMILES & SAFE"))
+    assert len(list(tmp_path.glob("*.png"))) <= 2
+
+
+def test_chemfig_cache(tmp_path):
+    converter = ChemfigConverter(tmp_path / "chemfig.jsonl", workers=1, timeout=1e-6)
+    assert dict(converter.convert(["CCO", "CN"])) == {"CCO": "", "CN": ""}
+    converter.timeout = 60
+    codes = dict(converter.convert(["CCO", "CN", "CCO"]))
+    converter.shutdown()
+    assert len(codes) == 2 and all(i.startswith("\\chemfig") for i in codes.values())
+    converter = ChemfigConverter(tmp_path / "chemfig.jsonl", workers=1)
+    assert dict(converter.convert(["CN", "CCO"])) == codes
+    assert converter._pool is None
+
+
+def test_chemfig_deadline(tmp_path):
+    # the time limit starts when a worker starts a molecule,
+    # not while the workers are starting or busy with other requests
+    converter = ChemfigConverter(tmp_path / "chemfig.jsonl", workers=1, timeout=0.25)
+    smiles = ["C" * i for i in range(1, 21)]
+    codes = [{}, {}]
+
+    def _request(idx):
+        codes[idx] = dict(converter.convert(smiles[idx::2]))
+
+    threads = [threading.Thread(target=_request, args=(i,)) for i in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    converter.shutdown()
+    assert sum(len(i) for i in codes) == 20
+    assert all(j.startswith("\\chemfig") for i in codes for j in i.values())
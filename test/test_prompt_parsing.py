@@ -8,6 +8,10 @@ from chembfn_webui.lib.utilities import (
     parse_prompt,
     parse_exclude_token,
     parse_sar_control,
+    parse_length_buckets,
+    parse_input_list,
+    parse_objective_sweep,
+    parse_guidance_sweep,
 )
 
 
@@ -80,3 +84,77 @@ def test_parse_sar_flag(input_value, expected):
 )
 def test_parse_prompt(input_value, expected):
     assert parse_prompt(input_value) == expected
+
+
+@pytest.mark.parametrize(
+    "input_value,expected",
+    [
+        (None, []),
+        ("", []),
+        (" Auto ", "auto"),
+        ("64, 32,32", [32, 64]),
+        ("32,x", []),
+    ],
+)
+def test_parse_length_buckets(input_value, expected):
+    assert parse_length_buckets(input_value) == expected
+
+
+def test_parse_input_list(tmp_path):
+    assert parse_input_list(None) == []
+    assert parse_input_list(" c1ccccc1 \n\nC1CCCCC1\n") == ["c1ccccc1", "C1CCCCC1"]
+    fn = tmp_path / "scaffolds.csv"
+    fn.write_text("SMILES,name\nc1ccncc1,pyridine\n\nC1CCNCC1,piperidine\n")
+    assert parse_input_list("CCO", str(fn)) == ["CCO", "c1ccncc1", "C1CCNCC1"]
+    fn = tmp_path / "scaffolds.smi"
+    fn.write_text("c1ccncc1 pyridine\n\nC1CCNCC1\n")
+    assert parse_input_list("", str(fn)) == ["c1ccncc1", "C1CCNCC1"]
+
+
+def test_parse_objective_sweep(tmp_path):
+    assert parse_objective_sweep("[1,2]") == ("[1,2]", [])
+    prompt, conditions = parse_objective_sweep("<a:0.5>:[0~1~3,2];<b>:[1|2]")
+    assert prompt == "<a:0.5>:[0.0,2.0];<b>:[1.0]"
+    assert conditions == [
+        [[0.0, 2.0], [1.0]],
+        [[0.0, 2.0], [2.0]],
+        [[0.5, 2.0], [1.0]],
+        [[0.5, 2.0], [2.0]],
+        [[1.0, 2.0], [1.0]],
+        [[1.0, 2.0], [2.0]],
+    ]
+    fn = tmp_path / "objectives.csv"
+    fn.write_text("a,b,c\n1,2,3\n\n4,5,6\n")
+    assert parse_objective_sweep("", str(fn)) == ("", [[[1, 2, 3]], [[4, 5, 6]]])
+    prompt, conditions = parse_objective_sweep("<a>:[0,0];<b>:[0|1]", str(fn))
+    assert conditions == [[[1, 2], [3]], [[4, 5], [6]]]
+    with pytest.raises(ValueError):
+        parse_objective_sweep("[0,0]", str(fn))
+
+
+@pytest.mark.parametrize(
+    "input_value,expected",
+    [
+        (None, []),
+        ("", []),
+        ("2, 4|8,4", [2.0, 4.0, 8.0]),
+        ("2~8~4", [2.0, 4.0, 6.0, 8.0]),
+        ("2,x", []),
+    ],
+)
+def test_parse_guidance_sweep(input_value, expected):
+    assert parse_guidance_sweep(input_value) == expected
+
+
+def test_sweep_size(tmp_path):
+    with pytest.raises(ValueError, match="at most 1000"):
+        parse_objective_sweep("[0~1~1000,0~1~1000]")
+    with pytest.raises(ValueError, match="at most 1000"):
+        parse_objective_sweep("[0~1~1000000,1]")
+    assert len(parse_objective_sweep("[0~1~10,0~1~100]")[1]) == 1000
+    fn = tmp_path / "objectives.csv"
+    fn.write_text("\n".join(["1,2"] * 1001))
+    with pytest.raises(ValueError, match="1001 conditions"):
+        parse_objective_sweep("", str(fn))
+    with pytest.raises(ValueError, match="at most 1000"):
+        parse_guidance_sweep("0~8~1001")
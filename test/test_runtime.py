@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Author: Nianze A. TAO (omozawa SUENO)
+"""
+Concurrent requests should share the CPU threads.
+"""
+import threading
+import torch
+from chembfn_webui.lib.runtime import configure_torch, thread_budget
+
+
+def test_thread_budget():
+    assert thread_budget(4, 16) == 4
+    assert thread_budget(3, 16) == 5
+    assert thread_budget(8, 4) == 1
+    assert thread_budget(0, 4) == 4
+
+
+def test_configure_torch():
+    n = torch.get_num_threads()
+    seen = []
+    barrier = threading.Barrier(2)
+
+    def _request():
+        barrier.wait()
+        seen.append(torch.get_num_threads())
+
+    try:
+        configure_torch(thread_budget(2, 4))
+        # the budget is process-wide, so that all (overlapping) requests use it
+        threads = [threading.Thread(target=_request) for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert seen == [2, 2] and torch.get_num_threads() == 2
+        configure_torch()
+        assert torch.get_num_threads() == 2
+    finally:
+        configure_torch(n)
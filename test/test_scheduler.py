@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+# Author: Nianze A. TAO (omozawa SUENO)
+"""
+Concurrent compatible requests should be run in one batch and get their own share back.
+"""
+import threading
+import torch
+from chembfn_webui.lib.scheduler import (
+    MicroBatcher,
+    LengthStats,
+    run_model,
+    generate,
+    _split,
+    estimate_sample_size,
+    next_round_size,
+    plan_chunks,
+)
+
+
+def _submit_all(batcher, jobs):
+    calls, results = [], {}
+
+    def _runner(group):
+        calls.append(list(group))
+        return [[job] * size for job, size in group]
+
+    def _worker(key, job, size):
+        results[job] = batcher.submit(key, (job, size), size, _runner)
+
+    threads = [threading.Thread(target=_worker, args=i) for i in jobs]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return calls, results
+
+
+def test_batching():
+    batcher = MicroBatcher(window=0.5, max_batch_size=512)
+    jobs = [("a", "job1", 2), ("a", "job2", 3), ("b", "job3", 1)]
+    calls, results = _submit_all(batcher, jobs)
+    assert len(calls) == 2
+    assert sorted(len(i) for i in calls) == [1, 2]
+    assert results == {"job1": ["job1"] * 2, "job2": ["job2"] * 3, "job3": ["job3"]}
+
+
+def test_max_batch_size():
+    batcher = MicroBatcher(window=0.5, max_batch_size=4)
+    jobs = [("a", "job1", 3), ("a", "job2", 3)]
+    calls, results = _submit_all(batcher, jobs)
+    assert len(calls) == 2
+    assert results == {"job1": ["job1"] * 3, "job2": ["job2"] * 3}
+
+
+def test_error():
+    batcher = MicroBatcher()
+
+    def _runner(_):
+        raise ValueError("oops")
+
+    try:
+        batcher.submit("a", None, 1, _runner)
+    except ValueError as error:
+        assert str(error) == "oops"
+    else:
+        assert False
+
+
+def test_split():
+    results = [(i, float(key)) for key, i in enumerate("abcdef")]
+    assert _split(results, [2, 4], False) == [
+        (["a", "b"], [0.0, 1.0]),
+        (["c", "d", "e", "f"], [2.0, 3.0, 4.0, 5.0]),
+    ]
+    assert _split(results, [2, 4], True) == [
+        (["a", "c"], [0.0, 2.0]),
+        (["b", "d", "e", "f"], [1.0, 3.0, 4.0, 5.0]),
+    ]
+
+
+def test_estimate_sample_size():
+    assert estimate_sample_size(30, 70, 100) == 48
+    assert estimate_sample_size(30, 70, 100, margin=1) == 43
+    assert estimate_sample_size(30, 0, 100) == 0
+    assert estimate_sample_size(0, 70, 100) == 0
+
+
+def test_next_round_size():
+    assert next_round_size(30, 70, 100, 50) == 48
+    assert next_round_size(30, 0, 100, 50) == 100
+    assert next_round_size(0, 70, 100, 50) == 0
+
+
+def test_plan_chunks():
+    # the first chunk is always invalid; then every 4th sample is found
+    found, sizes = [0], []
+    for chunk in plan_chunks(10, 5, lambda: found[0], 1000):
+        if sizes:
+            found[0] += chunk // 4
+        sizes.append(chunk)
+    assert sizes == [10, 10, 10, 9]
+    # nothing is ever found: give up after 3 rounds of growing size
+    sizes = list(plan_chunks(10, 5, lambda: 0, 1000))
+    assert sizes == [10] * 7
+    sizes = list(plan_chunks(10, 5, lambda: 0, 1000, max_empty_rounds=1))
+    assert sizes == [10]
+    # the sample limit and the chunk size are kept
+    assert list(plan_chunks(10, 5, lambda: 0, 25, 4)) == [4, 4, 2, 4, 4, 4, 3]
+    # without a target, one batch is generated
+    assert list(plan_chunks(10, 0, lambda: 0, 1000, 4)) == [4, 4, 2]
+
+
+class _FakeModel(torch.nn.Module):
+    # every other sample needs 12 tokens; the others need 4 tokens when the length is short
+    def __init__(self):
+        super().__init__()
+        self.calls = []
+
+    def sample(self, batch_size, sequence_size, y, *args):
+        self.calls.append((batch_size, sequence_size))
+        tokens = torch.full((batch_size, sequence_size), 3)
+        tokens[:, 0] = 1
+        if sequence_size < 12:
+            tokens[::2, 3] = 2
+        else:
+            tokens[:, 11] = 2
+        return tokens, torch.full((batch_size,), float(sequence_size))
+
+
+class _ReversedModel(_FakeModel):
+    # longer samples have lower entropy values
+    def sample(self, *args):
+        tokens, entropy = super().sample(*args)
+        return tokens, -entropy
+
+
+def test_length_buckets():
+    vocab_keys = ["<pad>", "<start>", "<end>", "C"]
+    model = _FakeModel()
+    mols, entropy = run_model(
+        model, "sample", (5, 16), 1, None, 1, vocab_keys, "bfn", "all", [8, 32]
+    )
+    assert model.calls == [(5, 8), (2, 16)]
+    assert mols == ["CC"] * 3 + ["C" * 10] * 2 and entropy == [8.0] * 3 + [16.0] * 2
+    model = _FakeModel()
+    run_model(model, "sample", (5, 16), 1, None, 1, vocab_keys, "bfn", "all")
+    assert model.calls == [(5, 16)]
+    # entropy values of different lengths are not sorted against each other
+    model = _ReversedModel()
+    [(mols, entropy)] = generate(
+        [(None, 5)],
+        model,
+        "sample",
+        16,
+        1,
+        None,
+        1,
+        vocab_keys,
+        "bfn",
+        "all",
+        True,
+        buckets=[8],
+    )
+    assert entropy == [-8.0] * 3 + [-16.0] * 2
+
+
+def test_length_stats():
+    stats = LengthStats(size=100, min_count=10)
+    stats.update("a", [10] * 5)
+    assert stats.buckets("a", 100) == []
+    stats.update("a", [10] * 45 + [30] * 40 + [90] * 10)
+    assert stats.buckets("a", 100) == [40]  # the 90% quantile is too long
+    assert stats.buckets("a", 100, (0.4, 0.5)) == [16, 40]
+    assert stats.buckets("b", 100) == []
+
+
+class _ConditionedModel(_FakeModel):
+    def __init__(self):
+        super().__init__()
+        self.y, self.w = [], []
+
+    def sample(self, batch_size, sequence_size, y, sample_step, w, *args):
+        self.y.append(y)
+        self.w.append(w)
+        return super().sample(batch_size, sequence_size, y, sample_step, w, *args)
+
+
+def test_job_conditions():
+    kargs = {
+        "vocab_keys": ["<pad>", "<start>", "<end>", "C"],
+        "method": "bfn",
+        "allowed_tokens": "all",
+        "sort": False,
+    }
+    jobs = [(None, 2), (None, 3)]
+    y = torch.tensor([[0.0], [1.0]])
+    model = _ConditionedModel()
+    results = generate(jobs, model, "sample", 16, 1, y, 1, buckets=[8], **kargs)
+    assert [len(i[0]) for i in results] == [2, 3]
+    # each sample gets the vector of its job and is not sampled again at another length
+    assert model.y[0].flatten().tolist() == [0.0, 0.0, 1.0, 1.0, 1.0]
+    assert model.calls == [(5, 16)]
+    model = _ConditionedModel()
+    generate(jobs, model, "sample", 16, 1, y[:1], 1, **kargs)
+    assert model.y[0].shape == (1, 1)  # shared by all jobs
+    # one guidance strength per job
+    model = _ConditionedModel()
+    generate(jobs, model, "sample", 16, 1, y[:1], [2.0, 4.0], buckets=[8], **kargs)
+    assert model.w[0].flatten().tolist() == [2.0, 2.0, 4.0, 4.0, 4.0]
+    assert model.calls == [(5, 16)]
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+# Author: Nianze A. TAO (omozawa SUENO)
+"""
+Sharded generation should be reproducible with a seed.
+"""
+import json
+import torch
+from bayesianflow_for_chem import ChemBFN, MLP
+from bayesianflow_for_chem.data import FASTA_VOCAB_KEYS
+import chembfn_webui.lib.utilities as utilities
+from chembfn_webui.lib.utilities import find_model, parse_prompt
+from chembfn_webui.lib.pipeline import build_model
+from chembfn_webui.lib.scheduler import generate
+from chembfn_webui.lib.shard import ModelSpec, ShardPool, shard_seed
+
+
+def test_shard_seed():
+    assert shard_seed(0, 1) == shard_seed(0, 1)
+    assert len({shard_seed(0), shard_seed(0, 1), shard_seed(0, 2), shard_seed(1)}) == 4
+
+
+def test_shard_pool(tmp_path, monkeypatch):
+    (tmp_path / "base_model").mkdir()
+    (tmp_path / "standalone_model" / "sa").mkdir(parents=True)
+    torch.manual_seed(0)
+    model = ChemBFN(len(FASTA_VOCAB_KEYS), 32, 1, 4)
+    with torch.no_grad():
+        for p in model.final_layer.parameters():
+            p.normal_(0, 1)  # an untrained model always gives uniform distributions
+    torch.save(
+        {"nn": model.state_dict(), "hparam": model.hparam},
+        tmp_path / "base_model" / "tiny.pt",
+    )
+    # the same model with an MLP turning 2 objective values into conditioning vectors
+    torch.save(
+        {"nn": model.state_dict(), "hparam": model.hparam},
+        tmp_path / "standalone_model" / "sa" / "model.pt",
+    )
+    mlp = MLP([2, 16, 32])
+    torch.save(
+        {"nn": mlp.state_dict(), "hparam": mlp.hparam},
+        tmp_path / "standalone_model" / "sa" / "mlp.pt",
+    )
+    with open(tmp_path / "standalone_model" / "sa" / "config.json", "w") as f:
+        json.dump({"name": "sa", "label": ["a", "b"], "padding_length": 10}, f)
+    monkeypatch.setattr(utilities, "_model_path", tmp_path)
+    models = find_model()
+    spec = ModelSpec("tiny.pt", parse_prompt(""), [False], 10, False, False, models)
+    # one objective vector per job, embedded by the MLP as in the web-UI
+    prompt_info = parse_prompt("[0,1]")
+    prompt_info["objective"] = [[[0.0, 1.0], [1.0, 0.0]]]
+    y_spec = ModelSpec("sa", prompt_info, [False], 10, False, False, models)
+    _, y, _, _ = build_model(*y_spec)
+    assert y.shape == (2, 32)
+    kargs = dict(
+        mode="sample",
+        sequence_size=10,
+        sample_step=5,
+        guidance_strength=1.0,
+        vocab_keys=FASTA_VOCAB_KEYS,
+        method="bfn",
+        allowed_tokens="all",
+        sort=False,
+    )
+    pool = ShardPool(2, threads=1)
+    try:
+        a = pool.generate([(None, 4), (None, 1)], spec, seed=7, **kargs)
+        b = pool.generate([(None, 4), (None, 1)], spec, seed=7, **kargs)
+        c = pool.generate([(None, 4), (None, 1)], spec, seed=8, **kargs)
+        d = pool.generate([(None, 4), (None, 1)], spec, seed=7, y=y, **kargs)
+        w = kargs | {"guidance_strength": [0.0, 8.0]}  # one strength per job
+        e = pool.generate([(None, 4), (None, 1)], spec, seed=7, y=y, **w)
+    finally:
+        pool.shutdown()
+    assert [len(i[0]) for i in a] == [4, 1] and [len(i[1]) for i in a] == [4, 1]
+    assert repr(a) == repr(b) and repr(a) != repr(c)
+    # the first shard is the same as a single process seeded with the shard seed
+    [(_, entropy)] = generate(
+        [(None, 3)], model, y=None, seed=shard_seed(7, 0), **kargs
+    )
+    assert repr(entropy) == repr(a[0][1][:3])
+    # the second shard holds the last sample of the first job and the second job
+    [(_, e0), (_, e1)] = generate(
+        [(None, 1), (None, 1)], model, y=y, seed=shard_seed(7, 1), **kargs
+    )
+    assert repr(e0 + e1) == repr(d[0][1][3:] + d[1][1])
+    assert repr(d) != repr(a)
+    [(_, e0), (_, e1)] = generate(
+        [(None, 1), (None, 1)], model, y=y, seed=shard_seed(7, 1), **w
+    )
+    assert repr(e0 + e1) == repr(e[0][1][3:] + e[1][1])
+    assert repr(e) != repr(d)
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# Author: Nianze A. TAO (omozawa SUENO)
+"""
+Tokenisers should be built once and encode batches into padded tensors.
+"""
+import os
+import pytest
+import torch
+from bayesianflow_for_chem.data import smiles2vec
+from chembfn_webui.lib.tokeniser import TokeniserRegistry, selfies2vec
+from chembfn_webui.lib.pipeline import build_tokeniser, build_input
+
+
+def _write_vocab(fn, keys):
+    with open(fn, "w", encoding="utf-8") as f:
+        f.write("\n".join(keys))
+
+
+def test_selfies_tokeniser(tmp_path):
+    keys = ["<pad>", "<start>", "<end>", "[C]", "[O]", "[unknown]"]
+    _write_vocab(fn := tmp_path / "vocab.txt", keys)
+    registry = TokeniserRegistry()
+    tokeniser = registry.get("SELFIES", fn)
+    assert registry.get("SELFIES", fn) is tokeniser
+    assert tokeniser.vocab_keys == keys and tokeniser.unknown_id == 5
+    assert tokeniser("[C][O][N]") == [3, 4, 5]
+    assert tokeniser("[C][O][N]") == selfies2vec("[C][O][N]", tokeniser.vocab_dict)
+    # a modified vocabulary is loaded again
+    _write_vocab(fn, keys[:3] + ["[O]", "[C]"])
+    stat = os.stat(fn)
+    os.utime(fn, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    tokeniser = registry.get("SELFIES", fn)
+    assert tokeniser("[C][O]") == [4, 3] and tokeniser.unknown_id is None
+    with pytest.raises(ValueError):
+        registry.get("InChI")
+
+
+def test_encode():
+    vocab_keys, tokeniser = build_tokeniser("SMILES & SAFE", None, {})
+    assert build_tokeniser("SMILES & SAFE", None, {})[1] is tokeniser
+    x = tokeniser.encode(["CCO", "c1ccccc1"], 12)
+    assert x.dtype == torch.long and x.shape == (2, 12)
+    assert x[0].tolist() == [1] + smiles2vec("CCO") + [2] + [0] * 7
+    assert x[1, :10].tolist() == [1] + smiles2vec("c1ccccc1") + [2]
+    x = tokeniser.encode(["CCO"], 6, end=False)
+    assert x[0].tolist() == [1] + smiles2vec("CCO") + [0, 0]
+    with pytest.raises(ValueError):
+        tokeniser.encode(["c1ccccc1"], 8)
+    mode, x, _ = build_input("c1ccccc1", "", tokeniser, 16)
+    assert mode == "inpaint" and x.shape == (1, 16) and 2 not in x[0].tolist()
+    mode, x, _ = build_input(["c1ccccc1", " ", "CCO"], "CC", tokeniser, 16)
+    assert mode == "inpaint" and x.shape == (2, 16)
+    assert x[1].tolist() == [1] + smiles2vec("CCO") + [0] * 12
+    mode, x, _ = build_input(None, "CCO", tokeniser, 16)
+    assert mode == "optimise" and x[0, :5].tolist() == [1] + smiles2vec("CCO") + [2]
+    mode, x, _ = build_input("", ["CCO", "c1ccccc1"], tokeniser, 16)
+    assert mode == "optimise" and x.shape == (2, 16)
+    assert x[1, :10].tolist() == [1] + smiles2vec("c1ccccc1") + [2]